@@ -0,0 +1,269 @@
+import abc
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import typing
+from PIL import Image
+
+import param
+import progress
+
+# Pixels of context around every tile, the same as realesrgan-ncnn-vulkan.
+PREPADDING = 10
+# Tile size of the CPU backend when the config leaves the choice to the backend.
+CPU_TILE_SIZE = 200
+
+class Backend(abc.ABC):
+    # Runs one pass of a model. Every backend upscales an image file, or a folder of images,
+    # like the executable does, and a decoded image. Tasks hand decoded images only to
+    # in-memory backends, so that their passes never go through the disk.
+    inMemory = False
+
+    @abc.abstractmethod
+    def describe(self) -> str:
+        ...
+
+    @abc.abstractmethod
+    def getCacheID(self) -> str:
+        # Identifies what produces the results, so that cached results of another backend
+        # or another build of the executable are not reused.
+        ...
+
+    @abc.abstractmethod
+    def runPass(
+        self,
+        inputPath: str, outputPath: str,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        outputFormat: str | None = None,
+        passProgress: progress.PassProgress | None = None,
+    ) -> None:
+        ...
+
+    @abc.abstractmethod
+    def upscaleImage(
+        self,
+        img: Image.Image,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        passProgress: progress.PassProgress | None = None,
+    ) -> Image.Image:
+        ...
+
+class SpawnBackend(Backend):
+    # Starts realesrgan-ncnn-vulkan for every pass.
+    def __init__(self, executable: str) -> None:
+        self.executable = executable
+
+    def describe(self) -> str:
+        return f'executable: {self.executable}'
+
+    def getCacheID(self) -> str:
+        try:
+            st = os.stat(self.executable)
+            return f'spawn:{os.path.abspath(self.executable)}:{st.st_size}:{st.st_mtime_ns}'
+        except OSError:
+            return f'spawn:{os.path.abspath(self.executable)}'
+
+    def getCommand(self) -> tuple[str, ...]:
+        # Scripts such as tools/fake-realesrgan-ncnn-vulkan.py are started by this interpreter,
+        # Windows cannot start them by themselves.
+        return (sys.executable, self.executable) if self.executable.lower().endswith('.py') else (self.executable,)
+
+    def runPass(
+        self,
+        inputPath: str, outputPath: str,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        outputFormat: str | None = None,
+        passProgress: progress.PassProgress | None = None,
+    ) -> None:
+        with subprocess.Popen(
+            (
+                *self.getCommand(),
+                '-v',
+                '-i', inputPath,
+                '-o', outputPath,
+                '-s', str(config.modelFactor),
+                '-t', str(config.tileSize),
+                '-n', config.model,
+                '-g', str(config.gpuID),
+                *(('-f', outputFormat) if outputFormat else ()),
+                ('-x' if config.useTTA else ''),
+            ),
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+        ) as p:
+            try:
+                for line in p.stderr:
+                    outputCallback(line)
+                    if passProgress:
+                        passProgress.feed(line)
+            except BaseException:
+                # Leaving the with block only waits for the executable, e.g. a cancelled job
+                # would hold its worker until the pass is done.
+                p.kill()
+                p.wait()
+                raise
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, p.args)
+        if passProgress:
+            passProgress.finish()
+
+    def upscaleImage(
+        self,
+        img: Image.Image,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        passProgress: progress.PassProgress | None = None,
+    ) -> Image.Image:
+        # The executable only reads files, the image goes through a temporary folder.
+        with tempfile.TemporaryDirectory() as tempDir:
+            inputPath = os.path.join(tempDir, 'input.png')
+            outputPath = os.path.join(tempDir, 'output.png')
+            img.save(inputPath, compress_level=1)
+            self.runPass(inputPath, outputPath, config, outputCallback, 'png', passProgress)
+            with Image.open(outputPath) as result:
+                result.load()
+                return result.copy()
+
+class CPUBackend(Backend):
+    # Runs the ncnn models of the models folder in this process on the CPU. Models stay loaded
+    # between passes and tasks, and images are passed between passes as arrays. Output lines
+    # imitate the executable, so progress and batches are reported the same way.
+    inMemory = True
+
+    def __init__(self, modelDir: str, threads: int = 0) -> None:
+        # Optional dependencies, only needed by this backend.
+        import ncnn
+        import numpy
+        self.ncnn = ncnn
+        self.np = numpy
+        self.modelDir = modelDir
+        self.threads = threads or os.cpu_count() or 1
+        self.nets: dict[str, tuple[typing.Any, str, str]] = {}
+        self.lock = threading.Lock()
+
+    def describe(self) -> str:
+        return f'CPU backend with {self.threads} threads: {self.modelDir}'
+
+    def getCacheID(self) -> str:
+        # The thread count does not change the result.
+        return f'cpu:{os.path.abspath(self.modelDir)}'
+
+    def getNet(self, model: str) -> tuple[typing.Any, str, str]:
+        with self.lock:
+            if model not in self.nets:
+                net = self.ncnn.Net()
+                net.opt.use_vulkan_compute = False
+                net.opt.num_threads = self.threads
+                basePath = os.path.join(self.modelDir, model)
+                if net.load_param(basePath + '.param') or net.load_model(basePath + '.bin'):
+                    raise RuntimeError(f'failed to load model {model} from {self.modelDir}')
+                self.nets[model] = (net, (net.input_names() or ['data'])[0], (net.output_names() or ['output'])[0])
+            return self.nets[model]
+
+    def runPass(
+        self,
+        inputPath: str, outputPath: str,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        outputFormat: str | None = None,
+        passProgress: progress.PassProgress | None = None,
+    ) -> None:
+        if os.path.isdir(inputPath):
+            # Output names keep the name of the input with the extension of the format, as the
+            # executable does.
+            files = [
+                (os.path.join(inputPath, f), os.path.join(outputPath, os.path.splitext(f)[0] + '.' + (outputFormat or 'png')))
+                for f in sorted(os.listdir(inputPath))
+            ]
+        else:
+            files = [(inputPath, outputPath)]
+        for src, dst in files:
+            with Image.open(src) as img:
+                result = self.upscaleImage(img, config, outputCallback, passProgress)
+            saveResult(result, dst)
+            self.report(f'{src} -> {dst} done\n', outputCallback, passProgress)
+        if passProgress:
+            passProgress.finish()
+
+    def upscaleImage(
+        self,
+        img: Image.Image,
+        config: param.REConfigParams,
+        outputCallback: typing.Callable[[str], None],
+        passProgress: progress.PassProgress | None = None,
+    ) -> Image.Image:
+        np = self.np
+        net = self.getNet(config.model)
+        scale = config.modelFactor
+        tileSize = config.tileSize if config.tileSize > 0 else CPU_TILE_SIZE
+        hasAlpha = 'A' in img.mode or 'transparency' in img.info
+        src = img.convert('RGBA' if hasAlpha else 'RGB')
+        w, h = src.size
+        # Tiles read their context from the edge-padded input, channels first, in [0, 1].
+        padded = np.pad(np.asarray(src)[:, :, :3], ((PREPADDING, PREPADDING), (PREPADDING, PREPADDING), (0, 0)), mode='edge')
+        data = padded.transpose(2, 0, 1).astype(np.float32) / 255
+        result = np.empty((h * scale, w * scale, 3), np.uint8)
+        for y in range(0, h, tileSize):
+            th = min(tileSize, h - y)
+            for x in range(0, w, tileSize):
+                tw = min(tileSize, w - x)
+                tile = data[:, y:(y + th + 2 * PREPADDING), x:(x + tw + 2 * PREPADDING)]
+                out = self.runTile(net, tile, config.useTTA)
+                out = out[:, (PREPADDING * scale):((PREPADDING + th) * scale), (PREPADDING * scale):((PREPADDING + tw) * scale)]
+                result[(y * scale):((y + th) * scale), (x * scale):((x + tw) * scale)] = np.clip(out.transpose(1, 2, 0) * 255 + .5, 0, 255)
+            self.report(f'{(y + th) / h * 100:.2f}%\n', outputCallback, passProgress)
+        upscaled = Image.fromarray(result, 'RGB')
+        if hasAlpha:
+            # The alpha channel is interpolated instead of inferred, like the executable does.
+            upscaled.putalpha(src.getchannel('A').resize(upscaled.size, Image.Resampling.BICUBIC))
+        src.close()
+        return upscaled
+
+    def runTile(self, net: tuple[typing.Any, str, str], tile: typing.Any, useTTA: bool) -> typing.Any:
+        if not useTTA:
+            return self.extract(net, tile)
+        # TTA averages the results of the 8 flips and transpositions of the tile.
+        total = 0
+        for k in range(8):
+            t = tile.transpose(0, 2, 1) if k & 4 else tile
+            t = t[:, :, ::-1] if k & 1 else t
+            t = t[:, ::-1, :] if k & 2 else t
+            out = self.extract(net, t)
+            out = out[:, ::-1, :] if k & 2 else out
+            out = out[:, :, ::-1] if k & 1 else out
+            total = total + (out.transpose(0, 2, 1) if k & 4 else out)
+        return total / 8
+
+    def extract(self, net: tuple[typing.Any, str, str], tile: typing.Any) -> typing.Any:
+        model, inputName, outputName = net
+        # The Mat wraps the array without owning it, both must live until the extraction.
+        data = self.np.ascontiguousarray(tile)
+        mat = self.ncnn.Mat(data)
+        ex = model.create_extractor()
+        ex.input(inputName, mat)
+        ret, out = ex.extract(outputName)
+        if ret:
+            raise RuntimeError(f'ncnn extract failed with {ret}')
+        return self.np.array(out)
+
+    @staticmethod
+    def report(line: str, outputCallback: typing.Callable[[str], None], passProgress: progress.PassProgress | None) -> None:
+        outputCallback(line)
+        if passProgress:
+            passProgress.feed(line)
+
+def saveResult(img: Image.Image, path: str) -> None:
+    # The executable writes lossless WebP and the best quality JPEG.
+    match os.path.splitext(path)[1].lower():
+        case '.webp':
+            img.save(path, lossless=True)
+        case '.jpg' | '.jpeg':
+            img.convert('RGB').save(path, quality=100)
+        case _:
+            img.save(path)
@@ -0,0 +1,93 @@
+import collections
+import hashlib
+import os
+import secrets
+import shutil
+import threading
+import typing
+from PIL import Image
+
+import param
+import planner
+
+class ResultCache:
+    def __init__(self, cacheDir: str, maxSize: int) -> None:
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cacheDir, exist_ok=True)
+        # key -> (file name, size), least recently used first
+        self.entries: collections.OrderedDict[str, tuple[str, int]] = collections.OrderedDict()
+        files = []
+        for f in os.listdir(cacheDir):
+            if f.startswith('.'):
+                continue
+            st = os.stat(os.path.join(cacheDir, f))
+            files.append((st.st_mtime, f, st.st_size))
+        for _, f, size in sorted(files):
+            self.entries[os.path.splitext(f)[0]] = (f, size)
+        self.size = sum(x[1] for x in self.entries.values())
+        while self.size > self.maxSize:
+            self.removeEntry(next(iter(self.entries)))
+
+    @staticmethod
+    def getKey(img: Image.Image, config: param.REConfigParams, plan: planner.ScalePlan, backendID: str) -> str:
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        # The downsample filter only matters when the input is shrunk before the first pass.
+        preDownscale = f'{plan.inputSize[0]}x{plan.inputSize[1]}:{int(config.downsample)}' if plan.inputSize != img.size else ''
+        passes = ','.join(f'{m}:{f}' for m, f in plan.passes)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f'{backendID}|{img.mode}|{img.size[0]}x{img.size[1]}|{preDownscale}|{passes}|{config.tileSize}|{config.useTTA}|'.encode())
+        h.update(img.tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str, createPath: typing.Callable[[str], str]) -> str | None:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            name = self.entries[key][0]
+            path = os.path.join(self.cacheDir, name)
+            dstPath = createPath(os.path.splitext(name)[1])
+            try:
+                shutil.copyfile(path, dstPath)
+                os.utime(path)
+            except OSError:
+                self.removeEntry(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dstPath
+
+    def put(self, key: str, srcPath: str) -> None:
+        name = key + os.path.splitext(srcPath)[1].lower()
+        size = os.path.getsize(srcPath)
+        if size > self.maxSize:
+            return
+        # Copy to a hidden temporary name first so that other processes sharing the cache
+        # never see a partially written entry.
+        tempPath = os.path.join(self.cacheDir, f'.{secrets.token_urlsafe(12)}')
+        shutil.copyfile(srcPath, tempPath)
+        with self.lock:
+            if key in self.entries:
+                self.removeEntry(key)
+            os.replace(tempPath, os.path.join(self.cacheDir, name))
+            self.entries[key] = (name, size)
+            self.size += size
+            while self.size > self.maxSize:
+                self.removeEntry(next(iter(self.entries)))
+
+    def removeEntry(self, key: str) -> None:
+        name, size = self.entries.pop(key)
+        self.size -= size
+        try:
+            os.remove(os.path.join(self.cacheDir, name))
+        except FileNotFoundError:
+            pass
+
+    def getSummary(self) -> str:
+        return f'Cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries using {self.size / 1048576:.1f}MiB of {self.maxSize / 1048576:.1f}MiB.\n'
@@ -0,0 +1,70 @@
+import json
+import os
+import re
+import typing
+
+PREFERRED_MODELS = (
+    'realesrgan-x4plus',
+    'realesrgan-x4plus-anime',
+)
+
+# Bumped whenever the cached fields or the rules behind them change.
+CATALOG_VERSION = 1
+
+class ModelInfo(typing.NamedTuple):
+    name: str
+    factor: int
+    # Total size of the .bin and .param files in bytes.
+    size: int
+
+def listModels(modelDir: str) -> list[str]:
+    modelFiles = set(os.listdir(modelDir))
+    models = sorted(
+        x for x in set(os.path.splitext(y)[0] for y in modelFiles)
+        if f'{x}.bin' in modelFiles and f'{x}.param' in modelFiles
+    )
+    for m in PREFERRED_MODELS[::-1]:
+        try:
+            models.insert(0, models.pop(models.index(m)))
+        except ValueError:
+            pass
+    return models
+
+def getModelFactor(model: str) -> int:
+    for i in range(2, 5):
+        if f'x{i}' in model:
+            return i
+    return 4
+
+def getModelFamily(model: str, models: typing.Iterable[str]) -> list[tuple[str, int]]:
+    # Models that only differ by their scale factor, e.g. realesr-animevideov3-x2/x3/x4.
+    family = re.sub(r'x[234]', 'x?', model, count=1)
+    return [(m, getModelFactor(m)) for m in models if m != model and re.sub(r'x[234]', 'x?', m, count=1) == family]
+
+def scanModels(modelDir: str) -> list[ModelInfo]:
+    return [
+        ModelInfo(m, getModelFactor(m), sum(os.path.getsize(os.path.join(modelDir, m + x)) for x in ('.bin', '.param')))
+        for m in listModels(modelDir)
+    ]
+
+def loadCatalog(modelDir: str, cachePath: str) -> list[ModelInfo]:
+    # Adding, removing or renaming a model changes the modification time of the folder, so the
+    # cached catalog is used as long as that stays the same and the folder is scanned otherwise.
+    modelDir = os.path.abspath(modelDir)
+    mtime = os.stat(modelDir).st_mtime_ns
+    try:
+        with open(cachePath, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['version'] == CATALOG_VERSION and cached['modelDir'] == modelDir and cached['mtime'] == mtime:
+            return [ModelInfo(*x) for x in cached['models']]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    models = scanModels(modelDir)
+    try:
+        with open(cachePath + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': CATALOG_VERSION, 'modelDir': modelDir, 'mtime': mtime, 'models': models}, f)
+        os.replace(cachePath + '.tmp', cachePath)
+    except OSError:
+        # A read-only install still works, it only scans the folder every time.
+        pass
+    return models
@@ -0,0 +1,248 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+import typing
+from PIL import Image
+
+import backend
+import cache
+import catalog
+import manifest
+import param
+import preflight
+import progress
+import scratch
+import task
+import tuner
+import watcher
+
+# Seconds between two progress lines.
+PROGRESS_INTERVAL = 1
+
+DOWNSAMPLE = {
+    'lanczos': Image.Resampling.LANCZOS,
+    'bicubic': Image.Resampling.BICUBIC,
+    'hamming': Image.Resampling.HAMMING,
+    'bilinear': Image.Resampling.BILINEAR,
+    'box': Image.Resampling.BOX,
+    'nearest': Image.Resampling.NEAREST,
+}
+
+def parseGPUIDs(s: str) -> tuple[int, ...]:
+    try:
+        gpuIDs = tuple(int(x) for x in s.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid GPU ID list: {s}')
+    if any(x < 0 for x in gpuIDs):
+        raise argparse.ArgumentTypeError(f'invalid GPU ID list: {s}')
+    return gpuIDs
+
+def parseTileSize(s: str) -> int:
+    if s == 'tuned':
+        return param.TUNED_TILE_SIZE
+    try:
+        tileSize = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid tile size: {s}')
+    if tileSize < 0:
+        raise argparse.ArgumentTypeError(f'invalid tile size: {s}')
+    return tileSize
+
+def buildArgumentParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='realesrgan-cli',
+        description='Upscale an image or a folder of images with Real-ESRGAN-ncnn-vulkan without the GUI.',
+    )
+    parser.add_argument('-i', '--input', required=True, help='input image file or folder')
+    parser.add_argument('-o', '--output', help='output image file or folder, required unless tuning tile sizes')
+    parser.add_argument('-n', '--model', default=catalog.PREFERRED_MODELS[0], help='model name (default: %(default)s)')
+    parser.add_argument('--model-factor', type=int, choices=(2, 3, 4), help='scale factor of the model (default: guessed from the model name)')
+    resize = parser.add_mutually_exclusive_group()
+    resize.add_argument('-s', '--scale', type=int, help='resize by a fixed ratio (default: 4)')
+    resize.add_argument('-w', '--width', type=int, help='resize proportionally to this width')
+    resize.add_argument('-H', '--height', type=int, help='resize proportionally to this height')
+    parser.add_argument('-d', '--downsample', choices=DOWNSAMPLE, default='lanczos', help='downsample filter (default: %(default)s)')
+    parser.add_argument('-t', '--tile-size', type=parseTileSize, default=0, help='tile size, 0 for auto, "tuned" for the tuned profile of the model, GPU and image size (default: %(default)s)')
+    parser.add_argument('--tune-tiles', action='store_true', help='benchmark tile sizes with the input image (or the first image of the input folder) on every GPU of -g, save the fastest in the tile profiles and exit')
+    parser.add_argument('--tile-profiles', default=os.path.join(task.APP_PATH, 'tile-profiles.json'), help='file of the tuned tile sizes (default: next to this program)')
+    parser.add_argument('-g', '--gpu-id', type=parseGPUIDs, default=(0,), help='GPU devices to use, one worker per entry, e.g. 0,0,1 runs two workers on GPU 0 and one on GPU 1 (default: 0)')
+    parser.add_argument('-x', '--tta', action='store_true', help='enable TTA mode')
+    parser.add_argument('--merge-gif-frames', action='store_true', help='merge consecutive identical GIF frames into one frame with their durations added up')
+    parser.add_argument('--mix-models', action='store_true', help='mix models of the same family with other scale factors (e.g. realesr-animevideov3-x2/x3/x4) across passes when it needs less work')
+    parser.add_argument('--pre-downscale', action='store_true', help='downscale the input before upscaling when the last pass would otherwise overshoot the target size by a lot')
+    parser.add_argument('--split-size', type=int, default=0, help=f'upscale images larger than this many pixels in overlapping tiles of about this size and stitch them without loading the whole upscaled image, 0 to disable, at least {4 * task.TILE_OVERLAP} (default: %(default)s, {task.DEFAULT_SPLIT_SIZE} is a good start)')
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB', help='only process files in the input folder whose path relative to it matches this pattern, e.g. "*.png" (repeatable)')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB', help='skip files and folders in the input folder whose path relative to it matches this pattern, e.g. "raw/*" (repeatable)')
+    parser.add_argument('--watch', action='store_true', help='keep watching the input folder and process new or modified images once they stop changing, until interrupted with Ctrl+C')
+    parser.add_argument('--settle-seconds', type=float, default=watcher.SETTLE_SECONDS, help='seconds a watched file must stay unchanged before it is processed (default: %(default)s)')
+    parser.add_argument('--preflight', action='store_true', help='probe every input before starting, report the estimated work, scratch and output size, and process the largest images first')
+    parser.add_argument('-b', '--batch-size', type=int, default=0, help='upscale up to this many images with the same settings in one run of the executable, 0 to run it once per image (default: %(default)s)')
+    parser.add_argument('--cache-dir', help='reuse upscaled results stored in this folder, keyed by image content and settings')
+    parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of the result cache in MiB, least recently used results are evicted first (default: %(default)s)')
+    parser.add_argument('--scratch-dir', help='folder for intermediate files, e.g. a tmpfs mount (default: $REALESRGAN_SCRATCH_DIR or the system temp folder)')
+    parser.add_argument('--scratch-budget', type=int, default=0, help='pause starting new tasks while intermediate files use more than this many MiB, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--incremental', action='store_true', help='record finished inputs in a manifest inside the output folder and skip inputs that are unchanged since they were finished, partially upscaled GIFs are resumed')
+    parser.add_argument('-e', '--executable', default=task.RE_EXECUTABLE, help='path of realesrgan-ncnn-vulkan, the models are read from the models folder next to it (default: next to this program)')
+    parser.add_argument('--backend', choices=('vulkan', 'cpu'), default='vulkan', help='run realesrgan-ncnn-vulkan, or run the models in this process on the CPU with the ncnn and numpy packages, -g then only sets the number of workers (default: %(default)s)')
+    parser.add_argument('--cpu-threads', type=int, default=0, help='threads of the CPU backend, 0 for all cores (default: %(default)s)')
+    parser.add_argument('--progress', action='store_true', help='print the progress of the whole queue with an estimated time left, also with --quiet')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print task summaries and errors')
+    return parser
+
+def getConfigParams(args: argparse.Namespace, planModels: tuple[tuple[str, int], ...] = ()) -> param.REConfigParams:
+    if args.width is not None:
+        resizeMode, resizeModeValue = param.ResizeMode.WIDTH, args.width
+    elif args.height is not None:
+        resizeMode, resizeModeValue = param.ResizeMode.HEIGHT, args.height
+    else:
+        resizeMode, resizeModeValue = param.ResizeMode.RATIO, 4 if args.scale is None else args.scale
+    return param.REConfigParams(
+        args.model,
+        args.model_factor or catalog.getModelFactor(args.model),
+        resizeMode,
+        resizeModeValue,
+        DOWNSAMPLE[args.downsample],
+        args.tile_size,
+        args.gpu_id[0],
+        args.tta,
+        args.merge_gif_frames,
+        planModels,
+        args.pre_downscale,
+        args.split_size,
+    )
+
+def main(argv: list[str] | None = None) -> int:
+    parser = buildArgumentParser()
+    args = parser.parse_args(argv)
+
+    inputPath = os.path.abspath(args.input)
+    if not os.path.exists(inputPath):
+        parser.error(f'input does not exist: {inputPath}')
+    if not args.output and not args.tune_tiles:
+        parser.error('the following arguments are required: -o/--output')
+    outputPath = os.path.abspath(args.output or '.')
+    if args.watch and not os.path.isdir(inputPath):
+        parser.error('--watch needs an input folder')
+    if args.watch and args.preflight:
+        parser.error('--watch cannot be combined with --preflight')
+    if args.split_size and args.split_size < 4 * task.TILE_OVERLAP:
+        parser.error(f'split size must be 0 or at least {4 * task.TILE_OVERLAP}')
+    if args.backend == 'vulkan' and not os.path.exists(args.executable):
+        parser.error(f'executable does not exist: {args.executable}')
+    modelDir = os.path.join(os.path.dirname(os.path.realpath(args.executable)), 'models')
+    if os.path.isdir(modelDir) and args.model not in catalog.listModels(modelDir):
+        parser.error(f'model not found in {modelDir}: {args.model}')
+    if args.backend == 'cpu':
+        try:
+            task.inferenceBackend = backend.CPUBackend(modelDir, args.cpu_threads)
+        except ImportError as ex:
+            parser.error(f'the CPU backend needs the ncnn and numpy packages: {ex}')
+    else:
+        task.RE_EXECUTABLE = os.path.realpath(args.executable)
+        task.inferenceBackend = backend.SpawnBackend(task.RE_EXECUTABLE)
+    if args.scratch_dir or args.scratch_budget:
+        task.scratchSpace = scratch.ScratchSpace(args.scratch_dir or task.scratchSpace.root, args.scratch_budget * 1048576)
+
+    def writeToOutput(s: str):
+        if not args.quiet:
+            sys.stderr.write(s)
+
+    def writeSummary(s: str):
+        sys.stderr.write(s)
+
+    lastProgress = 0.
+    def writeProgress(event: progress.ProgressEvent):
+        nonlocal lastProgress
+        now = time.perf_counter()
+        if now - lastProgress >= PROGRESS_INTERVAL or event.donePixels >= event.totalPixels:
+            lastProgress = now
+            sys.stderr.write(progress.formatProgress(event))
+
+    planModels = tuple(catalog.getModelFamily(args.model, catalog.listModels(modelDir))) if args.mix_models and os.path.isdir(modelDir) else ()
+    config = getConfigParams(args, planModels)
+    if args.tune_tiles or config.tileSize == param.TUNED_TILE_SIZE:
+        task.tileProfiles = tuner.TileProfiles(args.tile_profiles)
+    if args.tune_tiles:
+        samplePath = inputPath if not os.path.isdir(inputPath) else next((f for f, _ in task.scanDirectory(inputPath, outputPath, args.include, args.exclude)), None)
+        if not samplePath:
+            writeSummary(f'No image files found in {inputPath}\n')
+            return 1
+        # One task per entry of -g, every worker tunes the GPU it runs on.
+        queue = task.TaskQueue(task.TuneTilesTask(writeSummary, samplePath, config, task.tileProfiles) for _ in args.gpu_id)
+        success = task.taskRunner(queue, writeSummary, lambda: None, args.gpu_id)
+        task.scratchSpace.cleanup()
+        return 0 if success else 1
+    resultCache = cache.ResultCache(args.cache_dir, args.cache_size * 1048576) if args.cache_dir else None
+    queue = task.TaskQueue()
+    found = skipped = 0
+    if os.path.isdir(inputPath):
+        jobManifest = manifest.JobManifest(outputPath) if args.incremental else None
+
+        # The folder is walked in another thread, tasks start while it is still being walked.
+        def createTasks() -> typing.Iterator[task.AbstractTask]:
+            nonlocal found, skipped
+            for f, g in task.scanDirectory(inputPath, outputPath, args.include, args.exclude):
+                found += 1
+                if jobManifest and jobManifest.isComplete(f, g, config):
+                    skipped += 1
+                    continue
+                yield task.createTask(writeToOutput, f, g, config, queue, resultCache, jobManifest)
+
+        # With a pre-flight, the whole folder is walked and probed before the first task starts.
+        def scheduleTasks() -> typing.Iterator[task.AbstractTask]:
+            yield from preflight.scheduleTasks(createTasks(), len(args.gpu_id), writeSummary)
+
+        # A watched folder is never finished, every image that settles is queued on its own.
+        def createWatchedTask(f: str, g: str) -> task.AbstractTask | None:
+            nonlocal found, skipped
+            found += 1
+            if jobManifest and jobManifest.isComplete(f, g, config):
+                skipped += 1
+                return None
+            writeSummary(f'Queued {f}\n')
+            return task.createTask(writeToOutput, f, g, config, queue, resultCache, jobManifest)
+
+        queue.openProducer()
+        if args.watch:
+            folderWatcher = watcher.FolderWatcher(inputPath, outputPath, args.include, args.exclude, args.settle_seconds)
+            queue.keepGoing = True
+            # The first Ctrl+C stops watching and lets the queued images finish, the next one
+            # interrupts them.
+            def stopWatching(signum, frame):
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                folderWatcher.stop()
+            signal.signal(signal.SIGINT, stopWatching)
+            threading.Thread(target=folderWatcher.watch, args=(queue, createWatchedTask, writeSummary), daemon=True).start()
+        else:
+            # Batches only save starting the executable, an in-memory backend keeps its models loaded.
+            batchSize = 0 if task.inferenceBackend.inMemory else args.batch_size
+            threading.Thread(target=task.produceTasks, args=(queue, scheduleTasks() if args.preflight else createTasks(), writeSummary, batchSize), daemon=True).start()
+    elif os.path.splitext(inputPath)[1].lower() in task.IMAGE_EXTS:
+        jobManifest = manifest.JobManifest(os.path.dirname(outputPath)) if args.incremental else None
+        if jobManifest and jobManifest.isComplete(inputPath, outputPath, config):
+            writeSummary(f'{outputPath} is already up to date.\n')
+            return 0
+        t = task.createTask(writeToOutput, inputPath, outputPath, config, queue, resultCache, jobManifest)
+        queue.extend(preflight.scheduleTasks((t,), len(args.gpu_id), writeSummary) if args.preflight else (t,))
+        found = 1
+    else:
+        parser.error('only JPEG, PNG, GIF and WebP images are supported')
+
+    success = task.taskRunner(queue, writeSummary, jobManifest.close if jobManifest else lambda: None, args.gpu_id, writeProgress if args.progress else None)
+    if skipped:
+        writeSummary(f'Skipped {skipped} images that are already up to date.\n')
+    elif not found and not args.watch:
+        writeSummary(f'No image files found in {inputPath}\n')
+        success = False
+    task.scratchSpace.cleanup()
+    if args.scratch_dir or args.scratch_budget:
+        writeSummary(task.scratchSpace.getSummary())
+    if resultCache:
+        writeSummary(resultCache.getSummary())
+    return 0 if success else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
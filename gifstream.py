@@ -0,0 +1,93 @@
+import struct
+from PIL import GifImagePlugin, Image
+
+TRANSPARENT_INDEX = 255
+SAMPLE_SIZE = (32, 32)
+MAX_SAMPLES = 1024
+
+class PaletteSampler:
+    # Collects thumbnails of the source frames to build one palette for the whole animation.
+    # Once MAX_SAMPLES thumbnails are held, every other one is dropped and only every other
+    # frame is sampled from then on, so the samples stay spread over the animation.
+    def __init__(self) -> None:
+        self.samples: list[Image.Image] = []
+        self.stride = 1
+        self.count = 0
+
+    def add(self, frame: Image.Image) -> None:
+        if self.count % self.stride == 0:
+            sample = frame.convert('RGB')
+            sample.thumbnail(SAMPLE_SIZE)
+            self.samples.append(sample)
+            if len(self.samples) >= MAX_SAMPLES:
+                del self.samples[1::2]
+                self.stride *= 2
+        self.count += 1
+
+    def getPalette(self) -> Image.Image:
+        montage = Image.new('RGB', (SAMPLE_SIZE[0] * len(self.samples), SAMPLE_SIZE[1]))
+        for i, sample in enumerate(self.samples):
+            montage.paste(sample, (SAMPLE_SIZE[0] * i, 0))
+        # The last palette entry is left for transparent pixels.
+        return montage.quantize(TRANSPARENT_INDEX, Image.Quantize.MEDIANCUT)
+
+class GIFWriter:
+    # Writes an animated GIF one frame at a time. Every frame is mapped to the same global
+    # palette, so nothing but the frame being written is held in memory.
+    def __init__(self, path: str, palette: Image.Image, loop: int = 0) -> None:
+        self.path = path
+        self.palette = palette
+        self.loop = loop
+        self.size: tuple[int, int] | None = None
+        self.frameCount = 0
+        self.file = None
+
+    def open(self, size: tuple[int, int]) -> None:
+        self.size = size
+        paletteBytes = self.palette.palette.tobytes()[:(TRANSPARENT_INDEX * 3)]
+        paletteBytes += bytes(768 - len(paletteBytes))
+        self.file = open(self.path, 'wb')
+        # Header with a 256 colour global colour table, followed by the looping extension.
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0xf7, 0, 0) + paletteBytes)
+        self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\0')
+
+    def writeFrame(self, img: Image.Image, duration: int) -> None:
+        if self.file is None:
+            self.open(img.size)
+        elif img.size != self.size:
+            raise ValueError(f'frame size {img.size[0]}x{img.size[1]} differs from {self.size[0]}x{self.size[1]}')
+        frame = img.convert('RGB').quantize(palette=self.palette, dither=Image.Dither.NONE)
+        params = {'duration': duration, 'disposal': 2}
+        if img.mode == 'RGBA':
+            mask = img.getchannel('A').point(lambda a: 255 if a < 128 else 0)
+            if mask.getbbox():
+                frame.paste(TRANSPARENT_INDEX, mask=mask)
+                params['transparency'] = TRANSPARENT_INDEX
+        for data in GifImagePlugin.getdata(frame, **params):
+            self.file.write(data)
+        self.frameCount += 1
+
+    def close(self) -> None:
+        if self.file:
+            self.file.write(b';')
+            self.file.close()
+
+class GIFFrameReader:
+    # Reads composited frames by index, keeping the GIF open between reads so that frames
+    # read in increasing order are decoded only once.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.img: Image.Image | None = None
+
+    def getFrame(self, index: int) -> Image.Image:
+        if self.img is None:
+            self.img = Image.open(self.path)
+        self.img.seek(index)
+        frame = Image.new('RGBA', self.img.size)
+        frame.paste(self.img)
+        return frame
+
+    def close(self) -> None:
+        if self.img:
+            self.img.close()
+            self.img = None
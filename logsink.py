@@ -0,0 +1,36 @@
+import collections
+import typing
+
+# Lines kept in the output panel, older lines are dropped.
+MAX_LINES = 5000
+# Lines handed to the output panel per drain, so that a flood never blocks the main loop.
+MAX_BATCH = 2000
+
+class LogSink:
+    # Workers write lines from any thread; the main loop drains them in batches. Appending to
+    # and popping from a deque are atomic, so writers never wait for the main loop. Every
+    # drained line is also appended to the spill file if one is open.
+    def __init__(self) -> None:
+        self.pending: collections.deque[str] = collections.deque()
+        self.spill: typing.TextIO | None = None
+
+    def write(self, s: str) -> None:
+        self.pending.append(s)
+
+    def openSpill(self, path: str) -> None:
+        self.closeSpill()
+        self.spill = open(path, 'a', encoding='utf-8')
+
+    def closeSpill(self) -> None:
+        if self.spill:
+            self.spill.close()
+            self.spill = None
+
+    def drain(self, limit: int = MAX_BATCH) -> str:
+        lines = []
+        while self.pending and len(lines) < limit:
+            lines.append(self.pending.popleft())
+        s = ''.join(lines)
+        if self.spill and s:
+            self.spill.write(s)
+        return s
@@ -1,23 +1,32 @@
 # 导入Python标准库和第三方库中定义的模块
-import collections  # 用于处理如列表、字典等集合类型的高级操作
-import darkdetect  # 用于检测当前系统的主题是浅色还是深色，以便于应用程序可以适配
+import time  # 用于时间相关的操作
+# 程序开始运行的时间，启动计时从这里开始算起
+STARTUP_TIME = time.perf_counter()
+import concurrent.futures  # 用于在后台线程中生成预览图
 import os  # 用于处理文件和目录
 import sys  # 用于访问与Python解释器相关的变量和函数
-import time  # 用于时间相关的操作
 import threading  # 用于多线程操作
+import typing  # 用于类型注解
 import tkinter as tk  # 用于创建图形用户界面
-import webbrowser  # 用于在默认浏览器中打开网页
 from PIL import Image  # Python Imaging Library，用于图像处理
-from PIL import ImageTk  # 用于在Tkinter中显示PIL图像
 from tkinter import filedialog  # 用于创建打开文件和保存文件的对话框
 from tkinter import messagebox  # 用于创建消息框
 from tkinter import ttk  # 用于创建主题化的小部件
 from tkinter.scrolledtext import ScrolledText  # 用于创建带有滚动条的文本框
-from tkinterdnd2 import DND_FILES, TkinterDnD  # 用于实现Tkinter的拖放功能
+# darkdetect、webbrowser、PIL.ImageTk 和 tkinterdnd2 只在第一次用到时导入，以加快启动速度
 
 # 导入项目特定的模块
+import cache  # 项目特定的放大结果缓存模块
+import catalog  # 项目特定的模型列表模块
+import logsink  # 项目特定的线程安全日志缓冲模块
+import manifest  # 项目特定的增量处理任务清单模块
 import param  # 项目特定的参数配置模块
+import preflight  # 项目特定的预先检查与调度模块
+import preview  # 项目特定的预览缩略图模块
+import progress  # 项目特定的进度统计模块
 import task  # 项目特定的任务处理模块
+import tuner  # 项目特定的分块大小调优模块
+import watcher  # 项目特定的文件夹监视模块
 
 # 根据是否有_MEIPASS属性来确定基础路径，_MEIPASS通常在使用PyInstaller打包时设置
 BASE_PATH = sys._MEIPASS if hasattr(sys, '_MEIPASS') else ''
@@ -27,32 +36,37 @@ APP_PATH = os.path.dirname(os.path.realpath(sys.executable if hasattr(sys, '_MEI
 # 导入构建时间，这个值在构建应用程序时被设置
 from build_time import BUILD_TIME
 
+# 从启动到显示窗口的时间预算，超出时在启动计时报告中提示
+STARTUP_BUDGET = .5
+# 使用 --startup-timing 启动时，在日志中显示启动各阶段的耗时
+SHOW_STARTUP_TIMING = '--startup-timing' in sys.argv[1:]
+# 启动各阶段的名称和结束时间，第一项是导入模块
+startupMarks: list[tuple[str, float]] = [('imports', time.perf_counter())]
+
+# 记录一个启动阶段的结束时间
+def markStartup(stage: str):
+    startupMarks.append((stage, time.perf_counter()))
+
+# 生成启动计时报告，每个阶段显示结束时距启动的时间和该阶段本身的耗时
+def getStartupReport() -> str:
+    lines = ['Startup timing:\n']
+    last = STARTUP_TIME
+    for stage, t in startupMarks:
+        lines.append(f'    {stage}: {t - STARTUP_TIME:.3f}s (+{t - last:.3f}s)\n')
+        last = t
+    shown = dict(startupMarks)['window shown'] - STARTUP_TIME
+    lines.append(f'Window shown after {shown:.3f}s, {"within" if shown <= STARTUP_BUDGET else "over"} the budget of {STARTUP_BUDGET:.3f}s.\n')
+    return ''.join(lines)
+
 class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
     def __init__(self, parent: tk.Tk):  # 类的初始化方法
         super().__init__(parent)  # 调用父类的初始化方法
-        # 获取模型目录中的文件，并筛选出有效的模型文件
-        modelFiles = set(os.listdir(os.path.join(APP_PATH, 'models')))
-        self.models = sorted(
-            x for x in set(os.path.splitext(y)[0] for y in modelFiles)
-            if f'{x}.bin' in modelFiles and f'{x}.param' in modelFiles
-        )
-        # 将特定的模型插入到模型列表的前面
-        for m in (
-            'realesrgan-x4plus',
-            'realesrgan-x4plus-anime',
-        )[::-1]:
-            try:
-                self.models.insert(0, self.models.pop(self.models.index(m)))
-            except ValueError:
-                pass
+        # 读取模型目录中的有效模型，特定的模型会排在列表的前面
+        # 模型列表缓存在文件中，只有模型目录发生变化时才重新扫描
+        modelInfos = catalog.loadCatalog(os.path.join(APP_PATH, 'models'), os.path.join(APP_PATH, 'model-catalog.json'))
+        self.models = [m.name for m in modelInfos]
         # 创建一个字典来存储每个模型的倍数因子
-        self.modelFactors: dict[str, int] = {}
-        for m in self.models:
-            self.modelFactors[m] = 4
-            for i in range(2, 5):
-                if f'x{i}' in m:
-                    self.modelFactors[m] = i
-                    break
+        self.modelFactors: dict[str, int] = {m.name: m.factor for m in modelInfos}
 
         # 设置下采样方法
         self.downsample = (
@@ -63,13 +77,17 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
             ('Box', Image.Resampling.BOX),
             ('Nearest', Image.Resampling.NEAREST),
         )
-        # 设置分块大小选项
-        self.tileSize = (0, 32, 64, 128, 256, 512, 1024)
+        # 设置分块大小选项，第二项使用调优得到的分块大小
+        self.tileSize = (0, param.TUNED_TILE_SIZE, 32, 64, 128, 256, 512, 1024)
+        # 读取按模型、GPU 和图片大小调优得到的分块大小
+        task.tileProfiles = tuner.TileProfiles(os.path.join(APP_PATH, 'tile-profiles.json'))
 
         # 调用方法来设置应用程序的变量
         self.setupVars()
         # 调用方法来设置应用程序的控件
         self.setupWidgets()
+        # 开始定时将工作线程写入的日志显示到文本框
+        self.pollOutput()
 
     def setupVars(self):
         # 创建Tkinter字符串变量，用于在控件间共享数据
@@ -89,11 +107,47 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 创建Tkinter布尔变量，用于存储是否使用TTA模式和WebP格式
         self.varboolUseTTA = tk.BooleanVar()
         self.varboolUseWebP = tk.BooleanVar()
+        # 创建Tkinter布尔变量，用于存储是否合并GIF中连续的重复帧
+        self.varboolMergeGIFFrames = tk.BooleanVar()
+        # 创建Tkinter布尔变量，用于存储处理文件夹时是否跳过已完成的文件
+        self.varboolIncremental = tk.BooleanVar()
+        # 创建Tkinter布尔变量，用于存储是否混用同系列不同倍率的模型以及是否预先缩小输入
+        self.varboolMixModels = tk.BooleanVar()
+        self.varboolPreDownscale = tk.BooleanVar()
+        # 创建Tkinter布尔变量，用于存储是否分块处理超大图片
+        self.varboolSplitLargeImages = tk.BooleanVar()
+        # 工作线程写入的最新进度事件，由主线程定时读取并显示
+        self.latestProgress: progress.ProgressEvent | None = None
+        self.running = False
+        # 工作线程写入日志的缓冲区，由主线程批量取出显示
+        self.logSink = logsink.LogSink()
+        # 创建Tkinter布尔变量，用于存储是否将完整日志保存到文件
+        self.varboolSaveLog = tk.BooleanVar()
+        # 创建Tkinter字符串变量，用于存储处理文件夹时包含和排除的文件的通配符，多个通配符以分号分隔
+        self.varstrInclude = tk.StringVar()
+        self.varstrExclude = tk.StringVar()
+        # 创建Tkinter布尔变量，用于存储处理文件夹前是否预先检查所有图片
+        self.varboolPreflight = tk.BooleanVar()
+        # 创建Tkinter变量，用于存储放大结果缓存的文件夹（为空时不使用缓存）和大小上限（MiB）
+        self.varstrCacheDir = tk.StringVar()
+        self.varintCacheSize = tk.IntVar(value=1024)
+        # 创建Tkinter布尔变量，用于存储是否持续监视输入文件夹
+        self.varboolWatch = tk.BooleanVar()
+        # 正在监视的文件夹，没有监视时为None
+        self.folderWatcher: watcher.FolderWatcher | None = None
+        # 最近预览过的图片的缩略图，以及在后台生成缩略图的线程
+        self.previewCache = preview.PreviewCache()
+        self.previewExecutor = concurrent.futures.ThreadPoolExecutor(1)
+        # 正在生成的预览图和对应的路径，以及当前显示的预览图
+        self.previewFuture: concurrent.futures.Future | None = None
+        self.previewPath = ''
+        self.previewImage = None
 
     def setupWidgets(self):
         # 配置窗口的行和列，设置权重使窗口可以按比例分配空间
         self.rowconfigure(0, weight=0)
         self.rowconfigure(1, weight=1)
+        self.rowconfigure(2, weight=0)
         self.columnconfigure(0, weight=1)
 
         # 创建一个Notebook控件，用于在不同选项卡间切换
@@ -168,12 +222,10 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 创建一个用于显示图片的Frame
         self.imageDisplayFrame = ttk.Frame(self.frameModel, width=150, height=150)  # 根据需要设置宽度和高度
         self.imageDisplayFrame.pack(side=tk.RIGHT, padx=10, pady=5, fill=tk.BOTH, expand=True)      #紧贴上一个frame,更美观 算了不折腾了 pack和gird
-
-        # 假设您有一个方法用于加载并显示图片
-        # self.load_and_display_preview_image()
-
-        # 绑定下拉菜单的选择事件，当选择改变时调用您的load_and_display_image方法
-        # self.comboModel.bind('<<ComboboxSelected>>', self.load_and_display_preview_image())
+        # 显示预览图的Label，每次预览都重复使用这一个Label；Frame的大小由预览图决定，不随Label变化
+        self.imageDisplayFrame.pack_propagate(False)
+        self.labelPreviewImage = ttk.Label(self.imageDisplayFrame)
+        self.labelPreviewImage.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
         # 创建一个尺寸调整控件的Frame，并将其放置在底部Frame的第0行第0列
         self.frameResize = ttk.Frame(self.frameBasicConfigBottom)
@@ -243,15 +295,36 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         self.spinGPUID.set(0)
         self.spinGPUID.pack(padx=10, pady=5, fill=tk.X)
 
+        # 在高级配置左侧Frame中添加处理文件夹时包含和排除的文件的输入框，通配符匹配相对于输入文件夹的路径
+        ttk.Label(self.frameAdvancedConfigLeft, text='只处理匹配的文件（如 *.png;*.jpg）').pack(padx=10, pady=5, fill=tk.X)
+        self.entryInclude = ttk.Entry(self.frameAdvancedConfigLeft, textvariable=self.varstrInclude)
+        self.entryInclude.pack(padx=10, pady=5, fill=tk.X)
+        ttk.Label(self.frameAdvancedConfigLeft, text='跳过匹配的文件或文件夹（如 raw;*/thumbs）').pack(padx=10, pady=5, fill=tk.X)
+        self.entryExclude = ttk.Entry(self.frameAdvancedConfigLeft, textvariable=self.varstrExclude)
+        self.entryExclude.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置左侧Frame中添加放大结果缓存的设置，再次处理相同的图片时直接使用缓存的结果
+        ttk.Label(self.frameAdvancedConfigLeft, text='放大结果缓存文件夹（留空则不缓存）').pack(padx=10, pady=5, fill=tk.X)
+        self.entryCacheDir = ttk.Entry(self.frameAdvancedConfigLeft, textvariable=self.varstrCacheDir)
+        self.entryCacheDir.pack(padx=10, pady=5, fill=tk.X)
+        ttk.Label(self.frameAdvancedConfigLeft, text='缓存大小上限（MiB），超出时删除最久未使用的结果').pack(padx=10, pady=5, fill=tk.X)
+        self.spinCacheSize = ttk.Spinbox(self.frameAdvancedConfigLeft, from_=64, to=1048576, increment=256, width=12,
+                                         textvariable=self.varintCacheSize)
+        self.spinCacheSize.pack(padx=10, pady=5, fill=tk.X)
+
         # 在高级配置左侧Frame中添加拆分大小的标签
         ttk.Label(self.frameAdvancedConfigLeft, text='拆分大小').pack(padx=10, pady=5, fill=tk.X)
         # 创建一个下拉菜单，用于选择不同的拆分大小，并将其放置在高级配置左侧Frame中
         self.comboTileSize = ttk.Combobox(self.frameAdvancedConfigLeft, state='readonly',
-                                          values=('自动决定', *self.tileSize[1:]))
+                                          values=('自动决定', '按调优结果', *self.tileSize[2:]))
         self.comboTileSize.current(0)
         self.comboTileSize.pack(padx=10, pady=5, fill=tk.X)
         # 绑定下拉菜单的选择事件，当选择改变时执行comboTileSize_click方法
         self.comboTileSize.bind('<<ComboboxSelected>>', self.comboTileSize_click)
+        # 创建一个调优按钮，用输入的图片测试各个拆分大小，记录当前模型和 GPU 最快的拆分大小
+        self.buttonTuneTiles = ttk.Button(self.frameAdvancedConfigLeft, text='用输入的图片调优拆分大小',
+                                          command=self.buttonTuneTiles_click)
+        self.buttonTuneTiles.pack(padx=10, pady=5, fill=tk.X)
 
         # 在高级配置右侧Frame中添加优先保存为无损 WebP 的复选框
         self.checkUseWebP = ttk.Checkbutton(self.frameAdvancedConfigRight, text='优先保存为无损 WebP',
@@ -265,6 +338,54 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 将使用TTA模式的复选框放置在高级配置右侧Frame中
         self.checkUseTTA.pack(padx=10, pady=5, fill=tk.X)
 
+        # 在高级配置右侧Frame中添加合并 GIF 重复帧的复选框
+        self.checkMergeGIFFrames = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                                   text='合并 GIF 中连续的重复帧', style='Switch.TCheckbutton',
+                                                   variable=self.varboolMergeGIFFrames)
+        self.checkMergeGIFFrames.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加增量处理的复选框
+        self.checkIncremental = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                                text='处理文件夹时跳过已完成且未修改的文件', style='Switch.TCheckbutton',
+                                                variable=self.varboolIncremental)
+        self.checkIncremental.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加混用同系列模型的复选框，按估算的计算量选择最省的放大方案
+        self.checkMixModels = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                              text='混用同系列不同倍率的模型以减少计算量', style='Switch.TCheckbutton',
+                                              variable=self.varboolMixModels)
+        self.checkMixModels.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加预先缩小输入的复选框
+        self.checkPreDownscale = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                                 text='放大前先缩小输入以减少计算量（可能损失细节）', style='Switch.TCheckbutton',
+                                                 variable=self.varboolPreDownscale)
+        self.checkPreDownscale.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加分块处理超大图片的复选框，拼接时不会将整张放大后的图片载入内存
+        self.checkSplitLargeImages = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                                     text=f'分块处理边长超过 {task.DEFAULT_SPLIT_SIZE} 的超大图片（降低内存占用）',
+                                                     style='Switch.TCheckbutton', variable=self.varboolSplitLargeImages)
+        self.checkSplitLargeImages.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加保存完整日志的复选框，文本框中只保留最近的日志
+        self.checkSaveLog = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                            text='将完整日志保存到程序目录下的 logs 文件夹', style='Switch.TCheckbutton',
+                                            variable=self.varboolSaveLog)
+        self.checkSaveLog.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加预先检查的复选框，开始前估算总计算量和空间占用，并优先处理大图
+        self.checkPreflight = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                              text='处理文件夹前预先检查所有图片并优先处理大图', style='Switch.TCheckbutton',
+                                              variable=self.varboolPreflight)
+        self.checkPreflight.pack(padx=10, pady=5, fill=tk.X)
+
+        # 在高级配置右侧Frame中添加监视文件夹的复选框，开启后处理完现有图片仍继续等待新图片，直到点击停止
+        self.checkWatch = ttk.Checkbutton(self.frameAdvancedConfigRight,
+                                          text='持续监视输入文件夹并自动处理新增或修改的图片', style='Switch.TCheckbutton',
+                                          variable=self.varboolWatch)
+        self.checkWatch.pack(padx=10, pady=5, fill=tk.X)
+
         # # 创建关于页面的Frame，并将其放置在Notebook的第0行第0列
         # self.frameAbout = ttk.Frame(self.notebookConfig, padding=5)
         # self.frameAbout.grid(row=0, column=0, padx=5, pady=5, sticky=tk.NSEW)
@@ -305,51 +426,54 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 初始时禁用文本框，防止用户编辑
         self.textOutput.configure(state=tk.DISABLED)
 
-    # 预览图片加载和显示方法
-    def load_and_display_preview_image(self, p:str):
-        # # 清除Frame中的旧图片
-        # for widget in self.imageDisplayFrame.winfo_children():
-        #     widget.destroy()
-        # 根据当前选择的模型加载新的图片
-        # 这里只是一个示例，您需要根据实际情况来加载图片
-        # current_model = self.varstrModel.get()
-
-        # 使用Pillow加载图片
-        pil_image = Image.open(p)
-        # 获取原始图片的尺寸
-        original_width, original_height = pil_image.size
-
-        # 计算等比例缩放的尺寸，高度不超过300像素
-        aspect_ratio = original_width / original_height
-        if original_height > 300:
-            resized_height = 300
-            resized_width = int(300 * aspect_ratio)
-        else:
-            resized_height = original_height
-            resized_width = original_width
+        # 创建进度条和显示进度、速度和剩余时间的标签
+        self.frameProgress = ttk.Frame(self)
+        self.frameProgress.grid(row=2, column=0, padx=5, pady=5, sticky=tk.NSEW)
+        self.frameProgress.columnconfigure(0, weight=1)
+        self.progressbar = ttk.Progressbar(self.frameProgress, maximum=1000)
+        self.progressbar.grid(row=0, column=0, padx=5, sticky=tk.EW)
+        self.labelProgress = ttk.Label(self.frameProgress, width=40)
+        self.labelProgress.grid(row=0, column=1, padx=5, sticky=tk.E)
 
-        # 调整图片尺寸
-        pil_image = pil_image.resize((resized_width, resized_height))
+    # 预览图片加载和显示方法
+    def load_and_display_preview_image(self, p: str):
+        # 缩略图在后台线程中生成，不会阻塞界面；连续选择多张图片时，还没开始生成的旧预览会被取消
+        polling = self.previewFuture is not None
+        if polling:
+            self.previewFuture.cancel()
+        self.previewPath = p
+        self.previewFuture = self.previewExecutor.submit(self.previewCache.get, p)
+        if not polling:
+            self.pollPreview()
+
+    # 在主线程中定时检查缩略图是否已经生成
+    def pollPreview(self):
+        future = self.previewFuture
+        if not future:
+            return
+        if not future.done():
+            self.after(20, self.pollPreview)
+            return
+        self.previewFuture = None
+        try:
+            thumb = future.result()
+        except (OSError, ValueError, Image.DecompressionBombError) as ex:
+            # 无法读取的图片不显示预览，并在日志中说明原因
+            self.writeToOutput(f'Cannot preview {self.previewPath}: {ex}\n')
+            self.previewImage = None
+            self.labelPreviewImage.config(image='')
+            return
 
-        # 将Pillow图像转换为Tkinter的PhotoImage        后者只能支持png图片
-        tk_image = ImageTk.PhotoImage(pil_image)
+        # 将Pillow图像转换为Tkinter的PhotoImage，需要保存引用，否则图片会在函数返回后被回收
+        from PIL import ImageTk
+        self.previewImage = ImageTk.PhotoImage(thumb)
+        self.labelPreviewImage.config(image=self.previewImage)
 
         # 更新self.imageDisplayFrame的大小以适应图片
-        self.imageDisplayFrame.config(width=resized_width, height=resized_height)
-
-        # 创建一个新的Label并将其打包到imageDisplayFrame中
-        #ttk.Label(self.imageDisplayFrame, image=tk_image).pack(side=tk.TOP, fill=tk.BOTH, expand=True)    #这行单独出现时不显示，和下面类似代码出现时却重复显示图片，猜测不显示是因为tk_image是局部变量，函数执行完就销毁了
-
+        self.imageDisplayFrame.config(width=thumb.width, height=thumb.height)
         # 更新窗口大小以适应图片Frame的新尺寸
         self.update_window_size()
 
-        self.image = tk_image   #可能是局部变量问题
-        # ttk.Label(self.imageDisplayFrame, image=self.image).pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-
-        ttk.Label(self.imageDisplayFrame, image=self.image).pack(side=tk.TOP, fill=tk.BOTH, expand=True)      #踏马的到底是什么问题突然显示又突然不显示,大概率是要在update_win 后面执行
-
-        #其实不显示图片的原因大概率是解释器还没来得及加载新代码(py没有编译器)
-
     def update_window_size(self):
         # 获取self.imageDisplayFrame的当前宽度和高度
         width = self.imageDisplayFrame.cget('width')
@@ -404,6 +528,11 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
 
     # 当用户点击处理按钮时调用此函数
     def buttonProcess_click(self):
+        # 正在监视文件夹时，按钮用于停止监视，已加入队列的图片会继续处理完
+        if self.folderWatcher:
+            self.folderWatcher.stop()
+            self.buttonProcess.config(state=tk.DISABLED)
+            return
         # 获取输入和输出路径
         inputPath = self.varstrInputPath.get()
         outputPath = self.varstrOutputPath.get()
@@ -419,55 +548,143 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
 
         # 获取配置参数
         initialConfigParams = self.getConfigParams()
+        # 设置了缓存文件夹时，读取其中已有的放大结果
+        cacheDir = self.varstrCacheDir.get().strip()
+        try:
+            resultCache = cache.ResultCache(os.path.normpath(cacheDir), self.varintCacheSize.get() * 1048576) if cacheDir else None
+        except OSError as ex:
+            return messagebox.showwarning(None, f'无法使用缓存文件夹：{ex}')
         # 创建一个队列用于存放处理任务
-        queue = collections.deque()
-        # 如果输入路径是一个目录，则遍历目录中的所有文件
+        queue = task.TaskQueue()
+        # 增量处理时使用的任务清单，记录已完成的文件
+        jobManifest = None
+        # 如果输入路径是一个目录，则在后台线程中遍历目录，边遍历边将任务添加到队列，不会阻塞界面
         if os.path.isdir(inputPath):
-            # 对于每个文件，如果文件扩展名不在支持的图片格式中，则跳过
-            for curDir, dirs, files in os.walk(inputPath):
-                for f in files:
-                    if os.path.splitext(f)[1].lower() not in {'.jpg', '.jpeg', '.png', '.gif', '.webp'}:
+            # 开启增量处理时，在输出目录中读取或创建任务清单
+            if self.varboolIncremental.get():
+                jobManifest = manifest.JobManifest(outputPath)
+            include = [x.strip() for x in self.varstrInclude.get().split(';') if x.strip()]
+            exclude = [x.strip() for x in self.varstrExclude.get().split(';') if x.strip()]
+
+            # 对于每个支持的图片文件，根据文件类型创建处理任务，遍历结束后在日志中报告结果
+            def createTasks():
+                found = skipped = 0
+                for f, g in task.scanDirectory(inputPath, outputPath, include, exclude):
+                    found += 1
+                    # 跳过已完成且未修改的文件
+                    if jobManifest and jobManifest.isComplete(f, g, initialConfigParams):
+                        skipped += 1
                         continue
-                    # 构造完整的文件路径
-                    f = os.path.join(curDir, f)
-                    # 构造输出文件的路径
-                    g = os.path.join(outputPath, f.removeprefix(inputPath + os.path.sep))
-                    # 根据文件类型添加处理任务到队列
-                    queue.append((
-                        task.SplitGIFTask(self.writeToOutput, f, g, initialConfigParams, queue)
-                        if os.path.splitext(f)[1].lower() == '.gif' else
-                        task.RESpawnTask(self.writeToOutput, f, g, initialConfigParams)
-                    ))
-            # 如果队列为空，即没有可以处理的图片文件，则通过弹出警告框提示用户
-            if not queue:
-                return messagebox.showwarning('批量处理提示', '文件夹内没有可以处理的图片文件。')
+                    yield task.createTask(self.writeToOutput, f, g, initialConfigParams, queue, resultCache, jobManifest)
+                if skipped:
+                    self.writeToOutput(f'Skipped {skipped} images that are already up to date.\n')
+                elif not found:
+                    self.writeToOutput(f'No image files found in {inputPath}\n')
+
+            # 开启预先检查时，遍历完整个文件夹并读取所有图片的文件头后，才按从大到小的顺序开始处理
+            def scheduleTasks():
+                yield from preflight.scheduleTasks(createTasks(), 1, self.writeToOutput)
+
+            # 监视文件夹时，每张写入完成的新图片单独加入队列，处理失败的图片不会停止监视
+            def createWatchedTask(f: str, g: str):
+                if jobManifest and jobManifest.isComplete(f, g, initialConfigParams):
+                    return None
+                self.writeToOutput(f'Queued {f}\n')
+                return task.createTask(self.writeToOutput, f, g, initialConfigParams, queue, resultCache, jobManifest)
+
+            # 在启动任务线程之前登记生产者，使任务线程等待遍历结束
+            queue.openProducer()
+            if self.varboolWatch.get():
+                self.folderWatcher = watcher.FolderWatcher(inputPath, outputPath, include, exclude)
+                queue.keepGoing = True
+                threading.Thread(target=self.folderWatcher.watch, args=(queue, createWatchedTask, self.writeToOutput), daemon=True).start()
+            else:
+                threading.Thread(target=task.produceTasks, args=(queue, scheduleTasks() if self.varboolPreflight.get() else createTasks(), self.writeToOutput), daemon=True).start()
         # 如果输入路径是一个文件，并且是支持的图片格式，则添加处理任务到队列
-        elif os.path.splitext(inputPath)[1].lower() in {'.jpg', '.jpeg', '.png', '.gif', '.webp'}:
-            queue.append((
-                task.SplitGIFTask(self.writeToOutput, inputPath, outputPath, initialConfigParams, queue)
-                if os.path.splitext(inputPath)[1].lower() == '.gif' else
-                task.RESpawnTask(self.writeToOutput, inputPath, outputPath, initialConfigParams)
-            ))
+        elif os.path.splitext(inputPath)[1].lower() in task.IMAGE_EXTS:
+            queue.append(task.createTask(self.writeToOutput, inputPath, outputPath, initialConfigParams, queue, resultCache))
         else:
             # 如果输入文件格式不支持，则通过弹出警告框提示用户
             return messagebox.showwarning('格式错误', '仅支持 JPEG、PNG、GIF 和 WebP 格式的图片文件。')
-        # 禁用处理按钮
-        self.buttonProcess.config(state=tk.DISABLED)
+        # 任务结束后关闭任务清单、清理临时文件，并报告缓存的命中情况
+        self.startRunner(queue, lambda: (
+            jobManifest and jobManifest.close(),
+            task.scratchSpace.cleanup(),
+            resultCache and self.writeToOutput(resultCache.getSummary()),
+        ))
+
+    # 当用户点击调优按钮时调用此函数
+    def buttonTuneTiles_click(self):
+        inputPath = self.varstrInputPath.get()
+        if not inputPath or not os.path.exists(inputPath):
+            return messagebox.showwarning(None, '请输入有效的输入路径。')
+        inputPath = os.path.normpath(inputPath)
+        # 输入文件夹时使用其中的第一张图片
+        if os.path.isdir(inputPath):
+            inputPath = next((f for f, _ in task.scanDirectory(inputPath, self.getOutputPath(inputPath))), None)
+            if not inputPath:
+                return messagebox.showwarning(None, '输入的文件夹中没有支持的图片文件。')
+        elif os.path.splitext(inputPath)[1].lower() not in task.IMAGE_EXTS:
+            return messagebox.showwarning('格式错误', '仅支持 JPEG、PNG、GIF 和 WebP 格式的图片文件。')
+        queue = task.TaskQueue()
+        queue.append(task.TuneTilesTask(self.writeToOutput, inputPath, self.getConfigParams(), task.tileProfiles))
+        self.startRunner(queue, task.scratchSpace.cleanup)
+
+    # 在新线程中执行任务队列，任务结束后在工作线程中调用completeCallback
+    def startRunner(self, queue: task.TaskQueue, completeCallback: typing.Callable[[], None]):
+        # 禁用处理按钮和调优按钮，监视文件夹时处理按钮变为停止按钮
+        if self.folderWatcher:
+            self.buttonProcess.config(text='停止')
+        else:
+            self.buttonProcess.config(state=tk.DISABLED)
+        self.buttonTuneTiles.config(state=tk.DISABLED)
         # 使文本框可编辑，清除文本框内容，然后再次禁用
         self.textOutput.config(state=tk.NORMAL)
         self.textOutput.delete(1.0, tk.END)
         self.textOutput.config(state=tk.DISABLED)
+        # 重置进度条，并开始定时刷新进度
+        self.latestProgress = None
+        self.running = True
+        # 需要时打开本次运行的日志文件，上一次运行的日志在恢复按钮前已经全部显示
+        if self.varboolSaveLog.get():
+            os.makedirs(os.path.join(APP_PATH, 'logs'), exist_ok=True)
+            self.logSink.openSpill(os.path.join(APP_PATH, 'logs', time.strftime('%Y%m%d-%H%M%S.log')))
+        self.progressbar.config(value=0)
+        self.labelProgress.config(text='')
+        self.updateProgress()
         # 创建并启动新线程来执行任务队列
         t = threading.Thread(
             target=task.taskRunner,
             args=(
                 queue,
                 self.writeToOutput,
-                lambda: self.buttonProcess.config(state=tk.NORMAL),
+                # 工作线程中不直接操作控件，由主线程在刷新进度时恢复按钮
+                lambda: (completeCallback(), setattr(self, 'running', False)),
+                None,
+                self.setProgress,
             )
         )
         t.start()
 
+    # 工作线程报告进度时调用此函数，只记录最新的进度事件，不直接操作控件
+    def setProgress(self, event: progress.ProgressEvent):
+        self.latestProgress = event
+
+    # 在主线程中定时刷新进度条和标签，任务结束后停止刷新
+    def updateProgress(self):
+        event = self.latestProgress
+        if event and event.totalPixels:
+            self.progressbar.config(value=1000 * event.donePixels / event.totalPixels)
+            self.labelProgress.config(text=progress.formatProgress(event).removeprefix('Progress: ').strip())
+        if self.running or self.logSink.pending:
+            self.after(200, self.updateProgress)
+        else:
+            # 任务结束且日志已全部显示后，关闭日志文件并恢复处理按钮
+            self.logSink.closeSpill()
+            self.folderWatcher = None
+            self.buttonProcess.config(text='开始', state=tk.NORMAL)
+            self.buttonTuneTiles.config(state=tk.NORMAL)
+
     # 设置输入文件路径的函数
     def setInputPath(self, p: str):
         # 设置输入路径变量的值为用户选择的路径
@@ -475,19 +692,30 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 根据输入路径设置默认的输出路径
         self.varstrOutputPath.set(self.getOutputPath(p))
 
-    # 将处理结果写入文本输出框的函数
+    # 将处理结果写入日志缓冲区的函数，可以在任意线程中调用
     def writeToOutput(self, s: str):
-        # 使文本框可编辑
-        self.textOutput.config(state=tk.NORMAL)
-        # 在文本框末尾插入文本
-        self.textOutput.insert(tk.END, s)
-        # 再次禁用文本框
-        self.textOutput.config(state=tk.DISABLED)
-        # 获取当前文本框的垂直视图
-        yview = self.textOutput.yview()
-        # 如果视图的底部大于0.5或非常接近1，则滚动到文本框的末尾
-        if yview[1] - yview[0] > .5 or yview[1] > .9:
-            self.textOutput.see('end')
+        self.logSink.write(s)
+
+    # 在主线程中定时从日志缓冲区批量取出日志并显示
+    def pollOutput(self):
+        s = self.logSink.drain()
+        if s:
+            # 使文本框可编辑
+            self.textOutput.config(state=tk.NORMAL)
+            # 在文本框末尾一次性插入这一批文本
+            self.textOutput.insert(tk.END, s)
+            # 只保留最近的 MAX_LINES 行，删除更早的行
+            lineCount = int(self.textOutput.index('end-1c').split('.')[0])
+            if lineCount > logsink.MAX_LINES:
+                self.textOutput.delete('1.0', f'{lineCount - logsink.MAX_LINES + 1}.0')
+            # 再次禁用文本框
+            self.textOutput.config(state=tk.DISABLED)
+            # 获取当前文本框的垂直视图
+            yview = self.textOutput.yview()
+            # 如果视图的底部大于0.5或非常接近1，则滚动到文本框的末尾
+            if yview[1] - yview[0] > .5 or yview[1] > .9:
+                self.textOutput.see('end')
+        self.after(100, self.pollOutput)
 
     # 获取配置参数的函数
     def getConfigParams(self) -> param.REConfigParams:
@@ -511,6 +739,11 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
             self.tileSize[self.varintTileSizeIndex.get()],
             self.varintGPUID.get(),
             self.varboolUseTTA.get(),
+            self.varboolMergeGIFFrames.get(),
+            # 同系列的其他模型及其倍率，供放大方案规划时混用
+            tuple((m, self.modelFactors[m]) for m, _ in catalog.getModelFamily(self.varstrModel.get(), self.models)) if self.varboolMixModels.get() else (),
+            self.varboolPreDownscale.get(),
+            task.DEFAULT_SPLIT_SIZE if self.varboolSplitLargeImages.get() else 0,
         )
 # 定义一个函数，用于获取输出文件的路径。函数接收一个路径参数p，并返回一个字符串。
     def getOutputPath(self, p: str) -> str:
@@ -542,10 +775,51 @@ class REGUIApp(ttk.Frame):  # 创建一个基于ttk.Frame的类
         # 返回最终的文件路径，格式为base-suffix.ext。
         return f'{base}-{suffix}{ext}'
 
+# 窗口显示后再进行的启动工作，这些工作不影响窗口的内容，放在后面可以让窗口更早出现
+def finishStartup(root: tk.Tk, app: REGUIApp):
+    try:
+        # 尝试设置窗口图标。
+        root.iconbitmap(os.path.join(BASE_PATH, 'icon-256px.ico'))
+    except tk.TclError:
+        # 如果设置图标失败，使用PhotoImage设置窗口图标。
+        from PIL import ImageTk
+        root.tk.call('wm', 'iconphoto', root._w, ImageTk.PhotoImage(Image.open(os.path.join(BASE_PATH, 'icon-256px.ico'))))
+    markStartup('icon')
+
+    # 导入tkinterdnd2时会为所有控件添加拖放相关的方法，然后为窗口加载tkdnd扩展。
+    from tkinterdnd2 import DND_FILES, TkinterDnD
+    try:
+        # _require不是公开接口，requirements.txt中固定了tkinterdnd2的版本。
+        TkinterDnD._require(root)
+    except RuntimeError as ex:
+        # 加载失败时只是不能拖放文件，其他功能不受影响。
+        app.writeToOutput(f'Drag and drop is unavailable: {ex}\n')
+    else:
+        # 为应用注册拖放目标。
+        app.drop_target_register(DND_FILES)
+        # 绑定拖放事件，当文件被拖放到应用上时，调用setInputPath方法。
+        app.dnd_bind(
+            '<<Drop>>',
+            lambda e: app.setInputPath(e.data[1:-1] if '{' == e.data[0] and '}' == e.data[-1] else e.data),
+        )
+    markStartup('drag and drop')
+
+    # 显示启动计时报告。
+    if SHOW_STARTUP_TIMING:
+        app.writeToOutput(getStartupReport())
+
 # 主程序入口点。
 if __name__ == '__main__':
+    # 在另一个线程中检测系统是否处于暗模式，与创建窗口同时进行，Linux上需要运行外部命令。
+    isDark = []
+    def detectDarkMode():
+        import darkdetect
+        isDark.append(darkdetect.isDark())
+    darkModeThread = threading.Thread(target=detectDarkMode, daemon=True)
+    darkModeThread.start()
+
     # 创建一个Tkinter窗口实例，并立即隐藏它。
-    root = TkinterDnD.Tk()
+    root = tk.Tk()
     root.withdraw()
 
     # 检查Real-ESRGAN-ncnn-vulkan主程序是否存在于指定的APP_PATH路径下。
@@ -556,32 +830,23 @@ if __name__ == '__main__':
             '未找到 Real-ESRGAN-ncnn-vulkan 主程序。\n请前往 https://github.com/xinntao/Real-ESRGAN/releases 下载，并将本文件和主程序放在同一目录下。',
         )
         # 打开默认的网络浏览器，跳转到Real-ESRGAN的GitHub发布页面。
+        import webbrowser
         webbrowser.open_new_tab('https://github.com/xinntao/Real-ESRGAN/releases')
         # 退出程序。
         sys.exit(0)
 
     # 设置窗口标题为'Real-ESRGAN GUI'。
     root.title('Real-ESRGAN GUI')
-    try:
-        # 尝试设置窗口图标。
-        root.iconbitmap(os.path.join(BASE_PATH, 'icon-256px.ico'))
-    except tk.TclError:
-        # 如果设置图标失败，使用PhotoImage设置窗口图标。
-        root.tk.call('wm', 'iconphoto', root._w, ImageTk.PhotoImage(Image.open(os.path.join(BASE_PATH, 'icon-256px.ico'))))
+    markStartup('tk')
 
     # 加载主题配置文件，并根据系统是否处于暗模式设置主题。
     root.tk.call('source', os.path.join(BASE_PATH, 'theme/sun-valley.tcl'))
-    root.tk.call('set_theme', 'dark' if darkdetect.isDark() else 'light')
+    darkModeThread.join()
+    root.tk.call('set_theme', 'dark' if isDark and isDark[0] else 'light')
+    markStartup('theme')
 
     # 创建REGUIApp类的实例。
     app = REGUIApp(root)
-    # 为应用注册拖放目标。
-    app.drop_target_register(DND_FILES)
-    # 绑定拖放事件，当文件被拖放到应用上时，调用setInputPath方法。
-    app.dnd_bind(
-        '<<Drop>>',
-        lambda e: app.setInputPath(e.data[1:-1] if '{' == e.data[0] and '}' == e.data[-1] else e.data),
-    )
     # 将app组件填充到root窗口中。
     app.pack(fill=tk.BOTH, expand=True)
 
@@ -595,8 +860,13 @@ if __name__ == '__main__':
         (root.winfo_screenwidth() - initialSize[0]) // 2,
         (root.winfo_screenheight() - initialSize[1]) // 2,
     ))
+    markStartup('widgets')
 
-    # 显示窗口。
+    # 显示窗口，并处理完绘制窗口的事件。
     root.deiconify()
+    root.update()
+    markStartup('window shown')
+    # 其余的启动工作在窗口显示后进行。
+    root.after_idle(finishStartup, root, app)
     # 进入Tkinter事件循环。
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
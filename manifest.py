@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+import typing
+
+import param
+
+if typing.TYPE_CHECKING:
+    import task
+
+class JobManifest:
+    FILE_NAME = '.realesrgan-manifest.jsonl'
+    WORK_DIR_NAME = '.realesrgan-work'
+
+    def __init__(self, outputDir: str) -> None:
+        self.outputDir = outputDir
+        self.path = os.path.join(outputDir, self.FILE_NAME)
+        self.lock = threading.Lock()
+        # input path -> {'output', 'size', 'mtime', 'fingerprint', 'done', 'frames'}
+        self.entries: dict[str, dict] = {}
+        os.makedirs(outputDir, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.replay(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A line cut short by a crash, everything before it is still valid.
+                        pass
+        # The manifest is an append-only journal so that a crash never loses completed work,
+        # it is compacted once on every load.
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            for inputPath, e in self.entries.items():
+                if e['done']:
+                    f.write(json.dumps({'input': inputPath, **self.getRecord(e), 'output': e['output']}) + '\n')
+                for frame in e['frames']:
+                    f.write(json.dumps({'input': inputPath, **self.getRecord(e), 'frame': frame}) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+        self.journal = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def getFingerprint(config: param.REConfigParams) -> str:
+        # Only settings that change the output count: the GPU and the tile size a task happens
+        # to run with must not make completed outputs and frames look stale.
+        return hashlib.blake2b(repr(tuple(config._replace(gpuID=0, tileSize=0))).encode(), digest_size=8).hexdigest()
+
+    @staticmethod
+    def getRecord(e: dict) -> dict:
+        return {'size': e['size'], 'mtime': e['mtime'], 'fingerprint': e['fingerprint']}
+
+    def getEntry(self, inputPath: str, record: dict) -> dict:
+        e = self.entries.get(inputPath)
+        if e is None or self.getRecord(e) != record:
+            e = self.entries[inputPath] = {'output': None, **record, 'done': False, 'frames': set()}
+        return e
+
+    def replay(self, record: dict) -> None:
+        e = self.getEntry(record['input'], {'size': record['size'], 'mtime': record['mtime'], 'fingerprint': record['fingerprint']})
+        if 'frame' in record:
+            e['frames'].add(record['frame'])
+        else:
+            e['output'] = record['output']
+            e['done'] = True
+
+    def write(self, record: dict) -> None:
+        with self.lock:
+            self.replay(record)
+            self.journal.write(json.dumps(record) + '\n')
+            self.journal.flush()
+
+    def getInputRecord(self, inputPath: str, config: param.REConfigParams) -> dict:
+        st = os.stat(inputPath)
+        return {'size': st.st_size, 'mtime': st.st_mtime_ns, 'fingerprint': self.getFingerprint(config)}
+
+    def isComplete(self, inputPath: str, outputPath: str, config: param.REConfigParams) -> bool:
+        e = self.entries.get(inputPath)
+        return (
+            e is not None and e['done'] and e['output'] == outputPath
+            and self.getRecord(e) == self.getInputRecord(inputPath, config)
+            and os.path.exists(outputPath)
+        )
+
+    def isFrameDone(self, inputPath: str, config: param.REConfigParams, frame: str) -> bool:
+        e = self.entries.get(inputPath)
+        return e is not None and frame in e['frames'] and self.getRecord(e) == self.getInputRecord(inputPath, config)
+
+    def getWorkDir(self, inputPath: str) -> str:
+        return os.path.join(self.outputDir, self.WORK_DIR_NAME, hashlib.blake2b(inputPath.encode(), digest_size=8).hexdigest())
+
+    def track(self, t: 'task.AbstractTask', inputPath: str, outputPath: str, config: param.REConfigParams) -> None:
+        # The input is stat-ed when the task is queued, so an input modified while it is
+        # being processed will be processed again on the next run.
+        record = {'input': inputPath, **self.getInputRecord(inputPath, config)}
+        t.completeCallbacks.append(lambda: self.write({**record, 'output': outputPath}))
+
+    def trackFrame(self, t: 'task.AbstractTask', inputPath: str, config: param.REConfigParams, frame: str) -> None:
+        record = {'input': inputPath, **self.getInputRecord(inputPath, config)}
+        t.completeCallbacks.append(lambda: self.write({**record, 'frame': frame}))
+
+    def close(self) -> None:
+        self.journal.close()
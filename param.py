@@ -7,12 +7,22 @@ class ResizeMode(enum.IntEnum):
     WIDTH = enum.auto()
     HEIGHT = enum.auto()
 
+# Tile size that is looked up in the tuned profiles for every pass.
+TUNED_TILE_SIZE = -1
+
 class REConfigParams(typing.NamedTuple):
     model: str
     modelFactor: int
     resizeMode: ResizeMode
     resizeModeValue: int
     downsample: 'Image._Resample'
+    # 0 lets the executable choose, TUNED_TILE_SIZE uses the tuned profiles.
     tileSize: int
     gpuID: int
     useTTA: bool
+    mergeGIFFrames: bool = False
+    # Other models (name, factor) that may be mixed with the selected one across passes.
+    planModels: tuple[tuple[str, int], ...] = ()
+    preDownscale: bool = False
+    # Images larger than this are upscaled in overlapping tiles of about this size, 0 to disable.
+    splitSize: int = 0
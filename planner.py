@@ -0,0 +1,97 @@
+import itertools
+import math
+import typing
+
+import param
+
+class ScalePlan(typing.NamedTuple):
+    srcSize: tuple[int, int]
+    dstSize: tuple[int, int]
+    # Size of the image fed to the first pass, smaller than the source when it is pre-downscaled.
+    inputSize: tuple[int, int]
+    passes: tuple[tuple[str, int], ...]
+    cost: int
+    naiveCost: int
+    naivePasses: int
+
+    @property
+    def resultSize(self) -> tuple[int, int]:
+        f = math.prod(x[1] for x in self.passes)
+        return self.inputSize[0] * f, self.inputSize[1] * f
+
+def getTargetSize(size: tuple[int, int], config: param.REConfigParams) -> tuple[int, int]:
+    srcWidth, srcHeight = size
+    srcRatio = srcWidth / srcHeight
+    match config.resizeMode:
+        case param.ResizeMode.RATIO:
+            return srcWidth * config.resizeModeValue, srcHeight * config.resizeModeValue
+        case param.ResizeMode.WIDTH:
+            return config.resizeModeValue, round(config.resizeModeValue / srcRatio)
+        case param.ResizeMode.HEIGHT:
+            return round(config.resizeModeValue * srcRatio), config.resizeModeValue
+
+def getCost(inputSize: tuple[int, int], factors: typing.Iterable[int]) -> int:
+    # The work of a pass is estimated by the number of pixels it produces.
+    cost = 0
+    width, height = inputSize
+    for f in factors:
+        width *= f
+        height *= f
+        cost += width * height
+    return cost
+
+def isEnough(size: tuple[int, int], factor: int, dstSize: tuple[int, int]) -> bool:
+    # Same stop condition as the original pass loop: one side reaching the target is enough.
+    return not (size[0] * factor < dstSize[0] and size[1] * factor < dstSize[1])
+
+def planScale(size: tuple[int, int], config: param.REConfigParams) -> ScalePlan:
+    dstSize = getTargetSize(size, config)
+
+    naivePasses = 0
+    while not isEnough(size, config.modelFactor ** naivePasses, dstSize):
+        naivePasses += 1
+    naiveCost = getCost(size, (config.modelFactor,) * naivePasses)
+    best = (naiveCost, -size[0] * size[1], naivePasses, size, ((config.model, config.modelFactor),) * naivePasses)
+
+    if config.planModels or config.preDownscale:
+        models: dict[int, str] = {config.modelFactor: config.model}
+        for m, f in config.planModels:
+            models.setdefault(f, m)
+        maxPasses = naivePasses if len(models) == 1 else math.ceil(math.log2(max(dstSize[0] / size[0], dstSize[1] / size[1], 1))) + 1
+        for n in range(1, maxPasses + 1):
+            for factors in itertools.combinations_with_replacement(sorted(models), n):
+                # Smaller factors go first, every later pass is more expensive than the previous one.
+                p = math.prod(factors)
+                candidates = []
+                if isEnough(size, p, dstSize):
+                    candidates.append(size)
+                if config.preDownscale:
+                    inputSize = (math.ceil(dstSize[0] / p), math.ceil(dstSize[1] / p))
+                    if inputSize[0] <= size[0] and inputSize[1] <= size[1] and inputSize != size:
+                        candidates.append(inputSize)
+                for inputSize in candidates:
+                    # Prefer the cheapest plan, then the one discarding the least of the input.
+                    key = (getCost(inputSize, factors), -inputSize[0] * inputSize[1], n, inputSize, tuple((models[f], f) for f in factors))
+                    if key < best:
+                        best = key
+    return ScalePlan(size, dstSize, best[3], best[4], best[0], naiveCost, naivePasses)
+
+def getFixedPlan(size: tuple[int, int], passes: tuple[tuple[str, int], ...]) -> ScalePlan:
+    # Tiles of a split image reuse the passes planned for the whole image.
+    f = math.prod(x[1] for x in passes)
+    cost = getCost(size, (x[1] for x in passes))
+    return ScalePlan(size, (size[0] * f, size[1] * f), size, passes, cost, cost, len(passes))
+
+def describePlan(plan: ScalePlan) -> str:
+    steps = []
+    if plan.inputSize != plan.srcSize:
+        steps.append(f'pre-downscale to {plan.inputSize[0]}x{plan.inputSize[1]}')
+    steps.extend(f'{m} ({f}x)' for m, f in plan.passes)
+    return (
+        f'Plan for {plan.srcSize[0]}x{plan.srcSize[1]} -> {plan.dstSize[0]}x{plan.dstSize[1]}: {", ".join(steps) or "no upscaling"}. '
+        f'Estimated work {plan.cost / 1e6:.2f}MP, naive plan {plan.naivePasses} passes {plan.naiveCost / 1e6:.2f}MP.\n'
+    )
+
+def getPassCosts(plan: ScalePlan) -> list[int]:
+    factors = [f for _, f in plan.passes]
+    return [getCost(plan.inputSize, factors[:(i + 1)]) - getCost(plan.inputSize, factors[:i]) for i in range(len(factors))]
@@ -0,0 +1,95 @@
+import io
+import os
+import struct
+import typing
+import zlib
+from PIL import Image
+
+COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+CHUNK_SIZE = 1048576
+
+def readChunks(data: bytes) -> typing.Iterator[tuple[bytes, bytes]]:
+    pos = 8
+    while pos < len(data):
+        n, = struct.unpack('>I', data[pos:(pos + 4)])
+        yield data[(pos + 4):(pos + 8)], data[(pos + 8):(pos + 8 + n)]
+        pos += 12 + n
+
+class PNGWriter:
+    # Writes a PNG from horizontal strips, so that an image never has to be held in memory
+    # as a whole. By default every row uses the "None" filter, which keeps writing cheap;
+    # with adaptiveFilter, rows are filtered by Pillow's encoder like Image.save does.
+    def __init__(self, path: str, size: tuple[int, int], mode: str, compressLevel: int = 1, adaptiveFilter: bool = False) -> None:
+        if mode not in COLOR_TYPES:
+            raise ValueError(f'unsupported mode for streaming PNG: {mode}')
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.rows = 0
+        self.adaptiveFilter = adaptiveFilter
+        self.previousRow: Image.Image | None = None
+        self.buffer = bytearray()
+        self.compressor = zlib.compressobj(compressLevel)
+        self.file = open(path, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self.writeChunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, COLOR_TYPES[mode], 0, 0, 0))
+
+    def __enter__(self) -> 'PNGWriter':
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        if excType:
+            # Never leave a truncated image behind.
+            self.file.close()
+            os.remove(self.path)
+        else:
+            self.close()
+
+    def writeChunk(self, chunkType: bytes, data: bytes) -> None:
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunkType)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunkType))))
+
+    def write(self, img: Image.Image) -> None:
+        if img.size[0] != self.size[0] or img.mode != self.mode:
+            raise ValueError(f'strip {img.mode} {img.size[0]}x{img.size[1]} does not match {self.mode} {self.size[0]}x{self.size[1]}')
+        if self.rows + img.size[1] > self.size[1]:
+            raise ValueError(f'too many rows for {self.size[0]}x{self.size[1]}')
+        if self.adaptiveFilter:
+            self.buffer += self.compressor.compress(self.getFilteredRows(img))
+            self.previousRow = img.crop((0, img.size[1] - 1, img.size[0], img.size[1]))
+        else:
+            data = img.tobytes()
+            stride = len(data) // img.size[1] if img.size[1] else 0
+            for i in range(0, len(data), stride):
+                self.buffer += self.compressor.compress(b'\0')
+                self.buffer += self.compressor.compress(data[i:(i + stride)])
+        self.rows += img.size[1]
+        while len(self.buffer) >= CHUNK_SIZE:
+            self.writeChunk(b'IDAT', bytes(self.buffer[:CHUNK_SIZE]))
+            del self.buffer[:CHUNK_SIZE]
+
+    def getFilteredRows(self, img: Image.Image) -> bytes:
+        # Filters refer to the row above, so the last row of the previous strip is encoded
+        # along with the strip and dropped afterwards. The throwaway stream is not compressed.
+        if self.previousRow is not None:
+            strip = Image.new(self.mode, (img.size[0], img.size[1] + 1))
+            strip.paste(self.previousRow, (0, 0))
+            strip.paste(img, (0, 1))
+        else:
+            strip = img
+        b = io.BytesIO()
+        strip.save(b, 'png', compress_level=0)
+        data = zlib.decompress(b''.join(data for chunkType, data in readChunks(b.getvalue()) if chunkType == b'IDAT'))
+        return data[(len(data) // strip.size[1]):] if self.previousRow is not None else data
+
+    def close(self) -> None:
+        try:
+            if self.rows != self.size[1]:
+                raise ValueError(f'{self.rows} rows written for {self.size[0]}x{self.size[1]}')
+            self.buffer += self.compressor.flush()
+            self.writeChunk(b'IDAT', bytes(self.buffer))
+            self.writeChunk(b'IEND', b'')
+        finally:
+            self.file.close()
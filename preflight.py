@@ -0,0 +1,91 @@
+import heapq
+import math
+import time
+import typing
+
+import param
+import planner
+import probe
+import task
+
+# realesrgan-ncnn-vulkan runs every tile 8 times with TTA.
+TTA_FACTOR = 8
+
+class TaskEstimate(typing.NamedTuple):
+    # Output pixels of every pass, times TTA_FACTOR with TTA.
+    cost: int
+    frameCount: int
+    # Intermediate files of the task at its peak, uncompressed.
+    scratchBytes: int
+    # Output files, uncompressed.
+    outputBytes: int
+
+def estimateImage(info: probe.ImageInfo, config: param.REConfigParams, frameCount: int = 1, scratchFrames: int = 1) -> TaskEstimate:
+    plan = planner.planScale(info.size, config)
+    channels = 4 if 'A' in info.mode or info.mode == 'P' else 3
+    # A pass reads the previous intermediate and writes the next one.
+    files = [math.prod(plan.inputSize), *planner.getPassCosts(plan)]
+    peak = max(a + b for a, b in zip(files, files[1:])) if plan.passes else files[0]
+    outputPixels = math.prod(plan.dstSize)
+    return TaskEstimate(
+        plan.cost * frameCount * (TTA_FACTOR if config.useTTA else 1),
+        frameCount,
+        peak * channels * scratchFrames,
+        # GIF frames are written with one byte per pixel.
+        outputPixels * (1 if frameCount > 1 else channels) * frameCount,
+    )
+
+def estimateTask(t: task.AbstractTask) -> TaskEstimate:
+    try:
+        if isinstance(t, task.REBatchTask):
+            estimates = [estimateTask(x) for x in t.tasks]
+            return TaskEstimate(*(sum(x) for x in zip(*estimates)))
+        if isinstance(t, task.SplitGIFTask):
+            info = task.probeIndex.get(t.inputPath)
+            # Frames are extracted at most GIF_WINDOW batches ahead of the merge.
+            return estimateImage(info, t.config, info.frameCount, min(info.frameCount, task.GIF_WINDOW * task.GIF_BATCH_SIZE))
+        if isinstance(t, (task.RESpawnTask, task.SplitTilesTask)):
+            return estimateImage(task.probeIndex.get(t.inputPath), t.config)
+    except OSError:
+        # The task reports the error when it runs.
+        pass
+    return TaskEstimate(0, 0, 0, 0)
+
+def getInputPaths(t: task.AbstractTask) -> list[str]:
+    if isinstance(t, task.REBatchTask):
+        return [x.inputPath for x in t.tasks]
+    return [t.inputPath] if hasattr(t, 'inputPath') else []
+
+def scheduleTasks(
+    tasks: typing.Iterable[task.AbstractTask],
+    workerCount: int,
+    outputCallback: typing.Callable[[str], None],
+) -> list[task.AbstractTask]:
+    # Probes every input before the run, reports the estimated totals and returns the tasks
+    # largest first. Workers take the next task whenever they are free, so the largest tasks
+    # are spread over the workers first and the small ones fill the gaps at the end.
+    tasks = list(tasks)
+    ts = time.perf_counter()
+    task.probeIndex.probeAll(p for t in tasks for p in getInputPaths(t))
+    estimates = {t: estimateTask(t) for t in tasks}
+    te = time.perf_counter()
+    tasks.sort(key=lambda t: estimates[t].cost, reverse=True)
+    outputCallback(f'Probed {len(tasks)} tasks in {round((te - ts) * 1000)}ms.\n')
+    outputCallback(describeEstimates([estimates[t] for t in tasks], workerCount))
+    return tasks
+
+def describeEstimates(estimates: list[TaskEstimate], workerCount: int) -> str:
+    workerCount = max(workerCount, 1)
+    cost = sum(x.cost for x in estimates)
+    # Tasks running at the same time are the largest ones at worst.
+    scratchBytes = sum(sorted((x.scratchBytes for x in estimates), reverse=True)[:workerCount])
+    outputBytes = sum(x.outputBytes for x in estimates)
+    # Each task goes to the worker that becomes free first, as in the runner.
+    loads = [0] * workerCount
+    for x in estimates:
+        heapq.heapreplace(loads, loads[0] + x.cost)
+    return (
+        f'Estimated {cost / 1e6:.1f}MP to produce for {sum(x.frameCount for x in estimates)} images and frames, '
+        f'scratch up to {scratchBytes / 1048576:.1f}MiB, output up to {outputBytes / 1048576:.1f}MiB uncompressed.\n'
+        + (f'Largest worker share {max(loads) / 1e6:.1f}MP of {cost / workerCount / 1e6:.1f}MP on average.\n' if workerCount > 1 and cost else '')
+    )
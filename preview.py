@@ -0,0 +1,44 @@
+import collections
+import os
+import threading
+from PIL import Image
+
+# Largest size of a preview, the aspect ratio is kept and smaller images are shown as they are.
+PREVIEW_SIZE = (600, 300)
+# Thumbnails kept in memory, the least recently used one is dropped first.
+CACHE_SIZE = 32
+
+def createThumbnail(path: str, size: tuple[int, int] = PREVIEW_SIZE) -> Image.Image:
+    with Image.open(path) as img:
+        # JPEG is decoded at 1/2, 1/4 or 1/8 of its size, the nearest that is still larger than
+        # the preview, so that a huge photo costs about as much as a small one. Other formats
+        # have no draft mode and are decoded fully, then shrunk with reduce() before resampling.
+        img.draft('RGB', (size[0] * 2, size[1] * 2))
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            # Paletted and other images can only be resized with nearest neighbour.
+            img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB')
+        img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.)
+        # The opened image can no longer be used once the file is closed.
+        return img.copy()
+
+class PreviewCache:
+    # Recent thumbnails keyed by path and modification time, so that choosing an image again
+    # shows it without decoding, while a file that was modified is decoded again.
+    def __init__(self, size: int = CACHE_SIZE) -> None:
+        self.size = size
+        self.entries: collections.OrderedDict[tuple[str, int], Image.Image] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> Image.Image:
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+        with self.lock:
+            thumb = self.entries.get(key)
+            if thumb:
+                self.entries.move_to_end(key)
+                return thumb
+        thumb = createThumbnail(path)
+        with self.lock:
+            self.entries[key] = thumb
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return thumb
@@ -0,0 +1,53 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import typing
+from PIL import Image
+
+PROBE_WORKERS = 8
+# Images kept in the index, the least recently used one is dropped first. The index lives as
+# long as the process, e.g. while watching a folder or serving jobs, and a pre-flight of a
+# larger folder only probes the dropped images again.
+MAX_ENTRIES = 65536
+
+class ImageInfo(typing.NamedTuple):
+    size: tuple[int, int]
+    mode: str
+    frameCount: int
+
+class ProbeIndex:
+    # Header information of input images, so that estimating work opens each image once.
+    # Entries are validated by the size and modification time of the file.
+    def __init__(self, size: int = MAX_ENTRIES) -> None:
+        self.size = size
+        self.entries: collections.OrderedDict[str, tuple[tuple[int, int], ImageInfo]] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> ImageInfo:
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == stamp:
+                self.entries.move_to_end(path)
+                return entry[1]
+        with Image.open(path) as img:
+            info = ImageInfo(img.size, img.mode, getattr(img, 'n_frames', 1))
+        with self.lock:
+            self.entries[path] = (stamp, info)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return info
+
+    def probe(self, path: str) -> ImageInfo | None:
+        try:
+            return self.get(path)
+        except OSError:
+            return None
+
+    def probeAll(self, paths: typing.Iterable[str], workers: int = PROBE_WORKERS) -> list[ImageInfo | None]:
+        # Reading headers mostly waits for the disk, which threads overlap well.
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(self.probe, paths))
@@ -0,0 +1,110 @@
+import datetime
+import re
+import threading
+import time
+import typing
+
+PERCENT_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)%\s*$')
+
+class ProgressEvent(typing.NamedTuple):
+    taskID: int
+    # Zero-based index of the pass of the executable.
+    passIndex: int
+    passCount: int
+    # Progress of the current pass of the task.
+    percent: float
+    # Throughput of the current pass, in output pixels.
+    pixelsPerSecond: float
+    # Progress of the whole queue, in output pixels.
+    donePixels: float
+    totalPixels: float
+    # Seconds left, None until enough work is done to measure the throughput.
+    eta: float | None
+
+class ProgressTracker:
+    # Aggregates the progress of every run of the executable into progress of the whole queue.
+    # Work is counted in output pixels like the planner does, and the ETA is the remaining work
+    # times the seconds per pixel measured since the first run started.
+    def __init__(self, callback: typing.Callable[[ProgressEvent], None] | None = None) -> None:
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.totalPixels = 0.
+        self.donePixels = 0.
+        # Work done by the executable, unlike work skipped thanks to cached results.
+        self.measuredPixels = 0.
+        self.startTime: float | None = None
+
+    def addWork(self, pixels: float) -> None:
+        # Estimates are corrected by adding the difference, which may be negative.
+        with self.lock:
+            self.totalPixels += pixels
+
+    def skipWork(self, pixels: float) -> None:
+        with self.lock:
+            self.donePixels += pixels
+
+    def createPass(self, taskID: int, passIndex: int, passCount: int, pixels: float, imageCount: int = 1) -> 'PassProgress':
+        with self.lock:
+            if self.startTime is None:
+                self.startTime = time.perf_counter()
+        return PassProgress(self, taskID, passIndex, passCount, pixels, imageCount)
+
+    def getETA(self) -> float | None:
+        if not self.measuredPixels:
+            return None
+        secondsPerPixel = (time.perf_counter() - self.startTime) / self.measuredPixels
+        return max(self.totalPixels - self.donePixels, 0) * secondsPerPixel
+
+    def advance(self, p: 'PassProgress', pixels: float) -> None:
+        with self.lock:
+            self.donePixels += pixels
+            self.measuredPixels += pixels
+            elapsed = time.perf_counter() - p.startTime
+            event = ProgressEvent(
+                p.taskID, p.passIndex, p.passCount,
+                p.reportedPixels / p.pixels * 100 if p.pixels else 100.,
+                p.reportedPixels / elapsed if elapsed else 0.,
+                self.donePixels, max(self.totalPixels, self.donePixels),
+                self.getETA(),
+            )
+        if self.callback:
+            self.callback(event)
+
+class PassProgress:
+    # Progress of one run of the executable, fed with its stderr lines. A batch run prints the
+    # percentage of each image in turn, followed by a line ending with " done".
+    def __init__(self, tracker: ProgressTracker, taskID: int, passIndex: int, passCount: int, pixels: float, imageCount: int) -> None:
+        self.tracker = tracker
+        self.taskID = taskID
+        self.passIndex = passIndex
+        self.passCount = passCount
+        self.pixels = pixels
+        self.imageCount = imageCount
+        self.completedImages = 0
+        self.reportedPixels = 0.
+        self.startTime = time.perf_counter()
+
+    def feed(self, line: str) -> None:
+        if line.endswith(' done\n'):
+            self.completedImages += 1
+            self.update(self.completedImages / self.imageCount)
+        elif m := PERCENT_PATTERN.match(line):
+            self.update((self.completedImages + float(m.group(1)) / 100) / self.imageCount)
+
+    def update(self, fraction: float) -> None:
+        pixels = min(fraction, 1) * self.pixels
+        if pixels > self.reportedPixels:
+            delta = pixels - self.reportedPixels
+            self.reportedPixels = pixels
+            self.tracker.advance(self, delta)
+
+    def finish(self) -> None:
+        self.update(1)
+
+def formatProgress(event: ProgressEvent) -> str:
+    eta = '--:--:--' if event.eta is None else str(datetime.timedelta(seconds=round(event.eta)))
+    return (
+        f'Progress: {event.donePixels / event.totalPixels if event.totalPixels else 1:.1%} '
+        f'({event.donePixels / 1e6:.1f}/{event.totalPixels / 1e6:.1f}MP), '
+        f'{event.pixelsPerSecond / 1e6:.2f}MP/s, ETA {eta}\n'
+    )
@@ -0,0 +1,127 @@
+import contextlib
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import typing
+from PIL import Image
+
+# Intermediate files only need to survive until the next pass reads them. PNG is lossless,
+# accepted by the executable on every platform and much cheaper to encode than lossless WebP.
+INTERMEDIATE_EXT = '.png'
+OUTPUT_EXTS = {'.png', '.jpg', '.jpeg', '.webp'}
+
+def saveIntermediate(img: Image.Image, path: str) -> None:
+    img.save(path, compress_level=1)
+
+def getPathSize(path: str) -> int:
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(
+            os.path.getsize(os.path.join(curDir, f))
+            for curDir, dirs, files in os.walk(path)
+            for f in files
+        )
+    except OSError:
+        return 0
+
+def removePath(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class ScratchSession:
+    def __init__(self, space: 'ScratchSpace') -> None:
+        self.space = space
+        self.paths: list[str] = []
+
+    def createPath(self, ext: str) -> str:
+        path = self.space.createPath(ext)
+        self.paths.append(path)
+        return path
+
+class ScratchGroup:
+    # Files shared by the tasks of one input, e.g. the frames of a GIF. Once the tasks are
+    # dropped, the files are released again whenever one of them ends, so that a task that
+    # was still running does not leave the files it writes behind.
+    def __init__(self, space: 'ScratchSpace') -> None:
+        self.space = space
+        self.paths: list[str] = []
+        self.dropped = False
+
+    def createPath(self, ext: str) -> str:
+        path = self.space.createPath(ext)
+        self.paths.append(path)
+        return path
+
+    def drop(self) -> None:
+        self.dropped = True
+        self.release()
+
+    def release(self) -> None:
+        for path in self.paths:
+            self.space.release(path)
+
+class ScratchSpace:
+    def __init__(self, root: str | None = None, budget: int = 0) -> None:
+        self.root = root or tempfile.gettempdir()
+        self.budget = budget
+        self.paths: set[str] = set()
+        self.sessions = 0
+        self.peakUsage = 0
+        self.condition = threading.Condition()
+        os.makedirs(self.root, exist_ok=True)
+
+    def createPath(self, ext: str) -> str:
+        path = os.path.join(self.root, secrets.token_urlsafe(12) + ext)
+        with self.condition:
+            self.paths.add(path)
+        return path
+
+    def release(self, path: str) -> None:
+        removePath(path)
+        with self.condition:
+            self.paths.discard(path)
+            self.condition.notify_all()
+
+    def getUsage(self) -> int:
+        with self.condition:
+            paths = tuple(self.paths)
+        usage = sum(getPathSize(p) for p in paths)
+        with self.condition:
+            self.peakUsage = max(self.peakUsage, usage)
+        return usage
+
+    @contextlib.contextmanager
+    def session(self) -> typing.Iterator[ScratchSession]:
+        # A new session waits while the budget is exceeded, unless nothing else is running
+        # that could free space.
+        with self.condition:
+            while self.budget and self.sessions and self.getUsage() > self.budget:
+                self.condition.wait(1)
+            self.sessions += 1
+        s = ScratchSession(self)
+        try:
+            yield s
+        finally:
+            self.getUsage()
+            for path in s.paths:
+                self.release(path)
+            with self.condition:
+                self.sessions -= 1
+                self.condition.notify_all()
+
+    def cleanup(self) -> None:
+        with self.condition:
+            paths = tuple(self.paths)
+        for path in paths:
+            self.release(path)
+
+    def getSummary(self) -> str:
+        return f'Scratch: {self.root}, peak usage {self.peakUsage / 1048576:.1f}MiB' + (f' of {self.budget / 1048576:.1f}MiB budget' if self.budget else '') + '.\n'
@@ -0,0 +1,476 @@
+import argparse
+import collections
+import http.server
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+import time
+import typing
+import uuid
+
+import backend
+import cache
+import catalog
+import cli
+import param
+import progress
+import task
+import tuner
+
+DEFAULT_PORT = 8765
+# Jobs queued or running at the same time, further submissions are refused until some finish.
+MAX_ACTIVE_JOBS = 256
+# Finished jobs kept for status and results, the oldest are forgotten first.
+MAX_FINISHED_JOBS = 1000
+# Log lines kept per job.
+MAX_JOB_LINES = 1000
+# Seconds between keep-alive comments of an idle event stream.
+KEEPALIVE_INTERVAL = 15
+FINAL_STATES = {'done', 'failed', 'cancelled'}
+# Host names always accepted in the Host header, others only when the server listens on them
+# or they are allowed explicitly, so that a web page cannot reach the server by DNS rebinding.
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+# Config fields a job may set, gpuID is chosen by the worker that runs the job.
+CONFIG_FIELDS = {
+    'model', 'modelFactor', 'resizeMode', 'resizeModeValue', 'downsample', 'tileSize',
+    'useTTA', 'mergeGIFFrames', 'mixModels', 'preDownscale', 'splitSize',
+}
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    # Output callback of every task of the job, which is how its log and progress are
+    # collected. Once cancelled or failed it raises instead, so that the tasks of the job stop
+    # at their next line of output, including a running executable.
+    def __init__(self, jobID: str, inputPath: str, outputPath: str, config: param.REConfigParams) -> None:
+        self.jobID = jobID
+        self.inputPath = inputPath
+        self.outputPath = outputPath
+        self.config = config
+        self.state = 'queued'
+        self.error: str | None = None
+        # Progress of the current run of the executable, parsed from its output.
+        self.percent = 0.
+        self.lines: collections.deque[str] = collections.deque(maxlen=MAX_JOB_LINES)
+        self.lineCount = 0
+        # Incremented on every change, so that event streams can wait for the next one.
+        self.version = 0
+        self.submitTime = time.time()
+        self.startTime: float | None = None
+        self.endTime: float | None = None
+        self.condition = threading.Condition()
+
+    def __call__(self, s: str) -> None:
+        with self.condition:
+            if self.state in ('cancelled', 'failed'):
+                raise JobCancelled(f'job {self.jobID} was {self.state}')
+            if self.state == 'queued':
+                self.state = 'running'
+                self.startTime = time.time()
+            if m := progress.PERCENT_PATTERN.match(s):
+                self.percent = float(m.group(1))
+            else:
+                self.lines.append(s)
+                self.lineCount += 1
+            self.version += 1
+            self.condition.notify_all()
+
+    def finish(self, state: str, error: str | None = None) -> bool:
+        with self.condition:
+            if self.state in FINAL_STATES:
+                return False
+            self.state = state
+            self.error = error
+            self.endTime = time.time()
+            self.version += 1
+            self.condition.notify_all()
+            return True
+
+    def getStatus(self) -> dict:
+        with self.condition:
+            return {
+                'id': self.jobID,
+                'state': self.state,
+                'input': self.inputPath,
+                'output': self.outputPath,
+                'percent': 100. if self.state == 'done' else self.percent,
+                'error': self.error,
+                'submitTime': self.submitTime,
+                'startTime': self.startTime,
+                'endTime': self.endTime,
+                'lines': self.lineCount,
+            }
+
+    def getLines(self, start: int) -> list[str]:
+        with self.condition:
+            first = self.lineCount - len(self.lines)
+            return list(self.lines)[max(start - first, 0):]
+
+    def waitForChange(self, version: int, timeout: float) -> int:
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+class JobService:
+    # Runs the jobs of every request on one queue with one runner, which lives as long as the
+    # service. The service holds a producer of the queue open, so that the workers wait for
+    # the next job instead of finishing, and the backend keeps whatever it keeps loaded.
+    def __init__(
+        self,
+        defaults: param.REConfigParams,
+        models: typing.Sequence[str],
+        jobsDir: str,
+        gpuIDs: typing.Sequence[int],
+        resultCache: cache.ResultCache | None = None,
+        outputCallback: typing.Callable[[str], None] = sys.stderr.write,
+    ) -> None:
+        self.defaults = defaults
+        self.models = models
+        self.jobsDir = jobsDir
+        self.gpuIDs = gpuIDs
+        self.resultCache = resultCache
+        self.outputCallback = outputCallback
+        self.jobs: collections.OrderedDict[str, Job] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.queue = task.TaskQueue()
+        self.queue.keepGoing = True
+        self.latestProgress: progress.ProgressEvent | None = None
+        self.runner: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.queue.openProducer()
+        self.runner = threading.Thread(
+            target=task.taskRunner,
+            args=(self.queue, self.outputCallback, task.scratchSpace.cleanup, self.gpuIDs, self.setProgress, self.reportError),
+            daemon=True,
+        )
+        self.runner.start()
+
+    def close(self) -> None:
+        # Jobs still queued are finished before the runner returns.
+        self.queue.closeProducer()
+        if self.runner:
+            self.runner.join()
+
+    def setProgress(self, event: progress.ProgressEvent) -> None:
+        self.latestProgress = event
+
+    def reportError(self, t: task.AbstractTask, ex: Exception) -> None:
+        if not isinstance(t.outputCallback, Job):
+            return
+        if t.outputCallback.finish('failed', f'{type(ex).__name__}: {ex}'):
+            self.outputCallback(f'Job {t.outputCallback.jobID} failed.\n')
+        # The rest of the job could never complete, e.g. the frames of a GIF after a frame failed.
+        self.queue.discard(t.outputCallback)
+
+    def buildConfig(self, values: dict) -> param.REConfigParams:
+        unknown = values.keys() - CONFIG_FIELDS
+        if unknown:
+            raise ValueError(f'unknown config fields: {", ".join(sorted(unknown))}')
+        values = dict(values)
+        mixModels = values.pop('mixModels', bool(self.defaults.planModels))
+        if 'resizeMode' in values:
+            mode = values['resizeMode']
+            values['resizeMode'] = param.ResizeMode[mode.upper()] if isinstance(mode, str) else param.ResizeMode(mode)
+        if 'downsample' in values:
+            values['downsample'] = cli.DOWNSAMPLE[values['downsample'].lower()]
+        if 'tileSize' in values:
+            values['tileSize'] = cli.parseTileSize(str(values['tileSize']))
+        config = self.defaults._replace(**values)
+        if self.models and config.model not in self.models:
+            raise ValueError(f'unknown model: {config.model}')
+        if 'model' in values and 'modelFactor' not in values:
+            config = config._replace(modelFactor=catalog.getModelFactor(config.model))
+        if config.resizeModeValue <= 0:
+            raise ValueError(f'invalid resizeModeValue: {config.resizeModeValue}')
+        if config.splitSize and config.splitSize < 4 * task.TILE_OVERLAP:
+            raise ValueError(f'splitSize must be 0 or at least {4 * task.TILE_OVERLAP}')
+        return config._replace(planModels=tuple(catalog.getModelFamily(config.model, self.models)) if mixModels and self.models else ())
+
+    def submit(self, body: dict) -> Job:
+        inputPath = body.get('input')
+        if not isinstance(inputPath, str) or not os.path.isfile(inputPath):
+            raise ValueError(f'input is not a file: {inputPath}')
+        if os.path.splitext(inputPath)[1].lower() not in task.IMAGE_EXTS:
+            raise ValueError('only JPEG, PNG, GIF and WebP images are supported')
+        try:
+            config = self.buildConfig(body.get('config', {}))
+        except (KeyError, TypeError, AttributeError, argparse.ArgumentTypeError) as ex:
+            raise ValueError(f'invalid config: {ex}')
+        outputPath = body.get('output')
+        if outputPath:
+            # Relative paths would depend on the folder the server was started in. Jobs only
+            # create files, so that a request cannot replace files it does not own.
+            if not isinstance(outputPath, str) or not os.path.isabs(outputPath):
+                raise ValueError(f'output must be an absolute path: {outputPath}')
+            if os.path.lexists(outputPath):
+                raise ValueError(f'output already exists: {outputPath}')
+        jobID = uuid.uuid4().hex
+        # Without an output path the result is kept in the jobs folder until the job is deleted.
+        outputPath = outputPath or os.path.join(self.jobsDir, jobID, os.path.basename(inputPath))
+        job = Job(jobID, os.path.abspath(inputPath), os.path.abspath(outputPath), config)
+        try:
+            t = task.createTask(job, job.inputPath, job.outputPath, config, self.queue, self.resultCache)
+        except OSError as ex:
+            raise ValueError(f'cannot read input: {ex}')
+
+        def complete() -> None:
+            if job.finish('done'):
+                self.outputCallback(f'Job {jobID} done.\n')
+
+        t.completeCallbacks.append(complete)
+        with self.lock:
+            if sum(x.state not in FINAL_STATES for x in self.jobs.values()) >= MAX_ACTIVE_JOBS:
+                raise OverflowError(f'too many jobs, at most {MAX_ACTIVE_JOBS} may be queued or running')
+            if any(x.outputPath == job.outputPath and x.state not in FINAL_STATES for x in self.jobs.values()):
+                raise ValueError(f'output is used by another job: {job.outputPath}')
+            self.jobs[jobID] = job
+            self.forgetFinishedJobs()
+        self.outputCallback(f'Job {jobID} queued: {job.inputPath} -> {job.outputPath}\n')
+        self.queue.push(t)
+        return job
+
+    def get(self, jobID: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(jobID)
+
+    def listJobs(self) -> list[Job]:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, jobID: str) -> Job | None:
+        job = self.get(jobID)
+        if not job:
+            return None
+        if job.finish('cancelled'):
+            # Tasks that have not started are dropped, running ones stop at their next output.
+            self.queue.discard(job)
+            self.outputCallback(f'Job {jobID} cancelled.\n')
+        else:
+            # A finished job is forgotten, together with the result kept in the jobs folder.
+            with self.lock:
+                self.jobs.pop(jobID, None)
+            self.removeJobDir(jobID)
+        return job
+
+    def forgetFinishedJobs(self) -> None:
+        finished = [x.jobID for x in self.jobs.values() if x.state in FINAL_STATES]
+        for jobID in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[jobID]
+            self.removeJobDir(jobID)
+
+    def removeJobDir(self, jobID: str) -> None:
+        shutil.rmtree(os.path.join(self.jobsDir, jobID), ignore_errors=True)
+
+    def getStatus(self) -> dict:
+        jobs = self.listJobs()
+        event = self.latestProgress
+        return {
+            'workers': len(self.gpuIDs),
+            'backend': task.inferenceBackend.describe(),
+            'jobs': {s: sum(x.state == s for x in jobs) for s in ('queued', 'running', *sorted(FINAL_STATES))},
+            'progress': event._asdict() if event else None,
+        }
+
+class JobRequestHandler(http.server.BaseHTTPRequestHandler):
+    server: 'JobServer'
+
+    def log_request(self, code: int | str = '-', size: int | str = '-') -> None:
+        # Status polling would flood the log, jobs report their own progress; errors are still logged.
+        pass
+
+    def sendJSON(self, status: int, value: typing.Any) -> None:
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendError(self, status: int, message: str) -> None:
+        self.sendJSON(status, {'error': message})
+
+    def getRoute(self) -> list[str]:
+        return self.path.split('?')[0].strip('/').split('/')
+
+    def checkHost(self) -> bool:
+        host = self.headers.get('Host', '')
+        # Strip the port, IPv6 addresses are in brackets.
+        host = host[1:host.find(']')] if host.startswith('[') else host.rsplit(':', 1)[0]
+        if host.lower() in self.server.allowedHosts:
+            return True
+        self.sendError(403, f'host not allowed: {host}')
+        return False
+
+    def do_GET(self) -> None:
+        if not self.checkHost():
+            return
+        service = self.server.service
+        match self.getRoute():
+            case ['status']:
+                self.sendJSON(200, service.getStatus())
+            case ['jobs']:
+                self.sendJSON(200, [x.getStatus() for x in service.listJobs()])
+            case ['jobs', jobID, *rest] if rest in ([], ['events'], ['result']):
+                job = service.get(jobID)
+                if not job:
+                    self.sendError(404, f'no such job: {jobID}')
+                elif rest == ['events']:
+                    self.streamEvents(job)
+                elif rest == ['result']:
+                    self.sendResult(job)
+                else:
+                    self.sendJSON(200, job.getStatus())
+            case _:
+                self.sendError(404, f'not found: {self.path}')
+
+    def do_POST(self) -> None:
+        if not self.checkHost():
+            return
+        if self.getRoute() != ['jobs']:
+            return self.sendError(404, f'not found: {self.path}')
+        # Browsers only send other content types cross-origin without asking the server first.
+        if self.headers.get_content_type() != 'application/json':
+            return self.sendError(415, 'the request must be application/json')
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('the request must be a JSON object')
+            job = self.server.service.submit(body)
+        except ValueError as ex:
+            return self.sendError(400, str(ex))
+        except OverflowError as ex:
+            return self.sendError(503, str(ex))
+        self.sendJSON(201, job.getStatus())
+
+    def do_DELETE(self) -> None:
+        if not self.checkHost():
+            return
+        match self.getRoute():
+            case ['jobs', jobID]:
+                job = self.server.service.cancel(jobID)
+                if job:
+                    self.sendJSON(200, job.getStatus())
+                else:
+                    self.sendError(404, f'no such job: {jobID}')
+            case _:
+                self.sendError(404, f'not found: {self.path}')
+
+    def sendResult(self, job: Job) -> None:
+        if job.state != 'done':
+            return self.sendError(409, f'job is {job.state}')
+        try:
+            f = open(job.outputPath, 'rb')
+        except OSError as ex:
+            return self.sendError(410, str(ex))
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', mimetypes.guess_type(job.outputPath)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(job.outputPath)}"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def streamEvents(self, job: Job) -> None:
+        # Server-sent events: every log line of the job, and its status whenever it changes,
+        # until the job is finished. The response ends with the connection.
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        lineCount = 0
+        version = -1
+        try:
+            while True:
+                newVersion = job.waitForChange(version, KEEPALIVE_INTERVAL)
+                if newVersion == version:
+                    self.wfile.write(b': keepalive\n\n')
+                    self.wfile.flush()
+                    continue
+                version = newVersion
+                lines = job.getLines(lineCount)
+                lineCount += len(lines)
+                status = job.getStatus()
+                events = [('log', {'line': x}) for x in lines] + [('status', status)]
+                self.wfile.write(''.join(f'event: {name}\ndata: {json.dumps(data)}\n\n' for name, data in events).encode('utf-8'))
+                self.wfile.flush()
+                if status['state'] in FINAL_STATES and lineCount >= status['lines']:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class JobServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: JobService, allowedHosts: typing.Iterable[str] = ()) -> None:
+        super().__init__(address, JobRequestHandler)
+        self.service = service
+        self.allowedHosts = LOCAL_HOSTS | {x.lower() for x in allowedHosts}
+        if address[0] not in ('', '0.0.0.0', '::'):
+            self.allowedHosts.add(address[0].lower())
+
+def buildArgumentParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='realesrgan-server',
+        description='Serve upscale jobs over HTTP on this machine, see README for the endpoints.',
+    )
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: %(default)s)')
+    parser.add_argument('--allowed-host', action='append', default=[], help='host name clients may use to reach the server besides localhost and the listening address, may be repeated')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('--jobs-dir', default=os.path.join(task.APP_PATH, 'jobs'), help='folder of the results of jobs submitted without an output path (default: next to this program)')
+    parser.add_argument('-n', '--model', default='realesrgan-x4plus', help='default model name (default: %(default)s)')
+    parser.add_argument('-s', '--scale', type=int, default=4, help='default scale ratio (default: %(default)s)')
+    parser.add_argument('-t', '--tile-size', type=cli.parseTileSize, default=0, help='default tile size, 0 for auto, "tuned" for the tuned profiles (default: %(default)s)')
+    parser.add_argument('-g', '--gpu-id', type=cli.parseGPUIDs, default=(0,), help='GPU IDs of the workers, e.g. 0,0,1 (default: 0)')
+    parser.add_argument('-e', '--executable', default=task.RE_EXECUTABLE, help='path of realesrgan-ncnn-vulkan, the models are read from the models folder next to it (default: next to this program)')
+    parser.add_argument('--backend', choices=('vulkan', 'cpu'), default='vulkan', help='run realesrgan-ncnn-vulkan, or run the models in this process on the CPU (default: %(default)s)')
+    parser.add_argument('--cpu-threads', type=int, default=0, help='threads of the CPU backend, 0 for all cores (default: %(default)s)')
+    parser.add_argument('--tile-profiles', default=os.path.join(task.APP_PATH, 'tile-profiles.json'), help='file of the tuned tile sizes (default: next to this program)')
+    parser.add_argument('--cache-dir', help='cache upscaled results in this folder, see cli.py')
+    parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of the result cache in MiB (default: %(default)s)')
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    parser = buildArgumentParser()
+    args = parser.parse_args(argv)
+    if args.backend == 'vulkan' and not os.path.exists(args.executable):
+        parser.error(f'executable does not exist: {args.executable}')
+    modelDir = os.path.join(os.path.dirname(os.path.realpath(args.executable)), 'models')
+    models = catalog.listModels(modelDir) if os.path.isdir(modelDir) else []
+    if models and args.model not in models:
+        parser.error(f'model not found in {modelDir}: {args.model}')
+    if args.backend == 'cpu':
+        try:
+            task.inferenceBackend = backend.CPUBackend(modelDir, args.cpu_threads)
+        except ImportError as ex:
+            parser.error(f'the CPU backend needs the ncnn and numpy packages: {ex}')
+    else:
+        task.RE_EXECUTABLE = os.path.realpath(args.executable)
+        task.inferenceBackend = backend.SpawnBackend(task.RE_EXECUTABLE)
+    task.tileProfiles = tuner.TileProfiles(args.tile_profiles)
+
+    defaults = param.REConfigParams(
+        args.model, catalog.getModelFactor(args.model),
+        param.ResizeMode.RATIO, args.scale,
+        cli.DOWNSAMPLE['lanczos'], args.tile_size, args.gpu_id[0], False,
+    )
+    resultCache = cache.ResultCache(args.cache_dir, args.cache_size * 1048576) if args.cache_dir else None
+    service = JobService(defaults, models, args.jobs_dir, args.gpu_id, resultCache)
+    service.start()
+    server = JobServer((args.host, args.port), service, args.allowed_host)
+    sys.stderr.write(f'Serving jobs on http://{args.host}:{server.server_address[1]}/ with {len(args.gpu_id)} workers, using {task.inferenceBackend.describe()}\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write('Stopping, queued jobs are finished first.\n')
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
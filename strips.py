@@ -0,0 +1,149 @@
+import typing
+from PIL import Image
+
+import scratch
+
+MODES = {'RGB', 'RGBA'}
+STRIP_ROWS = 256
+BLOCK_BYTES = 8 * 1048576
+# Smaller images are resized in one go, which is faster and gives the same result.
+MIN_STREAM_PIXELS = 1 << 24
+
+def readAt(f: typing.BinaryIO, size: int, offset: int) -> bytes:
+    # os.pread is POSIX only, seeking works everywhere.
+    f.seek(offset)
+    return f.read(size)
+
+class ImageStripWriter:
+    # Assembles strips into an image for formats that cannot be written incrementally, so the
+    # whole output is held in memory; only PNG outputs are streamed, by pngstream.PNGWriter.
+    def __init__(self, path: str, size: tuple[int, int], mode: str, save: typing.Callable[[Image.Image, str], None]) -> None:
+        self.path = path
+        self.img = Image.new(mode, size)
+        self.rows = 0
+        self.save = save
+
+    def __enter__(self) -> 'ImageStripWriter':
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        if excType:
+            self.img.close()
+        else:
+            self.close()
+
+    def write(self, strip: Image.Image) -> None:
+        self.img.paste(strip, (0, self.rows))
+        self.rows += strip.size[1]
+
+    def close(self) -> None:
+        try:
+            self.save(self.img, self.path)
+        finally:
+            self.img.close()
+
+class StripResizer:
+    # Gives the same result as Image.resize for an image fed as horizontal strips, while only
+    # holding a few strips in memory. Like Image.resize, the horizontal pass runs first; its
+    # rows are spilled to a scratch file until the vertical pass can read whole columns. The
+    # vertical pass is a horizontal pass over transposed blocks of columns, so both passes use
+    # exactly the coefficients Image.resize uses. Scratch files are accessed with plain reads
+    # and writes rather than mapped, so that their pages never count as used memory.
+    def __init__(
+        self,
+        srcSize: tuple[int, int], dstSize: tuple[int, int],
+        mode: str, resample: 'Image._Resample',
+        writeStrip: typing.Callable[[Image.Image], None],
+        space: scratch.ScratchSpace,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f'unsupported mode for streaming resize: {mode}')
+        self.srcSize = srcSize
+        self.dstSize = dstSize
+        self.mode = mode
+        self.resample = resample
+        self.writeStrip = writeStrip
+        self.space = space
+        # Image.resize premultiplies alpha except for nearest neighbour.
+        self.workMode = 'RGBa' if mode == 'RGBA' and resample != Image.Resampling.NEAREST else mode
+        self.rawMode = {'RGB': 'RGBX', 'RGBA': 'RGBA', 'RGBa': 'RGBa'}[self.workMode]
+        self.rows = 0
+        self.spillPath = space.createPath('.raw') if dstSize[1] != srcSize[1] else None
+        self.spill = open(self.spillPath, 'wb') if self.spillPath else None
+
+    def __enter__(self) -> 'StripResizer':
+        return self
+
+    def __exit__(self, excType, excValue, traceback) -> None:
+        if excType:
+            self.release()
+        else:
+            self.close()
+
+    def emit(self, strip: Image.Image) -> None:
+        self.writeStrip(strip.convert(self.mode) if strip.mode != self.mode else strip)
+
+    def write(self, strip: Image.Image) -> None:
+        if strip.size[0] != self.srcSize[0] or self.rows + strip.size[1] > self.srcSize[1]:
+            raise ValueError(f'strip {strip.size[0]}x{strip.size[1]} does not fit {self.srcSize[0]}x{self.srcSize[1]}')
+        if strip.mode != self.workMode:
+            strip = strip.convert(self.workMode)
+        if self.dstSize[0] != self.srcSize[0]:
+            strip = strip.resize((self.dstSize[0], strip.size[1]), self.resample, (0, 0, *strip.size))
+        self.rows += strip.size[1]
+        if self.spill:
+            self.spill.write(strip.tobytes('raw', self.rawMode))
+        else:
+            self.emit(strip)
+
+    def close(self) -> None:
+        try:
+            if self.rows != self.srcSize[1]:
+                raise ValueError(f'{self.rows} rows written for {self.srcSize[0]}x{self.srcSize[1]}')
+            if self.spill:
+                self.spill.close()
+                self.resizeColumns()
+        finally:
+            self.release()
+
+    def resizeColumns(self) -> None:
+        width, srcHeight = self.dstSize[0], self.srcSize[1]
+        dstHeight = self.dstSize[1]
+        stride = width * 4
+        blockWidth = max(1, BLOCK_BYTES // (srcHeight * 4))
+        outputPath = self.space.createPath('.raw')
+        try:
+            with open(outputPath, 'w+b') as output, open(self.spillPath, 'rb') as spill:
+                for x0 in range(0, width, blockWidth):
+                    x1 = min(x0 + blockWidth, width)
+                    n = (x1 - x0) * 4
+                    data = b''.join(readAt(spill, n, y * stride + x0 * 4) for y in range(srcHeight))
+                    block = Image.frombytes(self.workMode, (x1 - x0, srcHeight), data, 'raw', self.rawMode).transpose(Image.Transpose.TRANSPOSE)
+                    del data
+                    block = block.resize((dstHeight, x1 - x0), self.resample, (0, 0, *block.size))
+                    data = block.transpose(Image.Transpose.TRANSPOSE).tobytes('raw', self.rawMode)
+                    del block
+                    for y in range(dstHeight):
+                        output.seek(y * stride + x0 * 4)
+                        output.write(data[(y * n):(y * n + n)])
+                for y0 in range(0, dstHeight, STRIP_ROWS):
+                    y1 = min(y0 + STRIP_ROWS, dstHeight)
+                    self.emit(Image.frombytes(self.workMode, (width, y1 - y0), readAt(output, (y1 - y0) * stride, y0 * stride), 'raw', self.rawMode))
+        finally:
+            self.space.release(outputPath)
+
+    def release(self) -> None:
+        if self.spillPath:
+            self.spill.close()
+            self.space.release(self.spillPath)
+            self.spillPath = None
+
+def resizeImage(
+    img: Image.Image, dstSize: tuple[int, int],
+    resample: 'Image._Resample',
+    writeStrip: typing.Callable[[Image.Image], None],
+    space: scratch.ScratchSpace,
+) -> None:
+    with StripResizer(img.size, dstSize, img.mode, resample, writeStrip, space) as resizer:
+        for y in range(0, img.size[1], STRIP_ROWS):
+            resizer.write(img.crop((0, y, img.size[0], min(y + STRIP_ROWS, img.size[1]))))
@@ -1,143 +1,559 @@
 import collections
-import secrets
+import concurrent.futures
+import contextlib
+import functools
+import fnmatch
+import hashlib
+import itertools
+import math
 import subprocess
-import io
 import os
+import re
 import shutil
 import sys
-import tempfile
+import threading
 import time
 import typing
 from PIL import Image
 
+import backend
+import cache
+import manifest
+import gifstream
 import param
+import planner
+import pngstream
+import probe
+import progress
+import scratch
+import strips
+import timing
+import tuner
+
+APP_PATH = os.path.dirname(os.path.realpath(sys.executable if hasattr(sys, '_MEIPASS') else __file__))
+RE_EXECUTABLE = os.path.join(APP_PATH, 'realesrgan-ncnn-vulkan' + ('.exe' if os.name == 'nt' else ''))
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+DEFAULT_SPLIT_SIZE = 2048
+TILE_OVERLAP = 16
+TILE_BATCH_SIZE = 16
+GIF_BATCH_SIZE = 16
+# Batches of GIF frames that may be extracted ahead of the merge.
+GIF_WINDOW = 4
+# Threads of the CPU stages around inference: decoding and converting the next inputs, and
+# downsampling and encoding the previous results while the GPU upscales.
+PREPARE_WORKERS = 2
+FINISH_WORKERS = 2
+# Results waiting for or in the finish stage, the GPU workers wait when it is full so that
+# results cannot pile up in memory or on disk.
+FINISH_QUEUE_SIZE = 4
+
+scratchSpace = scratch.ScratchSpace(os.environ.get('REALESRGAN_SCRATCH_DIR'))
+probeIndex = probe.ProbeIndex()
+# Loaded by the front end when tiles are tuned or tuned tile sizes are used.
+tileProfiles: tuner.TileProfiles | None = None
+# Runs every pass of every task, replaced by the front end to use another executable or backend.
+inferenceBackend: backend.Backend = backend.SpawnBackend(RE_EXECUTABLE)
+# Time spent in each task type and stage, measured when enabled.
+stageTimes = timing.StageTimes()
 
 def buildTempPath(ext: str) -> str:
-    return os.path.join(tempfile.gettempdir(), secrets.token_urlsafe(12) + ext)
+    return scratchSpace.createPath(ext)
 
 class AbstractTask:
+    # Whether the runner may call prepare() and finish() on other threads, overlapping them with
+    # the run() of other tasks. Otherwise the task is run entirely on its GPU worker.
+    pipelined = False
+
     def __init__(self, outputCallback: typing.Callable[[str], None]) -> None:
         self.outputCallback = outputCallback
+        self.dependencies: list[AbstractTask] = []
+        self.completeCallbacks: list[typing.Callable[[], None]] = []
+        self.done = threading.Event()
+        self.progress: progress.ProgressTracker | None = None
+        self.taskID = 0
+        # Work counted for the task when the queue was estimated, in output pixels.
+        self.work = 0
+        # Scratch files shared with the other tasks of the same input, e.g. the tiles of an image.
+        self.scratchGroup: scratch.ScratchGroup | None = None
+
+    def complete(self) -> None:
+        for c in self.completeCallbacks:
+            c()
+        self.done.set()
+
+    def ready(self) -> bool:
+        return all(t.done.is_set() for t in self.dependencies)
+
+    def assignDevice(self, gpuID: int) -> None:
+        pass
+
+    def assignProgress(self, tracker: progress.ProgressTracker) -> None:
+        self.progress = tracker
+
+    def estimateWork(self) -> int:
+        # Output pixels of every pass of the executable the task is expected to run, including
+        # the passes of the tasks it splits into.
+        return 0
+
+    def correctWork(self, work: int) -> None:
+        if self.progress:
+            self.progress.addWork(work - self.work)
+        self.work = work
+
+    def createPass(self, passIndex: int, passCount: int, pixels: int, imageCount: int = 1) -> progress.PassProgress | None:
+        return self.progress.createPass(self.taskID, passIndex, passCount, pixels, imageCount) if self.progress else None
+
+    def prepare(self) -> None:
+        # Work before run() that needs no GPU, e.g. decoding and converting the input.
+        pass
 
     def run(self) -> None:
         pass
 
+    def finish(self) -> None:
+        # Work after run() that needs no GPU, e.g. downsampling and encoding the result.
+        pass
+
+    def cleanup(self) -> None:
+        # Releases what the stages handed to each other, called once the task has finished
+        # or failed in any stage.
+        pass
+
+    def discard(self) -> None:
+        # Called for a task that is dropped before it starts, e.g. because its job was cancelled.
+        if self.scratchGroup:
+            self.scratchGroup.drop()
+
+class TaskQueue(collections.deque[AbstractTask]):
+    def __init__(self, iterable: typing.Iterable[AbstractTask] = ()) -> None:
+        super().__init__(iterable)
+        self.condition = threading.Condition()
+        # Sources produce tasks lazily and yield None while they have nothing to offer yet,
+        # with the output callback of the tasks they produce.
+        self.sources: list[tuple[typing.Callable[[str], None], typing.Iterator[AbstractTask | None]]] = []
+        # Producer threads still pushing tasks, workers wait for them instead of finishing.
+        self.producers = 0
+        # Set by the runner when it stops, so that producers stop too.
+        self.stopped = False
+        # Set by a producer that failed, the run then fails too.
+        self.failed = False
+        # Set for producers that never finish on their own, e.g. a folder watch, so that a failed
+        # task fails the run at the end instead of stopping it.
+        self.keepGoing = False
+        self.tracker: progress.ProgressTracker | None = None
+        # Workers of the runner, so that tasks can split their work between all of them.
+        self.workerCount = 1
+
+    def openProducer(self) -> None:
+        # Called before the runner starts, so that it cannot finish before the first push.
+        with self.condition:
+            self.producers += 1
+
+    def closeProducer(self) -> None:
+        with self.condition:
+            self.producers -= 1
+            self.condition.notify_all()
+
+    def push(self, t: AbstractTask) -> bool:
+        with self.condition:
+            if self.stopped:
+                return False
+            tracker = self.tracker
+        # Tasks pushed before the runner starts are estimated by the runner.
+        if tracker:
+            addEstimate(tracker, t)
+        self.append(t)
+        return True
+
+    def appendSource(self, outputCallback: typing.Callable[[str], None], source: typing.Iterator[AbstractTask | None]) -> None:
+        with self.condition:
+            self.sources.append((outputCallback, source))
+            # Pulled right away, so that every source in the queue has started and can release
+            # what it holds when it is closed.
+            self.pull()
+            self.condition.notify_all()
+
+    def discard(self, outputCallback: typing.Callable[[str], None]) -> None:
+        # Drops the tasks and sources of one output callback, e.g. of a cancelled job, and
+        # releases their files. Closing a source lets it release what it has not handed out.
+        with self.condition:
+            tasks = [t for t in self if t.outputCallback is outputCallback]
+            for t in tasks:
+                self.remove(t)
+            sources = [x for x in self.sources if x[0] is outputCallback]
+            for x in sources:
+                self.sources.remove(x)
+                x[1].close()
+            self.condition.notify_all()
+        for t in tasks:
+            t.discard()
+
+    def pull(self) -> None:
+        # Tasks pulled from a source go to the front of the queue, so that work which has
+        # already started is finished before new work is started.
+        n = 0
+        for x in tuple(self.sources):
+            for t in x[1]:
+                if t is None:
+                    break
+                self.insert(n, t)
+                n += 1
+            else:
+                self.sources.remove(x)
+
+    def append(self, t: AbstractTask) -> None:
+        with self.condition:
+            super().append(t)
+            self.condition.notify_all()
+
+    def appendleft(self, t: AbstractTask) -> None:
+        with self.condition:
+            super().appendleft(t)
+            self.condition.notify_all()
+
+    def extend(self, tasks: typing.Iterable[AbstractTask]) -> None:
+        with self.condition:
+            super().extend(tasks)
+            self.condition.notify_all()
+
+    def popReady(self, predicate: typing.Callable[[AbstractTask], bool] | None = None) -> AbstractTask | None:
+        with self.condition:
+            self.pull()
+            for i, t in enumerate(self):
+                if t.ready() and (predicate is None or predicate(t)):
+                    del self[i]
+                    return t
+            return None
+
 class RESpawnTask(AbstractTask):
+    pipelined = True
+
     def __init__(
         self,
         outputCallback: typing.Callable[[str], None],
         inputPath: str, outputPath: str,
         config: param.REConfigParams,
         removeInput: bool = False,
+        resultCache: cache.ResultCache | None = None,
     ) -> None:
         super().__init__(outputCallback)
         self.inputPath = inputPath
         self.outputPath = outputPath
         self.config = config
         self.removeInput = removeInput
+        self.resultCache = resultCache
+        # Passes planned by the owner of the task, e.g. for the tiles of a split image.
+        self.passes: tuple[tuple[str, int], ...] | None = None
+        # Handed from prepare() to run() and finish(). Every temporary file of the task belongs
+        # to the session, which is closed by cleanup() even if the task fails.
+        self.stack = contextlib.ExitStack()
+        self.session: scratch.ScratchSession | None = None
+        self.plan: planner.ScalePlan | None = None
+        self.cacheKey: str | None = None
+        self.cachedPath: str | None = None
+        # The decoded input for in-memory backends, replaced by the result by run().
+        self.image: Image.Image | None = None
+        # The result written by run() for backends that work on files.
+        self.resultPath: str | None = None
 
-    def run(self) -> None:
-        reExecutable = os.path.join(
-            os.path.dirname(os.path.realpath(sys.executable if hasattr(sys, '_MEIPASS') else __file__)),
-            'realesrgan-ncnn-vulkan' + ('.exe' if os.name == 'nt' else ''),
-        )
-        self.outputCallback(f'Using executable: {reExecutable}\n')
+    def getPlan(self, size: tuple[int, int]) -> planner.ScalePlan:
+        return planner.planScale(size, self.config) if self.passes is None else planner.getFixedPlan(size, self.passes)
+
+    def getCacheKey(self, img: Image.Image, plan: planner.ScalePlan) -> str | None:
+        return self.resultCache.getKey(img, self.config, plan, inferenceBackend.getCacheID()) if self.resultCache and plan.passes else None
+
+    def estimateWork(self) -> int:
+        return self.getPlan(probeIndex.get(self.inputPath).size).cost
 
+    def finishFromCache(self, cacheKey: str | None, plan: planner.ScalePlan, session: scratch.ScratchSession) -> bool:
+        cachedPath = self.resultCache.get(cacheKey, session.createPath) if cacheKey else None
+        if not cachedPath:
+            return False
+        self.finishCached(cachedPath, plan)
+        return True
+
+    def finishCached(self, cachedPath: str, plan: planner.ScalePlan) -> None:
+        self.outputCallback(f'Cache hit: {self.inputPath} -> {self.outputPath}\n')
+        if self.progress:
+            self.progress.skipWork(plan.cost)
+        if self.removeInput:
+            scratchSpace.release(self.inputPath)
+        finishOutput(cachedPath, plan.resultSize, self.outputPath, plan.dstSize, self.config.downsample, self.outputCallback)
+
+    def assignDevice(self, gpuID: int) -> None:
+        self.config = self.config._replace(gpuID=gpuID)
+
+    def prepare(self) -> None:
+        self.outputCallback(f'Using {inferenceBackend.describe()}\n')
+        self.session = session = self.stack.enter_context(scratchSpace.session())
         with Image.open(self.inputPath) as img:
-            srcWidth, srcHeight = img.size
-            srcRatio = srcWidth / srcHeight
-            if img.mode == 'P':
-                self.inputPath = buildTempPath('.png')
-                img.convert('RGBA').save(self.inputPath)
+            plan = self.plan = self.getPlan(img.size)
+            self.outputCallback(planner.describePlan(plan))
+            self.cacheKey = self.getCacheKey(img, plan)
+            self.cachedPath = self.resultCache.get(self.cacheKey, session.createPath) if self.cacheKey else None
+            if self.cachedPath:
+                return
+            prepared = prepareInput(img, plan, self.config.downsample)
+            # In-memory backends take the decoded image, nothing is written before the result.
+            if inferenceBackend.inMemory and plan.passes:
+                self.image = prepared or img.copy()
+            elif prepared:
+                self.inputPath = session.createPath(scratch.INTERMEDIATE_EXT)
+                scratch.saveIntermediate(prepared, self.inputPath)
                 self.removeInput = True
-        match self.config.resizeMode:
-            case param.ResizeMode.RATIO:
-                dstWidth = srcWidth * self.config.resizeModeValue
-                dstHeight = srcHeight * self.config.resizeModeValue
-            case param.ResizeMode.WIDTH:
-                dstWidth = self.config.resizeModeValue
-                dstHeight = round(dstWidth / srcRatio)
-            case param.ResizeMode.HEIGHT:
-                dstHeight = self.config.resizeModeValue
-                dstWidth = round(dstHeight * srcRatio)
-        scalePass = 0
-        while srcWidth < dstWidth and srcHeight < dstHeight:
-            scalePass += 1
-            srcWidth *= self.config.modelFactor
-            srcHeight *= self.config.modelFactor
+
+    def run(self) -> None:
+        if self.cachedPath:
+            return
+        if self.image is not None:
+            self.upscaleInMemory()
+            return
+        plan = self.plan
+        session = self.session
 
         # input -> output
         # input -> temp0 -> output
         # input -> temp0 -> temp1 -> output
+        # Intermediate results use the cheapest lossless format, only a result that needs no
+        # downsampling is written in the output format directly.
+        scalePass = len(plan.passes)
         outputExt = os.path.splitext(self.outputPath)[1]
-        files = (self.inputPath, *(buildTempPath(outputExt) for _ in range(scalePass)))
+        resultExt = outputExt if plan.resultSize == plan.dstSize and outputExt.lower() in scratch.OUTPUT_EXTS else scratch.INTERMEDIATE_EXT
+        if scalePass:
+            files = (
+                self.inputPath,
+                *(session.createPath(scratch.INTERMEDIATE_EXT) for _ in range(scalePass - 1)),
+                session.createPath(resultExt),
+            )
+        else:
+            # Nothing to upscale, work on a copy so that the input is never moved or removed.
+            files = (session.createPath(os.path.splitext(self.inputPath)[1]),)
+            shutil.copyfile(self.inputPath, files[0])
+            if self.removeInput:
+                scratchSpace.release(self.inputPath)
+        passCosts = planner.getPassCosts(plan)
         for i in range(len(files) - 1):
             inputPath, outputPath = files[i:(i + 2)]
-            with subprocess.Popen(
-                (
-                    reExecutable,
-                    '-v',
-                    '-i', inputPath,
-                    '-o', outputPath,
-                    '-s', str(self.config.modelFactor),
-                    '-t', str(self.config.tileSize),
-                    '-n', self.config.model,
-                    '-g', str(self.config.gpuID),
-                    ('-x' if self.config.useTTA else ''),
-                ),
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-            ) as p:
-                for line in p.stderr:
-                    self.outputCallback(line)
-            if p.returncode:
-                raise subprocess.CalledProcessError(p.returncode)
+            with stageTimes.measure('infer'):
+                inferenceBackend.runPass(
+                    inputPath, outputPath, getPassConfig(self.config, plan.passes, i, plan.inputSize), self.outputCallback,
+                    passProgress=self.createPass(i, scalePass, passCosts[i]),
+                )
+            scratchSpace.getUsage()
             if i > 0 or self.removeInput:
-                os.remove(inputPath)
+                scratchSpace.release(inputPath)
+        self.resultPath = files[-1]
 
-        os.makedirs(os.path.split(self.outputPath)[0], exist_ok=True)
-        if srcWidth == dstWidth and srcHeight == dstHeight:
-            if os.path.exists(self.outputPath):
-                os.remove(self.outputPath)
-            shutil.move(files[-1], self.outputPath)
+    def upscaleInMemory(self) -> None:
+        plan = self.plan
+        if self.removeInput:
+            scratchSpace.release(self.inputPath)
+        passCosts = planner.getPassCosts(plan)
+        for i in range(len(plan.passes)):
+            with stageTimes.measure('infer'):
+                result = inferenceBackend.upscaleImage(
+                    self.image, getPassConfig(self.config, plan.passes, i, plan.inputSize), self.outputCallback,
+                    self.createPass(i, len(plan.passes), passCosts[i]),
+                )
+            self.image.close()
+            self.image = result
+
+    def finish(self) -> None:
+        plan = self.plan
+        if self.cachedPath:
+            self.finishCached(self.cachedPath, plan)
+        elif self.image is not None:
+            if self.cacheKey:
+                resultPath = self.session.createPath(scratch.INTERMEDIATE_EXT)
+                scratch.saveIntermediate(self.image, resultPath)
+                self.resultCache.put(self.cacheKey, resultPath)
+                scratchSpace.release(resultPath)
+            createParentDir(self.outputPath)
+            with stageTimes.measure('finish'):
+                finishImage(self.image, self.outputPath, plan.dstSize, self.config.downsample, self.outputCallback)
         else:
-            with Image.open(files[-1]) as img:
-                self.outputCallback(f'Downsample from {img.size[0]}x{img.size[1]} to {dstWidth}x{dstHeight}.\n')
-                resized: Image.Image = img.resize((dstWidth, dstHeight), self.config.downsample)
-                resized.save(self.outputPath)
-                resized.close()
-            os.remove(files[-1])
+            if self.cacheKey:
+                self.resultCache.put(self.cacheKey, self.resultPath)
+            finishOutput(self.resultPath, plan.resultSize, self.outputPath, plan.dstSize, self.config.downsample, self.outputCallback)
+
+    def cleanup(self) -> None:
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+        self.stack.close()
+
+class REBatchTask(AbstractTask):
+    pipelined = True
+
+    def __init__(
+        self,
+        outputCallback: typing.Callable[[str], None],
+        tasks: list[RESpawnTask],
+    ) -> None:
+        super().__init__(outputCallback)
+        self.tasks = tasks
+        self.config = tasks[0].config
+        # Handed from prepare() to run() and finish(), like in RESpawnTask.
+        self.stack = contextlib.ExitStack()
+        self.items: list[tuple[RESpawnTask, str, tuple[int, int], tuple[int, int], str | None]] = []
+        self.passes: tuple[tuple[str, int], ...] = ()
+        self.passCosts: list[int] = []
+        self.inputSize = (0, 0)
+        self.stageDir = ''
+        # Staged inputs before run(), the results of the last pass after it.
+        self.resultDir = ''
+        self.finalFormat = ''
+
+    def assignDevice(self, gpuID: int) -> None:
+        self.config = self.config._replace(gpuID=gpuID)
+
+    def assignProgress(self, tracker: progress.ProgressTracker) -> None:
+        super().assignProgress(tracker)
+        # Cache hits of the images in the batch count as skipped work.
+        for t in self.tasks:
+            t.assignProgress(tracker)
+
+    def estimateWork(self) -> int:
+        return sum(t.estimateWork() for t in self.tasks)
+
+    def prepare(self) -> None:
+        self.outputCallback(f'Using {inferenceBackend.describe()}\n')
+        session = self.stack.enter_context(scratchSpace.session())
+        self.stageDir = session.createPath('')
+        # Every image in a batch shares the same (non-empty) sequence of passes, so each pass
+        # is a single run of the executable over the whole staged directory.
+        self.resultDir = inputDir = os.path.join(self.stageDir, '0')
+        os.makedirs(inputDir)
+        for i, t in enumerate(self.tasks):
+            name = f'{i:06d}'
+            with Image.open(t.inputPath) as img:
+                plan = t.getPlan(img.size)
+                self.passes = plan.passes
+                self.outputCallback(planner.describePlan(plan))
+                cacheKey = t.getCacheKey(img, plan)
+                if t.finishFromCache(cacheKey, plan, session):
+                    t.complete()
+                    continue
+                self.passCosts = [a + b for a, b in itertools.zip_longest(self.passCosts, planner.getPassCosts(plan), fillvalue=0)]
+                # Tuned tile sizes are chosen for the largest image of the batch.
+                self.inputSize = max(self.inputSize, plan.inputSize, key=math.prod)
+                prepared = prepareInput(img, plan, t.config.downsample)
+                if prepared:
+                    scratch.saveIntermediate(prepared, os.path.join(inputDir, name + scratch.INTERMEDIATE_EXT))
+                else:
+                    linkOrCopy(t.inputPath, os.path.join(inputDir, name + os.path.splitext(t.inputPath)[1]))
+            self.items.append((t, name, plan.resultSize, plan.dstSize, cacheKey))
+
+        # Same rule as RESpawnTask: lossless intermediates unless no image needs downsampling.
+        if all(resultSize == dstSize for _, _, resultSize, dstSize, _ in self.items):
+            self.finalFormat = getBatchFormat(self.tasks[0].outputPath)
+        else:
+            self.finalFormat = scratch.INTERMEDIATE_EXT[1:]
+
+    def run(self) -> None:
+        if not self.items:
+            return
+        scalePass = len(self.passes)
+        inputDir = self.resultDir
+        self.outputCallback(f'Upscaling {len(self.items)} images in {scalePass} passes.\n')
+        for i in range(scalePass):
+            outputDir = os.path.join(self.stageDir, str(i + 1))
+            os.makedirs(outputDir)
+            completed = 0
+            def passCallback(line: str) -> None:
+                nonlocal completed
+                self.outputCallback(line)
+                if line.endswith(' done\n'):
+                    completed += 1
+                    self.outputCallback(f'Pass {i + 1}/{scalePass}: {completed}/{len(self.items)} images done.\n')
+            with stageTimes.measure('infer'):
+                inferenceBackend.runPass(
+                    inputDir, outputDir, getPassConfig(self.config, self.passes, i, self.inputSize), passCallback,
+                    self.finalFormat if i == scalePass - 1 else scratch.INTERMEDIATE_EXT[1:],
+                    self.createPass(i, scalePass, self.passCosts[i], len(self.items)),
+                )
+            scratchSpace.getUsage()
+            shutil.rmtree(inputDir)
+            inputDir = outputDir
+        self.resultDir = inputDir
+
+    def finish(self) -> None:
+        for t, name, resultSize, dstSize, cacheKey in self.items:
+            resultPath = os.path.join(self.resultDir, f'{name}.{self.finalFormat}')
+            if cacheKey:
+                t.resultCache.put(cacheKey, resultPath)
+            finishOutput(resultPath, resultSize, t.outputPath, dstSize, t.config.downsample, self.outputCallback)
+            if t.removeInput:
+                scratchSpace.release(t.inputPath)
+            t.complete()
+
+    def cleanup(self) -> None:
+        self.stack.close()
 
 class MergeGIFTask(AbstractTask):
     def __init__(
         self,
         outputCallback: typing.Callable[[str], None],
         outputPath: str,
+        writer: gifstream.GIFWriter,
         frames: tuple[str, ...],
         durations: tuple[int, ...],
+        releasePaths: tuple[str, ...] = (),
+        isLast: bool = True,
     ) -> None:
         super().__init__(outputCallback)
         self.outputPath = outputPath
+        self.writer = writer
         self.frames = frames
         self.durations = durations
+        self.releasePaths = releasePaths
+        self.isLast = isLast
 
     def run(self) -> None:
-        self.outputCallback(f'Merging {len(self.frames)} frames to {self.outputPath}\n')
-        frameImgs: list[Image.Image] = []
-        for f in self.frames:
-            b = io.BytesIO()
-            Image.open(f).save(b, 'gif')
-            os.remove(f)
-            img = Image.open(b)
-            if 'transparency' in img.info:
-                paletteMap = list(range(256))
-                paletteMap[0], paletteMap[img.info['transparency']] = paletteMap[img.info['transparency']], paletteMap[0]
-                img = img.remap_palette(paletteMap)
-                img.info['transparency'] = 0
-            frameImgs.append(img)
-        os.makedirs(os.path.split(self.outputPath)[0], exist_ok=True)
-        frameImgs[0].save(self.outputPath, save_all=True, optimize=True, loop=0, duration=self.durations, append_images=frameImgs[1:], disposal=2)
+        self.outputCallback(f'Merging frames #{self.writer.frameCount}-#{self.writer.frameCount + len(self.frames) - 1} to {self.outputPath}\n')
+        for f, d in zip(self.frames, self.durations):
+            with Image.open(f) as img:
+                self.writer.writeFrame(img, d)
+        for f in self.releasePaths:
+            scratchSpace.release(f)
+        if self.isLast:
+            self.writer.close()
+            createParentDir(self.outputPath)
+            if os.path.exists(self.outputPath):
+                os.remove(self.outputPath)
+            shutil.move(self.writer.path, self.outputPath)
+            scratchSpace.release(self.writer.path)
+
+    def discard(self) -> None:
+        self.writer.close()
+        super().discard()
+
+class ExtractGIFFramesTask(AbstractTask):
+    def __init__(
+        self,
+        outputCallback: typing.Callable[[str], None],
+        reader: gifstream.GIFFrameReader,
+        frames: list[tuple[int, str]],
+        isLast: bool,
+    ) -> None:
+        super().__init__(outputCallback)
+        self.reader = reader
+        self.frames = frames
+        self.isLast = isLast
+
+    def run(self) -> None:
+        try:
+            for i, frameSrcPath in self.frames:
+                with self.reader.getFrame(i) as frame:
+                    scratch.saveIntermediate(frame, frameSrcPath)
+        finally:
+            if self.isLast:
+                self.reader.close()
+
+    def discard(self) -> None:
+        # The frames of later batches are never read either.
+        self.reader.close()
+        super().discard()
 
 class SplitGIFTask(AbstractTask):
     def __init__(
@@ -145,53 +561,777 @@ class SplitGIFTask(AbstractTask):
         outputCallback: typing.Callable[[str], None],
         inputPath: str, outputPath: str,
         config: param.REConfigParams,
-        queue: collections.deque[AbstractTask],
+        queue: TaskQueue,
+        resultCache: cache.ResultCache | None = None,
+        jobManifest: manifest.JobManifest | None = None,
     ) -> None:
         super().__init__(outputCallback)
         self.inputPath = inputPath
         self.outputPath = outputPath
         self.config = config
         self.queue = queue
+        self.resultCache = resultCache
+        self.jobManifest = jobManifest
+
+    def assignDevice(self, gpuID: int) -> None:
+        self.config = self.config._replace(gpuID=gpuID)
+
+    def estimateWork(self) -> int:
+        # Every frame is counted until the frames that need upscaling are known.
+        info = probeIndex.get(self.inputPath)
+        self.work = info.frameCount * planner.planScale(info.size, self.config).cost
+        return self.work
 
     def run(self) -> None:
-        frames = []
-        durations = []
-        tasks = []
+        frames: list[str] = []
+        durations: list[int] = []
+        # Upscaled frame path -> (index of the source frame, source frame path or None if the
+        # frame is already upscaled, hash of the frame).
+        sources: dict[str, tuple[int, str | None, str]] = {}
+        # Identical frames (holds, loops, ping-pong) are only upscaled once and shared by every
+        # frame that shows the same composited image. Without a manifest, a frame is only shared
+        # within GIF_WINDOW batches, so that scratch usage does not grow with the animation.
+        lastSeen: dict[bytes, tuple[int, int, str]] = {}
+        frameCount = 0
+        sampler = gifstream.PaletteSampler()
+        # With a manifest, frames live in a work folder named after the input inside the output
+        # tree, so that frames upscaled before a crash are reused by the next run.
+        workDir = self.jobManifest.getWorkDir(self.inputPath) if self.jobManifest else None
+        if workDir:
+            os.makedirs(workDir, exist_ok=True)
+        # Scratch files of the frames and the GIF, shared by every task of the GIF.
+        group = self.scratchGroup = scratch.ScratchGroup(scratchSpace)
+        # This pass only decodes the frames, they are written to disk later, batch by batch.
         with Image.open(self.inputPath) as img:
             while True:
                 try:
-                    frameSrcPath = buildTempPath('.webp')
-                    frameDstPath = buildTempPath('.webp')
+                    d = img.info['duration']
                     with Image.new('RGBA', img.size) as frame:
                         frame.paste(img)
-                        frame.save(frameSrcPath, lossless=True)
-                    d = img.info['duration']
-                    self.outputCallback(f'Frame #{len(frames)}: {frameSrcPath} -> {frameDstPath} Duration: {d}\n')
-                    frames.append(frameDstPath)
-                    durations.append(d)
-                    tasks.append(RESpawnTask(self.outputCallback, frameSrcPath, frameDstPath, self.config, True))
+                        h = hashlib.blake2b(frame.tobytes(), digest_size=16).digest()
+                        # Every distinct frame contributes to the palette shared by the whole GIF.
+                        if h not in lastSeen:
+                            sampler.add(frame)
+                    if h in lastSeen and (workDir or len(frames) - lastSeen[h][0] <= GIF_WINDOW * GIF_BATCH_SIZE):
+                        _, i, frameDstPath = lastSeen[h]
+                        if self.config.mergeGIFFrames and frames[-1] == frameDstPath:
+                            self.outputCallback(f'Frame #{frameCount}: Merged into previous frame Duration: {d}\n')
+                            durations[-1] += d
+                        else:
+                            self.outputCallback(f'Frame #{frameCount}: Same as frame #{i} Duration: {d}\n')
+                            frames.append(frameDstPath)
+                            durations.append(d)
+                        lastSeen[h] = (len(frames) - 1, i, frameDstPath)
+                    else:
+                        if workDir:
+                            frameSrcPath = os.path.join(workDir, h.hex() + '-src' + scratch.INTERMEDIATE_EXT)
+                            frameDstPath = os.path.join(workDir, h.hex() + scratch.INTERMEDIATE_EXT)
+                            if self.jobManifest.isFrameDone(self.inputPath, self.config, h.hex()) and os.path.exists(frameDstPath):
+                                frameSrcPath = None
+                        else:
+                            frameSrcPath = group.createPath(scratch.INTERMEDIATE_EXT)
+                            frameDstPath = group.createPath(scratch.INTERMEDIATE_EXT)
+                        if frameSrcPath:
+                            self.outputCallback(f'Frame #{frameCount}: {frameSrcPath} -> {frameDstPath} Duration: {d}\n')
+                        else:
+                            self.outputCallback(f'Frame #{frameCount}: {frameDstPath} (already upscaled) Duration: {d}\n')
+                        sources[frameDstPath] = (frameCount, frameSrcPath, h.hex())
+                        frames.append(frameDstPath)
+                        durations.append(d)
+                        lastSeen[h] = (len(frames) - 1, frameCount, frameDstPath)
+                    frameCount += 1
                     img.seek(img.tell() + 1)
                 except EOFError:
                     break
-        tasks.append(MergeGIFTask(self.outputCallback, self.outputPath, frames, durations))
+            size = img.size
+        upscaleCount = sum(1 for _, frameSrcPath, _ in sources.values() if frameSrcPath)
+        self.outputCallback(f'{len(lastSeen)} unique frames out of {frameCount} frames, {upscaleCount} to upscale.\n')
+        self.correctWork(upscaleCount * planner.planScale(size, self.config).cost)
+        # The GIF is only complete once its last frames are merged.
+        completeCallbacks = list(self.completeCallbacks)
+        self.completeCallbacks.clear()
+        if workDir:
+            completeCallbacks.append(lambda: removeWorkDir(workDir))
+        writer = gifstream.GIFWriter(group.createPath('.gif'), sampler.getPalette())
+        self.queue.appendSource(self.outputCallback, self.generateTasks(frames, durations, sources, size, writer, completeCallbacks, not workDir))
+
+    def generateTasks(
+        self,
+        frames: list[str], durations: list[int],
+        sources: dict[str, tuple[int, str | None, str]],
+        size: tuple[int, int],
+        writer: gifstream.GIFWriter,
+        completeCallbacks: list[typing.Callable[[], None]],
+        releaseFrames: bool,
+    ) -> typing.Iterator[AbstractTask | None]:
+        # Frames are extracted, upscaled and merged batch by batch. The queue pulls the tasks of
+        # the next batch only once the merge GIF_WINDOW batches back is done, so that at most
+        # GIF_WINDOW batches of frames are on disk at any time.
+        reader = gifstream.GIFFrameReader(self.inputPath)
+        try:
+            lastUse = {f: i for i, f in enumerate(frames)}
+            firstUse = {f: i for i, f in reversed(tuple(enumerate(frames)))}
+            starts = range(0, len(frames), GIF_BATCH_SIZE)
+            # Frames to extract and upscale for each batch, in order of first use.
+            newFrames: list[list[str]] = [[] for _ in starts]
+            for f, (_, frameSrcPath, _) in sources.items():
+                if frameSrcPath:
+                    newFrames[firstUse[f] // GIF_BATCH_SIZE].append(f)
+            lastExtract = max((i for i, x in enumerate(newFrames) if x), default=-1)
+            hasPasses = bool(planner.planScale(size, self.config).passes)
+            merges: list[MergeGIFTask] = []
+            extractTask: ExtractGIFFramesTask | None = None
+            for k, start in enumerate(starts):
+                while k >= GIF_WINDOW and not merges[k - GIF_WINDOW].done.is_set():
+                    yield None
+                end = min(start + GIF_BATCH_SIZE, len(frames))
+                chunk = frames[start:end]
+                mergeTask = MergeGIFTask(
+                    self.outputCallback, self.outputPath, writer, chunk, durations[start:end],
+                    tuple(f for f in dict.fromkeys(chunk) if releaseFrames and lastUse[f] < end), end == len(frames),
+                )
+                if merges:
+                    mergeTask.dependencies.append(merges[-1])
+                if newFrames[k]:
+                    nextTask = ExtractGIFFramesTask(self.outputCallback, reader, [sources[f][:2] for f in newFrames[k]], k == lastExtract)
+                    if extractTask:
+                        nextTask.dependencies.append(extractTask)
+                    extractTask = nextTask
+                    extractTask.scratchGroup = self.scratchGroup
+                    yield extractTask
+                    tasks = []
+                    for f in newFrames[k]:
+                        _, frameSrcPath, h = sources[f]
+                        t = RESpawnTask(self.outputCallback, frameSrcPath, f, self.config, True, self.resultCache)
+                        if self.jobManifest:
+                            self.jobManifest.trackFrame(t, self.inputPath, self.config, h)
+                        tasks.append(t)
+                    # All frames share the size of the GIF, so they are upscaled with one run of the
+                    # executable per pass.
+                    if len(tasks) > 1 and hasPasses:
+                        tasks = [REBatchTask(self.outputCallback, tasks)]
+                    for t in tasks:
+                        t.scratchGroup = self.scratchGroup
+                        t.dependencies.append(extractTask)
+                        mergeTask.dependencies.append(t)
+                        yield t
+                if end == len(frames):
+                    mergeTask.completeCallbacks.extend(completeCallbacks)
+                mergeTask.scratchGroup = self.scratchGroup
+                merges.append(mergeTask)
+                yield mergeTask
+        except GeneratorExit:
+            # The tasks were discarded, e.g. their job was cancelled.
+            reader.close()
+            writer.close()
+            self.scratchGroup.drop()
+            raise
+
+class StitchTilesTask(AbstractTask):
+    def __init__(
+        self,
+        outputCallback: typing.Callable[[str], None],
+        outputPath: str,
+        config: param.REConfigParams,
+        tiles: list[list[tuple[tuple[int, int, int, int], tuple[int, int, int, int], str]]],
+        mode: str, factor: int,
+        resultSize: tuple[int, int], dstSize: tuple[int, int],
+    ) -> None:
+        super().__init__(outputCallback)
+        self.outputPath = outputPath
+        self.config = config
+        # Rows of (core box, padded box, upscaled tile) with boxes in input pixels.
+        self.tiles = tiles
+        self.mode = mode
+        self.factor = factor
+        self.resultSize = resultSize
+        self.dstSize = dstSize
+
+    def run(self) -> None:
+        self.outputCallback(f'Stitching {sum(len(row) for row in self.tiles)} tiles to {self.outputPath}\n')
+        width, height = self.resultSize
+        f = self.factor
+        blend = TILE_OVERLAP * f
+        isFinal = self.resultSize == self.dstSize and os.path.splitext(self.outputPath)[1].lower() == '.png'
+        with scratchSpace.session() as session:
+            # Only one row of tiles is held in memory, the rows above it are already written out
+            # or downsampled. Tiles overlap by TILE_OVERLAP input pixels on each side of a seam,
+            # and are blended linearly across the overlap.
+            with contextlib.ExitStack() as stack:
+                if self.resultSize == self.dstSize:
+                    if not isFinal:
+                        warnWholeOutput(self.outputPath, self.resultSize, self.outputCallback)
+                    resultPath = session.createPath('.png')
+                    writer = stack.enter_context(pngstream.PNGWriter(resultPath, self.resultSize, self.mode, 6 if isFinal else 1, isFinal))
+                else:
+                    self.outputCallback(f'Downsample from {width}x{height} to {self.dstSize[0]}x{self.dstSize[1]}.\n')
+                    createParentDir(self.outputPath)
+                    outputWriter = stack.enter_context(openStripWriter(self.outputPath, self.dstSize, self.mode, self.outputCallback))
+                    writer = stack.enter_context(strips.StripResizer(self.resultSize, self.dstSize, self.mode, self.config.downsample, outputWriter.write, scratchSpace))
+                carry: Image.Image | None = None
+                for r, row in enumerate(self.tiles):
+                    top = row[0][1][1] * f
+                    strip = Image.new(self.mode, (width, row[0][1][3] * f - top))
+                    for c, (core, pad, path) in enumerate(row):
+                        with Image.open(path) as tile:
+                            if tile.size != ((pad[2] - pad[0]) * f, (pad[3] - pad[1]) * f):
+                                raise ValueError(f'unexpected size {tile.size[0]}x{tile.size[1]} of tile {path}')
+                            tile = tile.convert(self.mode)
+                        if c:
+                            zone = (core[0] * f - blend, 0, min(core[0] * f + blend, width), strip.size[1])
+                            previous = strip.crop(zone)
+                            strip.paste(tile, (pad[0] * f, 0))
+                            strip.paste(Image.composite(strip.crop(zone), previous, getBlendMask(previous.size, True)), zone[:2])
+                        else:
+                            strip.paste(tile, (pad[0] * f, 0))
+                        tile.close()
+                    if carry is not None:
+                        strip.paste(Image.composite(strip.crop((0, 0, width, carry.size[1])), carry, getBlendMask(carry.size, False)), (0, 0))
+                    if r < len(self.tiles) - 1:
+                        end = row[0][0][3] * f - blend - top
+                        carry = strip.crop((0, end, width, strip.size[1]))
+                    else:
+                        end = strip.size[1]
+                    writer.write(strip.crop((0, 0, width, end)))
+                    strip.close()
+            for row in self.tiles:
+                for _, _, path in row:
+                    scratchSpace.release(path)
+            if self.resultSize == self.dstSize:
+                finishOutput(resultPath, self.resultSize, self.outputPath, self.dstSize, self.config.downsample, self.outputCallback)
+
+class SplitTilesTask(AbstractTask):
+    def __init__(
+        self,
+        outputCallback: typing.Callable[[str], None],
+        inputPath: str, outputPath: str,
+        config: param.REConfigParams,
+        queue: TaskQueue,
+        resultCache: cache.ResultCache | None = None,
+    ) -> None:
+        super().__init__(outputCallback)
+        self.inputPath = inputPath
+        self.outputPath = outputPath
+        self.config = config
+        self.queue = queue
+        self.resultCache = resultCache
+
+    def estimateWork(self) -> int:
+        self.work = planner.planScale(probeIndex.get(self.inputPath).size, self.config).cost
+        return self.work
+
+    def run(self) -> None:
+        tiles = []
+        tasks: list[AbstractTask] = []
+        work = 0
+        # Scratch files of the tiles, shared by every task of the image.
+        group = self.scratchGroup = scratch.ScratchGroup(scratchSpace)
+        with Image.open(self.inputPath) as img:
+            plan = planner.planScale(img.size, self.config)
+            if plan.passes:
+                self.outputCallback(planner.describePlan(plan))
+                prepared = prepareInput(img, plan, self.config.downsample) or img
+                mode = 'RGBA' if 'A' in prepared.mode or 'transparency' in prepared.info else 'RGB'
+                if prepared.mode != mode:
+                    prepared = prepared.convert(mode)
+                width, height = plan.inputSize
+                xs = getTileBounds(width, self.config.splitSize)
+                ys = getTileBounds(height, self.config.splitSize)
+                self.outputCallback(f'Splitting {width}x{height} into {len(xs) - 1}x{len(ys) - 1} tiles.\n')
+                for y0, y1 in zip(ys, ys[1:]):
+                    row = []
+                    for x0, x1 in zip(xs, xs[1:]):
+                        pad = (max(x0 - TILE_OVERLAP, 0), max(y0 - TILE_OVERLAP, 0), min(x1 + TILE_OVERLAP, width), min(y1 + TILE_OVERLAP, height))
+                        tileSrcPath = group.createPath(scratch.INTERMEDIATE_EXT)
+                        tileDstPath = group.createPath(scratch.INTERMEDIATE_EXT)
+                        scratch.saveIntermediate(prepared.crop(pad), tileSrcPath)
+                        t = RESpawnTask(self.outputCallback, tileSrcPath, tileDstPath, self.config, True, self.resultCache)
+                        t.passes = plan.passes
+                        tasks.append(t)
+                        work += planner.getCost((pad[2] - pad[0], pad[3] - pad[1]), (f for _, f in plan.passes))
+                        row.append(((x0, y0, x1, y1), pad, tileDstPath))
+                    tiles.append(row)
+        # Overlapping tiles add some work to the estimate for the whole image.
+        self.correctWork(work)
+        if tasks:
+            # Tiles share the same passes, batches of them are spread over the workers so that
+            # every worker gets some even when there are few tiles.
+            batchSize = min(math.ceil(len(tasks) / self.queue.workerCount), TILE_BATCH_SIZE)
+            if batchSize > 1:
+                tasks = batchTasks(tasks, batchSize)
+            lastTask = StitchTilesTask(self.outputCallback, self.outputPath, self.config, tiles, mode, math.prod(x[1] for x in plan.passes), plan.resultSize, plan.dstSize)
+            lastTask.dependencies.extend(tasks)
+            for t in (*tasks, lastTask):
+                t.scratchGroup = group
+        else:
+            # Nothing to upscale, the image is only downsampled.
+            lastTask = RESpawnTask(self.outputCallback, self.inputPath, self.outputPath, self.config, resultCache=self.resultCache)
+        lastTask.completeCallbacks.extend(self.completeCallbacks)
+        self.completeCallbacks.clear()
+        tasks.append(lastTask)
         tasks.reverse()
         for t in tasks:
             self.queue.appendleft(t)
 
-def taskRunner(
-    queue: collections.deque[AbstractTask],
+class TuneTilesTask(AbstractTask):
+    def __init__(
+        self,
+        outputCallback: typing.Callable[[str], None],
+        inputPath: str,
+        config: param.REConfigParams,
+        profiles: tuner.TileProfiles,
+        candidates: typing.Sequence[int] = tuner.CANDIDATES,
+    ) -> None:
+        super().__init__(outputCallback)
+        self.inputPath = inputPath
+        self.config = config
+        self.profiles = profiles
+        self.candidates = candidates
+
+    def assignDevice(self, gpuID: int) -> None:
+        self.config = self.config._replace(gpuID=gpuID)
+
+    def run(self) -> None:
+        self.outputCallback(f'Using {inferenceBackend.describe()}\n')
+        with scratchSpace.session() as session:
+            inputPath = session.createPath(scratch.INTERMEDIATE_EXT)
+            with Image.open(self.inputPath) as img:
+                size = img.size
+                with img.convert('RGBA' if 'A' in img.mode or 'transparency' in img.info else 'RGB') as converted:
+                    scratch.saveIntermediate(converted, inputPath)
+            sizeClass = tuner.getSizeClass(size)
+            pixels = size[0] * size[1] * self.config.modelFactor ** 2
+            self.outputCallback(f'Tuning tile size of {self.config.model} on GPU {self.config.gpuID} for {sizeClass} images with {self.inputPath} ({size[0]}x{size[1]})\n')
+            results: list[tuner.TileResult] = []
+            for tileSize in self.candidates:
+                # A tile size that runs out of memory is not retried with larger tiles.
+                if results and results[-1].error is not None:
+                    results.append(tuner.TileResult(tileSize, None, None, 'skipped after a smaller tile size failed'))
+                    continue
+                outputPath = session.createPath(scratch.INTERMEDIATE_EXT)
+                # The executable may report a failed allocation without a non-zero exit code.
+                errors = []
+                def collectErrors(line: str) -> None:
+                    if 'failed' in line.lower() or 'error' in line.lower():
+                        errors.append(line.strip())
+                ts = time.perf_counter()
+                try:
+                    inferenceBackend.runPass(inputPath, outputPath, self.config._replace(tileSize=tileSize), collectErrors)
+                except subprocess.CalledProcessError as ex:
+                    errors.append(f'exit code {ex.returncode}')
+                except (RuntimeError, MemoryError) as ex:
+                    errors.append(str(ex) or type(ex).__name__)
+                seconds = time.perf_counter() - ts
+                if not errors and not os.path.exists(outputPath):
+                    errors.append('no output')
+                # Every run includes loading the model, which costs the same for every tile size.
+                results.append(tuner.TileResult(tileSize, None, None, errors[0]) if errors else tuner.TileResult(tileSize, seconds, pixels / seconds, None))
+                scratchSpace.release(outputPath)
+            self.outputCallback(tuner.describeResults(results))
+            best = self.profiles.record(self.config.model, self.config.gpuID, sizeClass, results)
+            if best is None:
+                raise RuntimeError(f'every tile size failed for {self.config.model} on GPU {self.config.gpuID}')
+            self.outputCallback(f'Best tile size for {self.config.model} on GPU {self.config.gpuID} for {sizeClass} images: {best}\n')
+
+def getTileBounds(length: int, splitSize: int) -> list[int]:
+    n = math.ceil(length / splitSize)
+    return [round(i * length / n) for i in range(n + 1)]
+
+@functools.lru_cache(maxsize=8)
+def getBlendMask(size: tuple[int, int], horizontal: bool) -> Image.Image:
+    # Weight of the tile to the right of (or below) a seam, rising linearly across the overlap.
+    n = size[0] if horizontal else size[1]
+    ramp = bytes(round(255 * (i + .5) / n) for i in range(n))
+    return Image.frombytes('L', (n, 1) if horizontal else (1, n), ramp).resize(size, Image.Resampling.NEAREST)
+
+def isLargeImage(inputPath: str, splitSize: int) -> bool:
+    with Image.open(inputPath) as img:
+        return max(img.size) > splitSize
+
+def prepareInput(img: Image.Image, plan: planner.ScalePlan, downsample: 'Image._Resample') -> Image.Image | None:
+    # Returns the image to feed to the executable instead of the input file, if any.
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+    elif plan.inputSize == img.size:
+        return None
+    if plan.inputSize != img.size:
+        img = img.resize(plan.inputSize, downsample)
+    return img
+
+def getPassConfig(
+    config: param.REConfigParams,
+    passes: tuple[tuple[str, int], ...], i: int,
+    inputSize: tuple[int, int],
+) -> param.REConfigParams:
+    model, modelFactor = passes[i]
+    config = config._replace(model=model, modelFactor=modelFactor)
+    if config.tileSize == param.TUNED_TILE_SIZE:
+        f = math.prod(x[1] for x in passes[:i])
+        size = (inputSize[0] * f, inputSize[1] * f)
+        config = config._replace(tileSize=tileProfiles.getTileSize(model, config.gpuID, size) if tileProfiles else 0)
+    return config
+
+def finishOutput(
+    resultPath: str, resultSize: tuple[int, int],
+    outputPath: str, dstSize: tuple[int, int],
+    downsample: 'Image._Resample',
     outputCallback: typing.Callable[[str], None],
-    completeCallback: typing.Callable[[], None],
 ) -> None:
-    counter = 0
+    createParentDir(outputPath)
+    if resultSize == dstSize and os.path.splitext(resultPath)[1].lower() == os.path.splitext(outputPath)[1].lower():
+        if os.path.exists(outputPath):
+            os.remove(outputPath)
+        shutil.move(resultPath, outputPath)
+    else:
+        with Image.open(resultPath) as img, stageTimes.measure('finish'):
+            finishImage(img, outputPath, dstSize, downsample, outputCallback)
+        os.remove(resultPath)
+
+def finishImage(
+    img: Image.Image,
+    outputPath: str, dstSize: tuple[int, int],
+    downsample: 'Image._Resample',
+    outputCallback: typing.Callable[[str], None],
+) -> None:
+    if img.size == dstSize:
+        saveOutput(img, outputPath)
+    else:
+        outputCallback(f'Downsample from {img.size[0]}x{img.size[1]} to {dstSize[0]}x{dstSize[1]}.\n')
+        if img.mode in strips.MODES and img.size[0] * img.size[1] >= strips.MIN_STREAM_PIXELS:
+            # The resized image is produced strip by strip instead of next to the whole
+            # result, PNG outputs are also written strip by strip.
+            with openStripWriter(outputPath, dstSize, img.mode, outputCallback) as writer:
+                strips.resizeImage(img, dstSize, downsample, writer.write, scratchSpace)
+        else:
+            resized: Image.Image = img.resize(dstSize, downsample)
+            saveOutput(resized, outputPath)
+            resized.close()
+
+def saveOutput(img: Image.Image, outputPath: str) -> None:
+    # Lossless intermediates may carry an alpha channel that JPEG cannot store.
+    if os.path.splitext(outputPath)[1].lower() in {'.jpg', '.jpeg'} and img.mode not in {'RGB', 'L'}:
+        img = img.convert('RGB')
+    img.save(outputPath)
+
+def openStripWriter(
+    outputPath: str, size: tuple[int, int], mode: str,
+    outputCallback: typing.Callable[[str], None],
+) -> pngstream.PNGWriter | strips.ImageStripWriter:
+    if os.path.splitext(outputPath)[1].lower() == '.png':
+        return pngstream.PNGWriter(outputPath, size, mode, 6, True)
+    warnWholeOutput(outputPath, size, outputCallback)
+    return strips.ImageStripWriter(outputPath, size, mode, saveOutput)
+
+def warnWholeOutput(outputPath: str, size: tuple[int, int], outputCallback: typing.Callable[[str], None]) -> None:
+    # Pillow encodes JPEG and WebP from a whole image, only PNG outputs are written in strips.
+    outputCallback(f'Warning: {os.path.splitext(outputPath)[1]} outputs cannot be written in strips, the whole {size[0]}x{size[1]} image is held in memory to encode it. Use a PNG output to keep memory bounded.\n')
+
+def getBatchFormat(outputPath: str) -> str:
+    ext = os.path.splitext(outputPath)[1].lower()
+    return {'.jpg': 'jpg', '.jpeg': 'jpg', '.webp': 'webp'}.get(ext, 'png')
+
+def createParentDir(path: str) -> None:
+    # A bare file name has no folder to create.
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+def removeWorkDir(workDir: str) -> None:
+    shutil.rmtree(workDir, ignore_errors=True)
     try:
-        while queue:
-            ts = time.perf_counter()
-            queue.popleft().run()
-            te = time.perf_counter()
-            outputCallback(f'Task #{counter} completed in {round((te - ts) * 1000)}ms.\n')
-            counter += 1
+        os.rmdir(os.path.dirname(workDir))
+    except OSError:
+        pass
+
+def linkOrCopy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def batchTasks(tasks: typing.Iterable[AbstractTask], batchSize: int) -> list[AbstractTask]:
+    return list(iterBatches(tasks, batchSize))
+
+def iterBatches(tasks: typing.Iterable[AbstractTask], batchSize: int) -> typing.Iterator[AbstractTask]:
+    # Batches are yielded as soon as they are full, the rest once the tasks run out.
+    groups: dict[tuple, list[RESpawnTask]] = {}
+    for t in tasks:
+        if type(t) is not RESpawnTask:
+            yield t
+            continue
+        with Image.open(t.inputPath) as img:
+            passes = t.getPlan(img.size).passes
+        if not passes:
+            yield t
+            continue
+        key = (passes, t.config.tileSize, t.config.useTTA, t.config.gpuID, getBatchFormat(t.outputPath))
+        group = groups.setdefault(key, [])
+        group.append(t)
+        if len(group) == batchSize:
+            yield REBatchTask(group[0].outputCallback, group)
+            del groups[key]
+    for group in groups.values():
+        yield REBatchTask(group[0].outputCallback, group) if len(group) > 1 else group[0]
+
+def produceTasks(
+    queue: TaskQueue,
+    tasks: typing.Iterable[AbstractTask],
+    outputCallback: typing.Callable[[str], None],
+    batchSize: int = 0,
+) -> None:
+    # Runs in its own thread, pushing tasks while they are created, e.g. while the input
+    # folder is still being walked. The caller opens the producer before starting the runner.
+    try:
+        for t in iterBatches(tasks, batchSize) if batchSize > 1 else tasks:
+            if not queue.push(t):
+                break
     except Exception as ex:
         outputCallback(f'{type(ex).__name__}: {ex} ({ex.__traceback__.tb_frame.f_code.co_filename}:{ex.__traceback__.tb_lineno})\n')
+        queue.failed = True
+    finally:
+        queue.closeProducer()
+
+def addEstimate(tracker: progress.ProgressTracker, t: AbstractTask) -> None:
+    try:
+        tracker.addWork(t.estimateWork())
+    except OSError:
+        # The task reports the error when it runs.
+        pass
+
+def createTask(
+    outputCallback: typing.Callable[[str], None],
+    inputPath: str, outputPath: str,
+    config: param.REConfigParams,
+    queue: TaskQueue,
+    resultCache: cache.ResultCache | None = None,
+    jobManifest: manifest.JobManifest | None = None,
+) -> AbstractTask:
+    if os.path.splitext(inputPath)[1].lower() == '.gif':
+        t = SplitGIFTask(outputCallback, inputPath, outputPath, config, queue, resultCache, jobManifest)
+    elif config.splitSize and isLargeImage(inputPath, config.splitSize):
+        t = SplitTilesTask(outputCallback, inputPath, outputPath, config, queue, resultCache)
+    else:
+        t = RESpawnTask(outputCallback, inputPath, outputPath, config, resultCache=resultCache)
+    if jobManifest:
+        jobManifest.track(t, inputPath, outputPath, config)
+    return t
+
+def compileGlobs(patterns: typing.Iterable[str]) -> re.Pattern | None:
+    patterns = tuple(patterns)
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns), re.IGNORECASE if os.name == 'nt' else 0)
+
+def scanDirectory(
+    inputPath: str, outputPath: str,
+    include: typing.Iterable[str] = (), exclude: typing.Iterable[str] = (),
+) -> typing.Iterator[tuple[str, str]]:
+    # Walks the folder in the same order as os.walk, yielding files as they are found. Glob
+    # patterns match paths relative to the input folder with / as the separator, and folders
+    # matching an exclude pattern are not entered.
+    includePattern = compileGlobs(include)
+    excludePattern = compileGlobs(exclude)
+    stack = [(inputPath, '')]
+    while stack:
+        curDir, relDir = stack.pop()
+        try:
+            entries = os.scandir(curDir)
+        except OSError:
+            # Unreadable folders are skipped like os.walk does.
+            continue
+        dirs = []
+        with entries:
+            for e in entries:
+                relPath = relDir + e.name
+                try:
+                    isDir = e.is_dir()
+                except OSError:
+                    continue
+                if isDir:
+                    # Like os.walk, linked folders are not entered, so that a link loop is not
+                    # followed forever.
+                    if e.is_symlink():
+                        continue
+                    if e.name != manifest.JobManifest.WORK_DIR_NAME and not (excludePattern and excludePattern.match(relPath)):
+                        dirs.append((e.path, relPath + '/'))
+                elif (
+                    os.path.splitext(e.name)[1].lower() in IMAGE_EXTS
+                    and not (includePattern and not includePattern.match(relPath))
+                    and not (excludePattern and excludePattern.match(relPath))
+                ):
+                    yield e.path, os.path.join(outputPath, *relPath.split('/'))
+        stack.extend(reversed(dirs))
+
+def taskRunner(
+    queue: TaskQueue,
+    outputCallback: typing.Callable[[str], None],
+    completeCallback: typing.Callable[[], None],
+    gpuIDs: typing.Sequence[int] | None = None,
+    progressCallback: typing.Callable[[progress.ProgressEvent], None] | None = None,
+    errorCallback: typing.Callable[[AbstractTask, Exception], None] | None = None,
+) -> bool:
+    counter = 0
+    running = 0
+    # Workers running a task. Tasks are only prepared ahead while every worker is busy, so that
+    # a worker never waits for a task another one holds.
+    busy = 0
+    success = True
+    tracker = progress.ProgressTracker(progressCallback) if progressCallback else None
+    queue.workerCount = len(gpuIDs) if gpuIDs else 1
+    if tracker:
+        with queue.condition:
+            queue.tracker = tracker
+            tasks = tuple(queue)
+        for t in tasks:
+            addEstimate(tracker, t)
+
+    # Pipelined tasks are prepared on their own threads while the GPU worker runs the task
+    # before, and finished on their own threads while it runs the task after.
+    prepareExecutor = concurrent.futures.ThreadPoolExecutor(PREPARE_WORKERS)
+    finishExecutor = concurrent.futures.ThreadPoolExecutor(FINISH_WORKERS)
+    finishSlots = threading.Semaphore(FINISH_QUEUE_SIZE)
+
+    def popTask(wait: bool) -> AbstractTask | None:
+        # Returns None when the run is over, or when nothing is ready and wait is False.
+        nonlocal counter, running, success
+        with queue.condition:
+            while True:
+                if not success or (not wait and busy < queue.workerCount):
+                    return None
+                t = queue.popReady(None if wait else lambda x: x.pipelined)
+                if t:
+                    t.taskID = counter
+                    counter += 1
+                    if tracker:
+                        t.assignProgress(tracker)
+                    running += 1
+                    return t
+                if not wait:
+                    return None
+                if not running and not queue.producers:
+                    if queue or queue.sources:
+                        outputCallback(f'{len(queue)} tasks could not be started because their dependencies did not complete.\n')
+                        success = False
+                    queue.condition.notify_all()
+                    return None
+                queue.condition.wait()
+
+    def startTask(t: AbstractTask, gpuID: int | None) -> concurrent.futures.Future | None:
+        if gpuID is not None:
+            t.assignDevice(gpuID)
+        if not t.pipelined:
+            return None
+
+        def prepare() -> None:
+            with stageTimes.measure('prepare'):
+                t.prepare()
+        return prepareExecutor.submit(prepare)
+
+    def failTask(t: AbstractTask, ex: Exception) -> None:
+        nonlocal success
+        outputCallback(f'{type(ex).__name__}: {ex} ({ex.__traceback__.tb_frame.f_code.co_filename}:{ex.__traceback__.tb_lineno})\n')
+        if errorCallback:
+            errorCallback(t, ex)
+        with queue.condition:
+            if queue.keepGoing:
+                queue.failed = True
+            else:
+                success = False
+
+    def endTask(t: AbstractTask, ex: Exception | None) -> None:
+        nonlocal running
+        try:
+            t.cleanup()
+        except Exception as cleanupEx:
+            ex = ex or cleanupEx
+        # The other tasks of a failed task's group can never complete. Tasks of a dropped group
+        # may have written files while they were running.
+        if t.scratchGroup and (ex or t.scratchGroup.dropped):
+            t.scratchGroup.drop()
+        if ex:
+            failTask(t, ex)
+        with queue.condition:
+            running -= 1
+            queue.condition.notify_all()
+
+    def finishTask(t: AbstractTask, ts: float, gpuID: int | None) -> None:
+        try:
+            t.finish()
+            te = time.perf_counter()
+            t.complete()
+            outputCallback(f'Task #{t.taskID} completed in {round((te - ts) * 1000)}ms{"" if gpuID is None else f" on GPU {gpuID}"}.\n')
+        except Exception as ex:
+            endTask(t, ex)
+        else:
+            endTask(t, None)
+        finally:
+            finishSlots.release()
+
+    def worker(gpuID: int | None) -> None:
+        nonlocal busy
+        # The next pipelined task, already being prepared while the current one runs.
+        ahead: tuple[AbstractTask, concurrent.futures.Future | None] | None = None
+        while True:
+            if ahead:
+                t, prepared = ahead
+                ahead = None
+            else:
+                t = popTask(True)
+                if not t:
+                    return
+                prepared = startTask(t, gpuID)
+            with queue.condition:
+                busy += 1
+            try:
+                if t.pipelined and success:
+                    nextTask = popTask(False)
+                    if nextTask:
+                        ahead = (nextTask, startTask(nextTask, gpuID))
+                ts = time.perf_counter()
+                if not success:
+                    # The run failed while the task was waiting, it is dropped like the tasks
+                    # still in the queue.
+                    if prepared:
+                        concurrent.futures.wait((prepared,))
+                    endTask(t, None)
+                    continue
+                if prepared:
+                    prepared.result()
+                with stageTimes.measure(f'task:{type(t).__name__}'):
+                    t.run()
+            except Exception as ex:
+                endTask(t, ex)
+                continue
+            finally:
+                with queue.condition:
+                    busy -= 1
+            if t.pipelined:
+                finishSlots.acquire()
+                finishExecutor.submit(finishTask, t, ts, gpuID)
+                continue
+            try:
+                te = time.perf_counter()
+                t.complete()
+                outputCallback(f'Task #{t.taskID} completed in {round((te - ts) * 1000)}ms{"" if gpuID is None else f" on GPU {gpuID}"}.\n')
+            except Exception as ex:
+                endTask(t, ex)
+            else:
+                endTask(t, None)
+
+    try:
+        if not gpuIDs or len(gpuIDs) == 1:
+            worker(gpuIDs[0] if gpuIDs else None)
+        else:
+            threads = [threading.Thread(target=worker, args=(gpuID,), daemon=True) for gpuID in gpuIDs]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        # Results of a failed run may still be finishing.
+        prepareExecutor.shutdown()
+        finishExecutor.shutdown()
+        return success and not queue.failed
     finally:
-        completeCallback()
\ No newline at end of file
+        with queue.condition:
+            queue.stopped = True
+        completeCallback()
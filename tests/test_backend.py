@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+import cli
+import param
+
+# Prints one line and then works silently for a long time, like a large pass of the executable.
+SLOW_EXECUTABLE = '''import sys
+import time
+sys.stderr.write('0.00%\\n')
+sys.stderr.flush()
+time.sleep(60)
+'''
+
+FAKE_EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'fake-realesrgan-ncnn-vulkan.py')
+
+class SpawnBackendTest(unittest.TestCase):
+    def testAbstract(self) -> None:
+        with self.assertRaises(TypeError):
+            backend.Backend()
+
+    def testUpscaleImage(self) -> None:
+        config = param.REConfigParams('realesrgan-x4plus', 2, param.ResizeMode.RATIO, 2, cli.DOWNSAMPLE['lanczos'], 0, 0, False)
+        img = Image.new('RGBA', (24, 16), (10, 20, 30, 40))
+        result = backend.SpawnBackend(FAKE_EXECUTABLE).upscaleImage(img, config, lambda s: None)
+        self.assertEqual(result.size, (48, 32))
+        self.assertEqual(result.getpixel((47, 31)), (10, 20, 30, 40))
+
+    def testStopOnError(self) -> None:
+        with tempfile.TemporaryDirectory() as tempDir:
+            executable = os.path.join(tempDir, 'slow.py')
+            with open(executable, 'w') as f:
+                f.write(SLOW_EXECUTABLE)
+            config = param.REConfigParams('realesrgan-x4plus', 4, param.ResizeMode.RATIO, 4, cli.DOWNSAMPLE['lanczos'], 0, 0, False)
+
+            def outputCallback(line: str) -> None:
+                raise InterruptedError('stop')
+
+            start = time.monotonic()
+            with self.assertRaises(InterruptedError):
+                backend.SpawnBackend(executable).runPass(os.path.join(tempDir, 'in.png'), os.path.join(tempDir, 'out.png'), config, outputCallback)
+            # The executable is killed instead of waited for.
+            self.assertLess(time.monotonic() - start, 30)
+
+if __name__ == '__main__':
+    unittest.main()
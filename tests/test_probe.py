@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+import unittest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import probe
+
+class ProbeIndexTest(unittest.TestCase):
+    def testLeastRecentlyUsed(self) -> None:
+        with tempfile.TemporaryDirectory() as tempDir:
+            paths = []
+            for i in range(4):
+                paths.append(os.path.join(tempDir, f'{i}.png'))
+                Image.new('RGB', (i + 1, 2)).save(paths[-1])
+            index = probe.ProbeIndex(2)
+            self.assertEqual(index.get(paths[0]).size, (1, 2))
+            index.get(paths[1])
+            index.get(paths[0])
+            index.get(paths[2])
+            # The image used longest ago is dropped first.
+            self.assertEqual(list(index.entries), [paths[0], paths[2]])
+            self.assertEqual([x.size if x else None for x in index.probeAll(paths)], [(1, 2), (2, 2), (3, 2), (4, 2)])
+            self.assertEqual(len(index.entries), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+import cli
+import param
+import scratch
+import server
+import task
+
+FAKE_EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'fake-realesrgan-ncnn-vulkan.py')
+
+class JobServerTest(unittest.TestCase):
+    # Runs the server in this process on a free port, with the stand-in executable doing the work.
+    def setUp(self) -> None:
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.inputPath = os.path.join(self.tempDir.name, 'in.png')
+        Image.new('RGB', (256, 256), (40, 80, 120)).save(self.inputPath)
+        # Every tile takes this long, so that a job with small tiles is still running when cancelled.
+        self.environ = os.environ.get('FAKE_REALESRGAN_TILE_SECONDS')
+        os.environ['FAKE_REALESRGAN_TILE_SECONDS'] = '0.1'
+        self.backend = task.inferenceBackend
+        task.inferenceBackend = backend.SpawnBackend(FAKE_EXECUTABLE)
+        self.scratchSpace = task.scratchSpace
+        task.scratchSpace = scratch.ScratchSpace(os.path.join(self.tempDir.name, 'scratch'))
+        defaults = param.REConfigParams(
+            'realesrgan-x4plus', 4, param.ResizeMode.RATIO, 2,
+            cli.DOWNSAMPLE['lanczos'], 0, 0, False,
+        )
+        self.service = server.JobService(defaults, [], os.path.join(self.tempDir.name, 'jobs'), (0,), outputCallback=lambda s: None)
+        self.service.start()
+        self.server = server.JobServer(('127.0.0.1', 0), self.service)
+        self.serverThread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.serverThread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        task.inferenceBackend = self.backend
+        task.scratchSpace = self.scratchSpace
+        if self.environ is None:
+            del os.environ['FAKE_REALESRGAN_TILE_SECONDS']
+        else:
+            os.environ['FAKE_REALESRGAN_TILE_SECONDS'] = self.environ
+        self.tempDir.cleanup()
+
+    def request(self, method: str, path: str, body: dict | None = None, headers: dict[str, str] | None = None) -> tuple[int, bytes]:
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=30)
+        try:
+            connection.request(
+                method, path,
+                json.dumps(body).encode() if body is not None else None,
+                {'Content-Type': 'application/json', **(headers or {})},
+            )
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def submit(self, body: dict) -> dict:
+        status, data = self.request('POST', '/jobs', body)
+        self.assertEqual(status, 201, data)
+        return json.loads(data)
+
+    def getState(self, jobID: str) -> str:
+        return json.loads(self.request('GET', f'/jobs/{jobID}')[1])['state']
+
+    def waitForState(self, jobID: str, states: set[str]) -> str:
+        deadline = time.monotonic() + 60
+        while (state := self.getState(jobID)) not in states:
+            self.assertLess(time.monotonic(), deadline, f'job {jobID} is still {state}')
+            time.sleep(.05)
+        return state
+
+    def testResult(self) -> None:
+        job = self.submit({'input': self.inputPath})
+        self.assertEqual(self.waitForState(job['id'], server.FINAL_STATES), 'done')
+        status, data = self.request('GET', f'/jobs/{job["id"]}/result')
+        self.assertEqual(status, 200)
+        outputPath = os.path.join(self.tempDir.name, 'result.png')
+        with open(outputPath, 'wb') as f:
+            f.write(data)
+        with Image.open(outputPath) as img:
+            self.assertEqual(img.size, (512, 512))
+
+    def testCancel(self) -> None:
+        # There is one worker, which prepares at most the second job while the first one runs,
+        # so the third job waits in the queue.
+        running = self.submit({'input': self.inputPath, 'config': {'tileSize': 32}})
+        following = self.submit({'input': self.inputPath})
+        queued = self.submit({'input': self.inputPath})
+        self.waitForState(running['id'], {'running'})
+        self.assertEqual(self.getState(queued['id']), 'queued')
+
+        self.assertEqual(self.request('DELETE', f'/jobs/{queued["id"]}')[0], 200)
+        self.assertEqual(self.getState(queued['id']), 'cancelled')
+        self.assertEqual(self.request('DELETE', f'/jobs/{running["id"]}')[0], 200)
+        self.assertEqual(self.getState(running['id']), 'cancelled')
+        self.assertEqual(self.request('GET', f'/jobs/{running["id"]}/result')[0], 409)
+
+        # The worker goes on with the next job once the cancelled executable has stopped.
+        self.assertEqual(self.waitForState(following['id'], server.FINAL_STATES), 'done')
+        self.assertEqual(self.getState(queued['id']), 'cancelled')
+
+    def createGIF(self) -> str:
+        gifPath = os.path.join(self.tempDir.name, 'in.gif')
+        frames = [Image.new('RGB', (32, 32), (i, 255 - i, 0)) for i in range(150)]
+        frames[0].save(gifPath, save_all=True, append_images=frames[1:], duration=40)
+        return gifPath
+
+    def assertReleased(self) -> None:
+        # The next job runs once the worker is done with the tasks of the previous one.
+        self.assertEqual(self.waitForState(self.submit({'input': self.inputPath})['id'], server.FINAL_STATES), 'done')
+        self.assertEqual(self.service.queue.sources, [])
+        self.assertEqual(len(self.service.queue), 0)
+        self.assertEqual(task.scratchSpace.paths, set())
+        self.assertEqual(os.listdir(task.scratchSpace.root), [])
+
+    def testCancelGIF(self) -> None:
+        job = self.submit({'input': self.createGIF()})
+        # Cancelled once its frames are being upscaled, while the source of its batches is queued.
+        deadline = time.monotonic() + 60
+        while not self.service.queue.sources:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(.01)
+        self.assertEqual(self.request('DELETE', f'/jobs/{job["id"]}')[0], 200)
+        self.assertReleased()
+
+    def testFailedGIF(self) -> None:
+        # Tiles this large fail in the stand-in like a GPU out of memory.
+        job = self.submit({'input': self.createGIF(), 'config': {'tileSize': 1000}})
+        self.assertEqual(self.waitForState(job['id'], server.FINAL_STATES), 'failed')
+        self.assertReleased()
+
+    def testRefusedRequests(self) -> None:
+        status, _ = self.request('POST', '/jobs', {'input': self.inputPath}, {'Content-Type': 'text/plain'})
+        self.assertEqual(status, 415)
+        status, _ = self.request('GET', '/status', headers={'Host': 'example.com'})
+        self.assertEqual(status, 403)
+        status, _ = self.request('POST', '/jobs', {'input': self.inputPath, 'output': 'out.png'})
+        self.assertEqual(status, 400)
+        # Existing files are never replaced.
+        status, _ = self.request('POST', '/jobs', {'input': self.inputPath, 'output': self.inputPath})
+        self.assertEqual(status, 400)
+        self.assertEqual(self.request('GET', '/jobs')[1], b'[]')
+
+if __name__ == '__main__':
+    unittest.main()
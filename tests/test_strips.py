@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import unittest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scratch
+import strips
+
+class StripResizerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.space = scratch.ScratchSpace(self.tempDir.name)
+
+    def tearDown(self) -> None:
+        self.space.cleanup()
+        self.tempDir.cleanup()
+
+    def resize(self, img: Image.Image, dstSize: tuple[int, int], resample: 'Image._Resample') -> Image.Image:
+        collected: list[Image.Image] = []
+        strips.resizeImage(img, dstSize, resample, collected.append, self.space)
+        result = Image.new(img.mode, dstSize)
+        y = 0
+        for strip in collected:
+            result.paste(strip, (0, y))
+            y += strip.size[1]
+        self.assertEqual(y, dstSize[1])
+        return result
+
+    def createImage(self, mode: str, size: tuple[int, int]) -> Image.Image:
+        return Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+
+    def testSameAsResize(self) -> None:
+        # Tall enough for several strips and blocks of columns, so the scratch files are read
+        # and written at many offsets.
+        for mode in ('RGB', 'RGBA'):
+            img = self.createImage(mode, (300, strips.STRIP_ROWS * 2 + 37))
+            for dstSize in ((200, 401), (300, 123), (150, img.size[1])):
+                for resample in (Image.Resampling.LANCZOS, Image.Resampling.NEAREST):
+                    with self.subTest(mode=mode, dstSize=dstSize, resample=resample):
+                        self.assertEqual(self.resize(img, dstSize, resample).tobytes(), img.resize(dstSize, resample).tobytes())
+        self.assertFalse(os.listdir(self.tempDir.name))
+
+    def testSmallBlocks(self) -> None:
+        # Blocks of a single column exercise the reads and writes at unaligned offsets.
+        blockBytes = strips.BLOCK_BYTES
+        strips.BLOCK_BYTES = 1
+        try:
+            img = self.createImage('RGB', (37, 300))
+            self.assertEqual(self.resize(img, (20, 150), Image.Resampling.BICUBIC).tobytes(), img.resize((20, 150), Image.Resampling.BICUBIC).tobytes())
+        finally:
+            strips.BLOCK_BYTES = blockBytes
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import task
+
+class ScanDirectoryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.inputPath = os.path.join(self.tempDir.name, 'in')
+        self.outputPath = os.path.join(self.tempDir.name, 'out')
+        os.makedirs(os.path.join(self.inputPath, 'sub'))
+        for name in ('a.png', os.path.join('sub', 'b.jpg'), 'c.txt'):
+            Image.new('RGB', (8, 8)).save(os.path.join(self.inputPath, name), 'PNG')
+
+    def tearDown(self) -> None:
+        self.tempDir.cleanup()
+
+    def scan(self) -> list[tuple[str, str]]:
+        return list(task.scanDirectory(self.inputPath, self.outputPath))
+
+    def testSameAsWalk(self) -> None:
+        expected = [
+            (os.path.join(curDir, f), os.path.join(self.outputPath, os.path.relpath(os.path.join(curDir, f), self.inputPath)))
+            for curDir, dirs, files in os.walk(self.inputPath)
+            for f in files
+            if f.endswith(('.png', '.jpg'))
+        ]
+        self.assertEqual(sorted(self.scan()), sorted(expected))
+        self.assertEqual(len(expected), 2)
+
+    def testLinkedFolder(self) -> None:
+        # A link back to the input folder would be a loop, it is neither entered nor taken for
+        # an image, like in os.walk.
+        try:
+            os.symlink(self.inputPath, os.path.join(self.inputPath, 'sub', 'loop.png'), target_is_directory=True)
+        except (OSError, NotImplementedError) as ex:
+            self.skipTest(f'cannot create links: {ex}')
+        self.assertEqual(sorted(f for f, _ in self.scan()), sorted([
+            os.path.join(self.inputPath, 'a.png'),
+            os.path.join(self.inputPath, 'sub', 'b.jpg'),
+        ]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import contextlib
+import threading
+import time
+import typing
+
+class StageTimes:
+    # Wall time spent in each stage of the pipeline, summed over every thread. Measuring is off
+    # unless enabled, e.g. by the benchmark, so that normal runs only pay for a flag check.
+    def __init__(self) -> None:
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stages: dict[str, list[float]] = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> typing.Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        ts = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - ts)
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0., 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages.clear()
+
+    def getSummary(self) -> dict[str, dict[str, float]]:
+        with self.lock:
+            return {k: {'seconds': round(v[0], 4), 'count': v[1]} for k, v in sorted(self.stages.items())}
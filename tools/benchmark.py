@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Benchmark of the Python side of the pipeline: probing, conversion, intermediate files,
+# multi-pass shuffling, downsampling and GIF encoding, measured against a stand-in upscaler
+# that costs next to nothing, e.g.
+#   python tools/benchmark.py -o before.json
+#   python tools/benchmark.py -o after.json --compare before.json
+# Corpora are generated from a fixed seed, so results of different commits are comparable.
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend
+import catalog
+import param
+import task
+
+TOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+FAKE_EXECUTABLE = os.path.join(TOOLS_PATH, 'fake-realesrgan-ncnn-vulkan.py')
+SEED = 20240501
+# Two passes of a 2x model and a downsample, like most scales that are not a power of the model.
+MODEL = 'realesr-animevideov3-x2'
+SCALE = 3
+# A corpus that is slower than the compared result by more than this fails the comparison.
+REGRESSION_THRESHOLD = .1
+
+def createNoise(rng: random.Random, size: tuple[int, int], mode: str) -> Image.Image:
+    # A gradient with noise on top, which compresses about as badly as a photo.
+    w, h = size
+    gradient = Image.linear_gradient('L').resize(size).convert(mode)
+    noise = Image.frombytes(mode, size, rng.randbytes(w * h * len(mode)))
+    return Image.blend(gradient, noise, .35)
+
+def createPalettedFrame(rng: random.Random, size: tuple[int, int], shapes: int) -> Image.Image:
+    img = Image.new('P', size, 0)
+    img.putpalette([rng.randrange(256) for _ in range(768)])
+    for _ in range(shapes):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        img.paste(rng.randrange(1, 256), (x, y, min(x + rng.randrange(4, 40), size[0]), min(y + rng.randrange(4, 40), size[1])))
+    return img
+
+def createCorpora(root: str, scale: float) -> dict[str, str]:
+    rng = random.Random(SEED)
+    corpora = {}
+
+    def n(count: int) -> int:
+        return max(1, round(count * scale))
+
+    path = corpora['small-png'] = os.path.join(root, 'small-png')
+    os.makedirs(path)
+    for i in range(n(60)):
+        createNoise(rng, (96, 64), 'RGB').save(os.path.join(path, f'{i:04d}.png'))
+
+    path = corpora['huge-jpeg'] = os.path.join(root, 'huge-jpeg')
+    os.makedirs(path)
+    for i in range(n(1)):
+        createNoise(rng, (2048, 1536), 'RGB').save(os.path.join(path, f'{i:04d}.jpg'), quality=90)
+
+    path = corpora['long-gif'] = os.path.join(root, 'long-gif')
+    os.makedirs(path)
+    frames = []
+    for i in range(n(120)):
+        # Runs of repeated frames, as in most animations.
+        frames.append(frames[-1] if frames and rng.random() < .3 else createPalettedFrame(rng, (160, 120), 40))
+    frames[0].save(os.path.join(path, 'long.gif'), save_all=True, append_images=frames[1:], duration=40, loop=0)
+
+    path = corpora['paletted'] = os.path.join(root, 'paletted')
+    os.makedirs(path)
+    for i in range(n(20)):
+        img = createPalettedFrame(rng, (256, 192), 80)
+        img.info['transparency'] = 0
+        img.save(os.path.join(path, f'{i:04d}.png'), transparency=0)
+    return corpora
+
+def getInputPixels(path: str) -> int:
+    pixels = 0
+    for f, _ in task.scanDirectory(path, path):
+        with Image.open(f) as img:
+            pixels += img.size[0] * img.size[1] * getattr(img, 'n_frames', 1)
+    return pixels
+
+def runCorpus(inputPath: str, outputPath: str, config: param.REConfigParams, gpuIDs: tuple[int, ...], batchSize: int, verbose: bool) -> dict:
+    shutil.rmtree(outputPath, ignore_errors=True)
+    log = sys.stderr.write if verbose else lambda s: None
+    queue = task.TaskQueue()
+    tasks = (task.createTask(log, f, g, config, queue) for f, g in task.scanDirectory(inputPath, outputPath))
+    queue.extend(task.iterBatches(tasks, batchSize) if batchSize > 1 else tasks)
+    task.stageTimes.reset()
+    ts = time.perf_counter()
+    success = task.taskRunner(queue, log, lambda: None, gpuIDs)
+    te = time.perf_counter()
+    task.scratchSpace.cleanup()
+    if not success:
+        raise RuntimeError(f'benchmark run failed for {inputPath}')
+    return {'seconds': round(te - ts, 4), 'stages': task.stageTimes.getSummary()}
+
+def getCommit() -> str | None:
+    try:
+        return subprocess.run(('git', 'rev-parse', '--short', 'HEAD'), cwd=TOOLS_PATH, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compareResults(old: dict, new: dict, threshold: float) -> bool:
+    # Prints the change of every corpus and stage, returns whether nothing regressed.
+    ok = True
+    if old['settings'] != new['settings']:
+        print(f'Warning: settings differ from the compared results: {old["settings"]}', file=sys.stderr)
+    for name, result in new['corpora'].items():
+        before = old['corpora'].get(name)
+        if not before:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else math.inf
+        regressed = ratio > 1 + threshold
+        ok = ok and not regressed
+        print(f'{name}: {before["seconds"]:.3f}s -> {result["seconds"]:.3f}s ({ratio - 1:+.1%}){" REGRESSION" if regressed else ""}', file=sys.stderr)
+        for stage, x in result['stages'].items():
+            y = before['stages'].get(stage)
+            if y and y['seconds']:
+                print(f'    {stage}: {y["seconds"]:.3f}s -> {x["seconds"]:.3f}s ({x["seconds"] / y["seconds"] - 1:+.1%})', file=sys.stderr)
+    return ok
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline around the upscaler with synthetic corpora.')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file, fails on a regression')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='slowdown of a corpus that counts as a regression (default: %(default)s)')
+    parser.add_argument('-e', '--executable', default=FAKE_EXECUTABLE, help='upscaler to run (default: the stand-in next to this script)')
+    parser.add_argument('-g', '--gpu-id', default='0', help='GPU IDs of the workers, e.g. 0,1 (default: %(default)s)')
+    parser.add_argument('-b', '--batch-size', type=int, default=0, help='batch size, as in cli.py (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of every corpus, the fastest counts (default: %(default)s)')
+    parser.add_argument('--corpus-scale', type=float, default=1., help='scale the number of files and frames of every corpus (default: %(default)s)')
+    parser.add_argument('--corpus', action='append', help='only run this corpus, may be repeated')
+    parser.add_argument('--work-dir', help='folder for the corpora and outputs (default: a temporary folder)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the tasks')
+    args = parser.parse_args(argv)
+
+    # The stand-in only simulates the time of the GPU when asked to.
+    os.environ.setdefault('FAKE_REALESRGAN_TILE_SECONDS', '0')
+    os.environ.setdefault('FAKE_REALESRGAN_MEGAPIXEL_SECONDS', '0')
+    task.inferenceBackend = backend.SpawnBackend(os.path.realpath(args.executable))
+    task.stageTimes.enabled = True
+    gpuIDs = tuple(int(x) for x in args.gpu_id.split(','))
+    config = param.REConfigParams(MODEL, catalog.getModelFactor(MODEL), param.ResizeMode.RATIO, SCALE, Image.Resampling.LANCZOS, 0, gpuIDs[0], False)
+
+    workDir = args.work_dir or tempfile.mkdtemp(prefix='realesrgan-benchmark-')
+    try:
+        corpusDir = os.path.join(workDir, f'corpora-{SEED}-{args.corpus_scale}')
+        if not os.path.isdir(corpusDir):
+            corpora = createCorpora(corpusDir + '.tmp', args.corpus_scale)
+            os.replace(corpusDir + '.tmp', corpusDir)
+        corpora = {x: os.path.join(corpusDir, x) for x in sorted(os.listdir(corpusDir))}
+        results = {
+            'commit': getCommit(),
+            'time': round(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'executable': os.path.basename(args.executable),
+            'settings': {'model': MODEL, 'scale': SCALE, 'workers': len(gpuIDs), 'batchSize': args.batch_size, 'repeat': args.repeat, 'corpusScale': args.corpus_scale},
+            'corpora': {},
+        }
+        for name, path in corpora.items():
+            if args.corpus and name not in args.corpus:
+                continue
+            runs = [runCorpus(path, os.path.join(workDir, 'output', name), config, gpuIDs, args.batch_size, args.verbose) for _ in range(max(args.repeat, 1))]
+            best = min(runs, key=lambda x: x['seconds'])
+            results['corpora'][name] = {
+                'files': sum(1 for _ in task.scanDirectory(path, path)),
+                'inputMegapixels': round(getInputPixels(path) / 1e6, 3),
+                'seconds': best['seconds'],
+                'runs': [x['seconds'] for x in runs],
+                'stages': best['stages'],
+            }
+            print(f'{name}: {best["seconds"]:.3f}s (runs: {", ".join(format(x["seconds"], ".3f") for x in runs)})', file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            return 0 if compareResults(json.load(f), results, args.threshold) else 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Stand-in for realesrgan-ncnn-vulkan, for trying the front ends without a GPU, e.g.
+#   python cli.py -e tools/fake-realesrgan-ncnn-vulkan.py -i in -o out -t tuned --tune-tiles
+# Images are upscaled with nearest neighbour. The time taken is simulated from the number of
+# padded tiles, so that small tiles pay for their overhead and tiles larger than
+# FAKE_REALESRGAN_MAX_TILE fail like a GPU running out of memory.
+import math
+import os
+import sys
+import time
+from PIL import Image
+
+TILE_SECONDS = float(os.environ.get('FAKE_REALESRGAN_TILE_SECONDS', '0.002'))
+MEGAPIXEL_SECONDS = float(os.environ.get('FAKE_REALESRGAN_MEGAPIXEL_SECONDS', '0.05'))
+MAX_TILE = int(os.environ.get('FAKE_REALESRGAN_MAX_TILE', '400'))
+AUTO_TILE = 200
+PADDING = 10
+
+def parseArgs(argv: list[str]) -> dict[str, str]:
+    args = {}
+    i = 0
+    while i < len(argv):
+        if argv[i] in ('-v', '-x', ''):
+            args[argv[i]] = ''
+            i += 1
+        else:
+            args[argv[i]] = argv[i + 1]
+            i += 2
+    return args
+
+def upscale(inputPath: str, outputPath: str, scale: int, tileSize: int, tta: bool) -> None:
+    with Image.open(inputPath) as img:
+        # Like the executable, alpha is kept only if the input has it and the output can store it.
+        hasAlpha = 'A' in img.mode or 'transparency' in img.info
+        img = img.convert('RGBA' if hasAlpha and not outputPath.lower().endswith(('.jpg', '.jpeg')) else 'RGB')
+        tiles = math.ceil(img.size[0] / tileSize) * math.ceil(img.size[1] / tileSize)
+        seconds = tiles * (TILE_SECONDS + (tileSize + 2 * PADDING) ** 2 * scale ** 2 / 1e6 * MEGAPIXEL_SECONDS) * (8 if tta else 1)
+        for i in range(tiles):
+            time.sleep(seconds / tiles)
+            sys.stderr.write(f'{i / tiles * 100:.2f}%\n')
+        img.resize((img.size[0] * scale, img.size[1] * scale), Image.Resampling.NEAREST).save(outputPath)
+    sys.stderr.write(f'{inputPath} -> {outputPath} done\n')
+
+def main() -> int:
+    args = parseArgs(sys.argv[1:])
+    scale = int(args.get('-s', '4'))
+    tileSize = int(args.get('-t', '0')) or AUTO_TILE
+    if tileSize > MAX_TILE:
+        sys.stderr.write('vkAllocateMemory failed -2\n')
+        return 1
+    if os.path.isdir(args['-i']):
+        os.makedirs(args['-o'], exist_ok=True)
+        for f in sorted(os.listdir(args['-i'])):
+            upscale(os.path.join(args['-i'], f), os.path.join(args['-o'], os.path.splitext(f)[0] + '.' + args.get('-f', 'png')), scale, tileSize, '-x' in args)
+    else:
+        upscale(args['-i'], args['-o'], scale, tileSize, '-x' in args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
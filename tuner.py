@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+import time
+import typing
+
+CANDIDATES = (32, 64, 128, 256, 512, 1024)
+# Size classes by the number of input pixels of a pass, the last one has no upper bound.
+SIZE_CLASSES = (
+    ('small', 512 * 512),
+    ('medium', 2048 * 2048),
+    ('large', None),
+)
+
+class TileResult(typing.NamedTuple):
+    tileSize: int
+    seconds: float | None
+    pixelsPerSecond: float | None
+    # Why the run failed, e.g. the GPU ran out of memory, or None if it succeeded.
+    error: str | None
+
+def getSizeClass(size: tuple[int, int]) -> str:
+    for name, limit in SIZE_CLASSES:
+        if limit is None or size[0] * size[1] <= limit:
+            return name
+
+class TileProfiles:
+    # Best tile size measured for each (model, GPU, size class), stored as JSON. Profiles that
+    # were never tuned leave the choice to the executable (tile size 0).
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.profiles: dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.profiles = {}
+
+    @staticmethod
+    def getKey(model: str, gpuID: int, sizeClass: str) -> str:
+        return f'{model}/{gpuID}/{sizeClass}'
+
+    def getTileSize(self, model: str, gpuID: int, size: tuple[int, int]) -> int:
+        with self.lock:
+            profile = self.profiles.get(self.getKey(model, gpuID, getSizeClass(size)))
+        return profile['tileSize'] if profile else 0
+
+    def record(self, model: str, gpuID: int, sizeClass: str, results: list[TileResult]) -> int | None:
+        # The fastest tile size that worked wins, failures are kept to show why others lost.
+        succeeded = [x for x in results if x.error is None]
+        if not succeeded:
+            return None
+        best = max(succeeded, key=lambda x: x.pixelsPerSecond).tileSize
+        with self.lock:
+            self.profiles[self.getKey(model, gpuID, sizeClass)] = {
+                'tileSize': best,
+                'time': round(time.time()),
+                'results': [x._asdict() for x in results],
+            }
+            self.save()
+        return best
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tempPath = self.path + '.tmp'
+        with open(tempPath, 'w', encoding='utf-8') as f:
+            json.dump(self.profiles, f, indent=2)
+        os.replace(tempPath, self.path)
+
+def describeResults(results: list[TileResult]) -> str:
+    lines = []
+    for x in results:
+        if x.error is None:
+            lines.append(f'Tile size {x.tileSize}: {x.seconds:.2f}s, {x.pixelsPerSecond / 1e6:.2f}MP/s\n')
+        else:
+            lines.append(f'Tile size {x.tileSize}: {x.error}\n')
+    return ''.join(lines)
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import typing
+
+import task
+
+POLL_INTERVAL = 1.
+# Seconds the size and modification time of a file must stay the same before it is queued,
+# so that files still being copied into the folder are not read half written.
+SETTLE_SECONDS = 2.
+
+class FolderWatcher:
+    # Polls a folder for new or modified images and pushes a task for each of them once it has
+    # settled. Files found by the first poll are queued too, the caller may filter them, e.g.
+    # by the job manifest. Polling needs nothing but the standard library and works the same
+    # on local folders and network shares.
+    def __init__(
+        self,
+        inputPath: str, outputPath: str,
+        include: typing.Iterable[str] = (), exclude: typing.Iterable[str] = (),
+        settleSeconds: float = SETTLE_SECONDS,
+    ) -> None:
+        self.inputPath = inputPath
+        self.outputPath = outputPath
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.settleSeconds = settleSeconds
+        # Size and modification time of every file that was queued.
+        self.queued: dict[str, tuple[int, int]] = {}
+        # Files that changed recently: their last seen stamp and when it was first seen.
+        self.changing: dict[str, tuple[tuple[int, int], float]] = {}
+        self.stopEvent = threading.Event()
+
+    def poll(self) -> list[tuple[str, str]]:
+        now = time.monotonic()
+        ready = []
+        found = set()
+        # Outputs written into the watched folder are never picked up as inputs.
+        outputPrefix = os.path.join(self.outputPath, '')
+        for f, g in task.scanDirectory(self.inputPath, self.outputPath, self.include, self.exclude):
+            if f.startswith(outputPrefix):
+                continue
+            found.add(f)
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            stamp = (st.st_size, st.st_mtime_ns)
+            if self.queued.get(f) == stamp:
+                continue
+            last = self.changing.get(f)
+            if not last or last[0] != stamp:
+                self.changing[f] = (stamp, now)
+            elif now - last[1] >= self.settleSeconds:
+                del self.changing[f]
+                self.queued[f] = stamp
+                ready.append((f, g))
+        # A removed file is queued again if it comes back.
+        for f in self.queued.keys() - found:
+            del self.queued[f]
+        for f in self.changing.keys() - found:
+            del self.changing[f]
+        return ready
+
+    def stop(self) -> None:
+        self.stopEvent.set()
+
+    def watch(
+        self,
+        queue: task.TaskQueue,
+        createTask: typing.Callable[[str, str], task.AbstractTask | None],
+        outputCallback: typing.Callable[[str], None],
+        pollInterval: float = POLL_INTERVAL,
+    ) -> None:
+        # Runs in its own thread as a producer of the queue until it is stopped, so that the
+        # workers keep waiting for new images instead of finishing. The caller opens the
+        # producer before starting the runner.
+        try:
+            outputCallback(f'Watching {self.inputPath} for new images.\n')
+            while not self.stopEvent.is_set():
+                for f, g in self.poll():
+                    t = createTask(f, g)
+                    if t and not queue.push(t):
+                        return
+                self.stopEvent.wait(pollInterval)
+            outputCallback(f'Stopped watching {self.inputPath}.\n')
+        except Exception as ex:
+            outputCallback(f'{type(ex).__name__}: {ex} ({ex.__traceback__.tb_frame.f_code.co_filename}:{ex.__traceback__.tb_lineno})\n')
+            queue.failed = True
+        finally:
+            queue.closeProducer()